@@ -1,15 +1,2554 @@
 import cv2
 import numpy as np
-import pyautogui
-from pynput.mouse import Controller as MouseController, Button
-from pynput.keyboard import Controller as KeyboardController, Key
+import importlib
 import json
+import hashlib
+import itertools
 import time
 import os
+import sys
 import glob
+import re
+import heapq
+import threading
+import argparse
+import atexit
+import traceback
+import zlib
+import multiprocessing
+from multiprocessing import shared_memory
+from collections import namedtuple, deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import mss  # 可選：高速截圖（X11 共享記憶體）
+except ImportError:
+    mss = None
+
+class LazyImport:
+    """第一次使用時才匯入的模組（或模組中的名稱）
+    
+    偵測工作行程以 spawn 啟動時會重新匯入這個檔案，GUI 套件（pyautogui、pynput）
+    延後到真正操作滑鼠鍵盤、截圖時才匯入，工作行程不需要螢幕連線，也不用付匯入成本。
+    """
+    def __init__(self, module, attribute=None):
+        self._module = module
+        self._attribute = attribute
+        self._target = None
+    
+    def _load(self):
+        if self._target is None:
+            target = importlib.import_module(self._module)
+            self._target = getattr(target, self._attribute) if self._attribute else target
+        return self._target
+    
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._load(), name)
+    
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+pyautogui = LazyImport('pyautogui')
+MouseController = LazyImport('pynput.mouse', 'Controller')
+KeyboardController = LazyImport('pynput.keyboard', 'Controller')
+Key = LazyImport('pynput.keyboard', 'Key')
+
+# 多尺度比對使用的尺度
+OBJECT_SCALES = (0.8, 0.9, 1.0, 1.1, 1.2)  # 怪物、繩子、平台
+PLAYER_ON_ROPE_SCALES = (0.7, 0.8, 0.9, 1.0, 1.1, 1.2, 1.3)  # 角色在繩子上
+COARSE_FACTORS = (2, 4)  # 由粗到細比對時畫面與模板的縮小倍數
+
+# 常見的遊戲物件顏色範圍（HSV）- 顏色預篩選與顏色偵測測試共用
+COLOR_RANGES = {
+    '怪物紅色': {
+        'lower': np.array([0, 100, 100]),    # 紅色下限
+        'upper': np.array([10, 255, 255]),   # 紅色上限
+        'color': (0, 0, 255)  # BGR中的紅色
+    },
+    '怪物橙色': {
+        'lower': np.array([10, 100, 100]),   # 橙色下限
+        'upper': np.array([25, 255, 255]),   # 橙色上限
+        'color': (0, 165, 255)  # BGR中的橙色
+    },
+    '繩子棕色': {
+        'lower': np.array([8, 50, 50]),      # 棕色下限
+        'upper': np.array([20, 200, 200]),   # 棕色上限
+        'color': (42, 42, 165)  # BGR中的棕色
+    },
+    'HP條綠色': {
+        'lower': np.array([40, 50, 50]),     # 綠色下限
+        'upper': np.array([80, 255, 255]),   # 綠色上限
+        'color': (0, 255, 0)  # BGR中的綠色
+    },
+    '文字白色': {
+        'lower': np.array([0, 0, 200]),      # 白色下限
+        'upper': np.array([180, 30, 255]),   # 白色上限
+        'color': (255, 255, 255)  # BGR中的白色
+    }
+}
+
+# 偵測結果的物件類型（DetectionBatch 以索引儲存）
+DETECTION_TYPES = ('monsters', 'ropes', 'platforms', 'player_on_rope', 'unknown')
+
+# 錄製檔索引（index.bin）每張畫面一筆，固定大小，重播時直接 memory-map
+SESSION_INDEX_DTYPE = np.dtype([('chunk', '<u4'), ('keyframe', 'u1'), ('offset', '<u8'), ('length', '<u8'),
+                                ('tick', '<i8'), ('timestamp', '<f8'), ('origin_x', '<i4'), ('origin_y', '<i4')])
+
+# 單一尺度的模板：圖像與預先計算好的尺寸、平均值與範數（零均值後的 L2 範數）
+TemplateVariant = namedtuple('TemplateVariant', ['scale', 'image', 'width', 'height', 'mean', 'norm', 'name'],
+                             defaults=(None,))
+
+class TemplatePyramid:
+    """模板的多尺度金字塔 - 載入模板時建立一次，之後所有比對都直接使用（唯讀）"""
+    def __init__(self, template, scales, name=None):
+        self.name = name  # 模板名稱（FFT 頻譜快取的鍵）
+        variants = []
+        for scale in scales:
+            width = int(template.shape[1] * scale)
+            height = int(template.shape[0] * scale)
+            if width < 1 or height < 1:
+                continue
+            variants.append(self._make_variant(scale, cv2.resize(template, (width, height)), name))
+        self._variants = tuple(variants)
+        self._by_scale = {variant.scale: variant for variant in variants}
+        
+        # 由粗到細比對用的縮小模板（太小就無法可靠比對，直接略過）
+        self._coarse = {}
+        for factor in COARSE_FACTORS:
+            coarse_variants = {}
+            for variant in variants:
+                width = variant.width // factor
+                height = variant.height // factor
+                if width >= 4 and height >= 4:
+                    image = cv2.resize(variant.image, (width, height), interpolation=cv2.INTER_AREA)
+                    coarse_variants[variant.scale] = self._make_variant(variant.scale, image, name)
+            self._coarse[factor] = coarse_variants
+    
+    @staticmethod
+    def _make_variant(scale, image, name=None):
+        image.setflags(write=False)
+        height, width = image.shape[:2]
+        mean, std = cv2.meanStdDev(image)
+        norm = float(std[0][0]) * (width * height) ** 0.5
+        return TemplateVariant(scale, image, width, height, float(mean[0][0]), norm, name)
+    
+    def __iter__(self):
+        return iter(self._variants)
+    
+    def __len__(self):
+        return len(self._variants)
+    
+    @property
+    def variants(self):
+        return self._variants
+    
+    def get(self, scale):
+        """取得指定尺度的模板，沒有時回傳 None"""
+        return self._by_scale.get(scale)
+    
+    def coarse(self, scale, factor):
+        """取得指定尺度縮小 factor 倍的模板，太小或沒有時回傳 None"""
+        return self._coarse.get(factor, {}).get(scale)
+    
+    def max_size(self):
+        """所有尺度中最大的寬高"""
+        if not self._variants:
+            return 0
+        return max(max(variant.width, variant.height) for variant in self._variants)
+
+def _empty_peaks():
+    return (np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32))
+
+def extract_peaks(result, threshold, neighborhood):
+    """從比對分數圖取出超過閾值的局部最大值（膨脹後比較，全部向量化）"""
+    candidates = result >= threshold
+    if not candidates.any():
+        return _empty_peaks()
+    dilated = cv2.dilate(result, np.ones((neighborhood, neighborhood), np.uint8))
+    ys, xs = np.nonzero(candidates & (result >= dilated))
+    return xs, ys, result[ys, xs]
+
+def non_max_suppression(boxes, scores, iou_threshold=0.3):
+    """貪婪式非極大值抑制 - boxes 為 (x, y, w, h)，回傳保留的索引（信心度由高到低）
+    
+    每一輪保留目前最高分的框，並一次向量化移除與它重疊過多的框，
+    所以成本取決於物件數量，而不是原始峰值數量。
+    """
+    if len(scores) == 0:
+        return np.empty(0, dtype=np.intp)
+    boxes = np.asarray(boxes, dtype=np.float64)
+    x1 = boxes[:, 0]
+    y1 = boxes[:, 1]
+    x2 = x1 + boxes[:, 2]
+    y2 = y1 + boxes[:, 3]
+    areas = boxes[:, 2] * boxes[:, 3]
+    
+    order = np.argsort(-np.asarray(scores), kind='stable')
+    keep = []
+    while order.size:
+        best = order[0]
+        keep.append(best)
+        rest = order[1:]
+        overlap_w = np.clip(np.minimum(x2[best], x2[rest]) - np.maximum(x1[best], x1[rest]), 0, None)
+        overlap_h = np.clip(np.minimum(y2[best], y2[rest]) - np.maximum(y1[best], y1[rest]), 0, None)
+        intersection = overlap_w * overlap_h
+        iou = intersection / (areas[best] + areas[rest] - intersection)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.intp)
+
+def grid_neighbor_pairs(points, radius, queries=None):
+    """均勻網格（空間雜湊）找出距離不超過 radius 的所有 (查詢點, 資料點) 索引對
+    
+    格子大小等於 radius，每個查詢點只需要和自己與相鄰 8 格內的資料點比較，
+    9 個相鄰格子的查詢、點對展開與距離計算全部向量化。
+    queries 為 None 時查詢資料點本身（結果包含 i == j）。
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    queries = points if queries is None else np.asarray(queries, dtype=np.float64).reshape(-1, 2)
+    if not len(points) or not len(queries):
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    
+    origin = np.minimum(points.min(axis=0), queries.min(axis=0))
+    point_cells = np.floor((points - origin) / radius).astype(np.int64)
+    query_cells = np.floor((queries - origin) / radius).astype(np.int64)
+    # 格子編號：四周各留一格，相鄰格子的編號不會跨列重疊，也不會超出範圍
+    columns = int(max(point_cells[:, 0].max(), query_cells[:, 0].max())) + 3
+    rows = int(max(point_cells[:, 1].max(), query_cells[:, 1].max())) + 3
+    point_keys = (point_cells[:, 1] + 1) * columns + (point_cells[:, 0] + 1)
+    query_keys = (query_cells[:, 1] + 1) * columns + (query_cells[:, 0] + 1)
+    order = np.argsort(point_keys, kind='stable')
+    cell_counts = np.bincount(point_keys, minlength=rows * columns)
+    cell_starts = np.cumsum(cell_counts) - cell_counts
+    
+    # 每個查詢點的 9 個相鄰格子在排序後陣列中的範圍（查表，格子數量為 (範圍 / radius)²）
+    neighbor_offsets = np.array([dy * columns + dx for dy in (-1, 0, 1) for dx in (-1, 0, 1)])
+    targets = (query_keys[:, None] + neighbor_offsets).ravel()
+    start = cell_starts[targets]
+    lengths = cell_counts[targets]
+    
+    # 每個 (查詢點, 相鄰格子) 展開成格子內的所有候選點
+    total = int(lengths.sum())
+    pair_j = order[np.arange(total) + np.repeat(start - (np.cumsum(lengths) - lengths), lengths)]
+    pair_i = np.repeat(np.arange(len(queries)), lengths.reshape(len(queries), -1).sum(axis=1))
+    
+    dx = (queries[pair_i, 0] - points[pair_j, 0]).astype(np.float32)
+    dy = (queries[pair_i, 1] - points[pair_j, 1]).astype(np.float32)
+    close = dx * dx + dy * dy <= np.float32(radius * radius)
+    return pair_i[close], pair_j[close]
+
+class RecordAccess:
+    """_KEYS 列出的屬性支援 obj['key']、obj.get('key', 預設值)、'key' in obj 的字典式讀取（值為 None 視為沒有）"""
+    __slots__ = ()
+    _KEYS = frozenset()
+    
+    def __getitem__(self, key):
+        if key in self._KEYS:
+            value = getattr(self, key)
+            if value is not None:
+                return value
+        raise KeyError(key)
+    
+    def __contains__(self, key):
+        return key in self._KEYS and getattr(self, key) is not None
+    
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+class Detection(RecordAccess):
+    """單一偵測結果 - 使用 __slots__，不為每個結果建立 dict
+    
+    座標為螢幕座標。仍支援 obj['position']、obj.get('priority', 5) 這類字典式讀取。
+    """
+    __slots__ = ('name', 'x', 'y', 'width', 'height', 'confidence', 'scale', 'type', 'priority')
+    _KEYS = frozenset(('name', 'position', 'box', 'confidence', 'scale', 'type', 'priority'))
+    
+    def __init__(self, name, x, y, width, height, confidence, scale=1.0, object_type="unknown", priority=None):
+        self.name = name
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.confidence = confidence
+        self.scale = scale
+        self.type = object_type
+        self.priority = priority  # 沒有設定優先級的模板為 None
+    
+    @property
+    def position(self):
+        """物件中心點"""
+        return (self.x + self.width // 2, self.y + self.height // 2)
+    
+    @property
+    def box(self):
+        return (self.x, self.y, self.width, self.height)
+    
+    def __repr__(self):
+        return f"Detection({self.name!r}, box={self.box}, confidence={self.confidence:.3f}, scale={self.scale})"
+
+class DetectionBatch:
+    """偵測結果的陣列形式（structure of arrays）- 每個欄位一個 numpy 陣列
+    
+    x, y 為物件框左上角的螢幕座標。名稱與優先級依 template_id 查 names / priorities，
+    選擇目標等運算直接使用陣列；逐一取用（for obj in batch）時才建立 Detection。
+    """
+    _ARRAY_FIELDS = ('x', 'y', 'width', 'height', 'confidence', 'scale', 'template_id', 'type_code')
+    
+    def __init__(self, x, y, width, height, confidence, scale, template_id, type_code, names=(), priorities=()):
+        self.x = np.asarray(x, dtype=np.int32)
+        self.y = np.asarray(y, dtype=np.int32)
+        self.width = np.asarray(width, dtype=np.int32)
+        self.height = np.asarray(height, dtype=np.int32)
+        self.confidence = np.asarray(confidence, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+        self.template_id = np.asarray(template_id, dtype=np.int32)
+        self.type_code = np.asarray(type_code, dtype=np.int8)  # DETECTION_TYPES 的索引
+        self.names = tuple(names)  # template_id -> 名稱
+        self.priorities = np.asarray(priorities, dtype=np.float32)  # template_id -> 優先級（沒有設定為 NaN）
+    
+    @classmethod
+    def empty(cls):
+        return cls(*[()] * 8)
+    
+    @classmethod
+    def from_detections(cls, detections):
+        """從 Detection（或相同欄位的 dict）清單建立"""
+        names = []
+        priorities = []
+        template_ids = []
+        for obj in detections:
+            key = (obj['name'], obj.get('priority'))
+            if key not in names:
+                names.append(key)
+                priorities.append(np.nan if key[1] is None else key[1])
+            template_ids.append(names.index(key))
+        boxes = np.array([obj['box'] for obj in detections], dtype=np.int32).reshape(-1, 4)
+        return cls(boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3],
+                   [obj['confidence'] for obj in detections],
+                   [obj.get('scale', 1.0) for obj in detections], template_ids,
+                   [DETECTION_TYPES.index(obj.get('type', 'unknown')) for obj in detections],
+                   [name for name, _ in names], priorities)
+    
+    @classmethod
+    def concatenate(cls, batches):
+        """合併多個批次：名稱表依 (名稱, 優先級) 合併，各批次的 template_id 重新對應到合併後的表
+        
+        名稱表與優先級表長度不同（優先級表為空除外）時拋出 ValueError；
+        超出名稱表的 template_id 對應到 "unknown"。
+        """
+        batches = [batch for batch in batches if len(batch)]
+        if not batches:
+            return cls.empty()
+        if len(batches) == 1:
+            return batches[0]
+        
+        table = {}  # (名稱, 優先級) -> 合併後的 template_id（依加入順序）
+        template_ids = []
+        for batch in batches:
+            if len(batch.priorities) not in (0, len(batch.names)):
+                raise ValueError(f"名稱表與優先級表長度不同: {len(batch.names)} != {len(batch.priorities)}")
+            remap = np.empty(max(len(batch.names), int(batch.template_id.max()) + 1), np.int32)
+            for template_id in range(len(remap)):
+                name = batch.names[template_id] if template_id < len(batch.names) else "unknown"
+                priority = np.nan
+                if template_id < len(batch.priorities):
+                    priority = float(batch.priorities[template_id])
+                key = (name, None if np.isnan(priority) else priority)
+                remap[template_id] = table.setdefault(key, len(table))
+            template_ids.append(remap[batch.template_id])
+        
+        def merged(field):
+            return np.concatenate([getattr(batch, field) for batch in batches])
+        
+        return cls(merged('x'), merged('y'), merged('width'), merged('height'), merged('confidence'),
+                   merged('scale'), np.concatenate(template_ids), merged('type_code'),
+                   [name for name, _ in table], [np.nan if priority is None else priority for _, priority in table])
+    
+    def __len__(self):
+        return len(self.x)
+    
+    @property
+    def center_x(self):
+        return self.x + self.width // 2
+    
+    @property
+    def center_y(self):
+        return self.y + self.height // 2
+    
+    @property
+    def positions(self):
+        """物件中心點 (n, 2)"""
+        return np.column_stack((self.center_x, self.center_y))
+    
+    @property
+    def boxes(self):
+        """物件框 (n, 4)：x, y, w, h"""
+        return np.column_stack((self.x, self.y, self.width, self.height))
+    
+    def priority(self, default=5):
+        """每個物件的優先級（模板沒有設定時為 default）"""
+        if not len(self.priorities):
+            return np.full(len(self), default, dtype=np.float32)
+        priorities = self.priorities[self.template_id]
+        return np.where(np.isnan(priorities), default, priorities)
+    
+    def take(self, indices):
+        """取出部分物件（索引陣列或布林遮罩），回傳新的批次"""
+        # 欄位已經是正確的型別，直接設定，不經過 __init__ 的轉換
+        batch = DetectionBatch.__new__(DetectionBatch)
+        for field in self._ARRAY_FIELDS:
+            setattr(batch, field, getattr(self, field)[indices])
+        batch.names = self.names
+        batch.priorities = self.priorities
+        return batch
+    
+    def detection(self, index):
+        """取出單一物件為 Detection"""
+        template_id = self.template_id[index]
+        priority = None
+        if template_id < len(self.priorities) and not np.isnan(self.priorities[template_id]):
+            priority = self.priorities[template_id].item()
+            if priority.is_integer():
+                priority = int(priority)
+        return Detection(self.names[template_id] if template_id < len(self.names) else "unknown",
+                         int(self.x[index]), int(self.y[index]), int(self.width[index]), int(self.height[index]),
+                         float(self.confidence[index]), float(self.scale[index]),
+                         DETECTION_TYPES[self.type_code[index]], priority)
+    
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError(index)
+            return self.detection(index)
+        return self.take(index)
+    
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.detection(index)
+    
+    def __repr__(self):
+        return f"DetectionBatch({len(self)} 個物件)"
+
+class TargetArea(RecordAccess):
+    """攻擊目標（怪物群組中心或單一怪物）- 每個 tick 只建立一個，支援字典式讀取
+    
+    單一怪物也以群組方式攻擊（is_cluster 為 True，monster_count 為 1）。
+    """
+    __slots__ = ('position', 'monster_count', 'cluster_info')
+    _KEYS = frozenset(('name', 'position', 'priority', 'is_cluster', 'monster_count', 'cluster_info'))
+    priority = 10  # 群組目標給予高優先級
+    is_cluster = True
+    
+    def __init__(self, position, monster_count=1, cluster_info=None):
+        self.position = position  # 目標中心點（螢幕座標）
+        self.monster_count = monster_count
+        self.cluster_info = cluster_info  # 選中的怪物群組（單一怪物時為 None）
+    
+    @property
+    def name(self):
+        return f"群組目標({self.monster_count}隻)"
+    
+    def __repr__(self):
+        return f"TargetArea({self.name}, position={self.position})"
+
+class MonsterCluster(dict):
+    """怪物群組（dict）- 'monsters' 在第一次讀取時才從原始批次取出
+    
+    大多數情況只用到中心點與分數，不需要為每個群組建立子批次。
+    一次會建立上百個群組，因此不定義 __init__：以欄位建立 dict 後再設定
+    _source（原始批次）與 _member_indices（成員索引，或第一次讀取時才計算索引的函數）。
+    """
+    __slots__ = ('_source', '_member_indices')
+    
+    @property
+    def member_indices(self):
+        """成員在原始批次中的索引"""
+        if callable(self._member_indices):
+            self._member_indices = self._member_indices()
+        return self._member_indices
+    
+    def __missing__(self, key):
+        if key != 'monsters':
+            raise KeyError(key)
+        monsters = self._source.take(self.member_indices)
+        self['monsters'] = monsters
+        return monsters
+
+class FFTCorrelationEngine:
+    """FFT 批次相關運算 - 與 TM_CCOEFF_NORMED 結果相同（誤差在浮點容許範圍內）
+    
+    每張畫面只做一次正向 FFT 與積分圖，之後每個模板、每個尺度只需要
+    一次頻譜相乘與反向 FFT。同尺寸模板的視窗標準差也只計算一次，
+    所以模板越多（動畫影格、變體）越划算。模板頻譜依 (模板名稱, 尺度, FFT 尺寸) 快取，
+    每個頻譜和整張畫面一樣大，超過 max_bytes 時丟棄最久沒用到的。
+    """
+    def __init__(self, min_std=1e-3, max_bytes=256 * 1024 ** 2):
+        self.min_std = min_std  # 視窗幾乎是單色時分數視為 0
+        self.max_bytes = max_bytes  # 模板頻譜快取的容量上限（位元組）
+        self._template_spectra = OrderedDict()  # (模板名稱, 尺度, FFT 尺寸) -> (模板圖像, 頻譜)，依最近使用排序
+        self._spectra_bytes = 0
+    
+    def prepare(self, gray):
+        """計算畫面的頻譜與積分圖（每張畫面一次），回傳給 match() 使用的狀態"""
+        height, width = gray.shape
+        dft_height = cv2.getOptimalDFTSize(height)
+        dft_width = cv2.getOptimalDFTSize(width)
+        padded = np.zeros((dft_height, dft_width), np.float32)
+        # 先減去平均值以提高精度（模板已是零均值，不影響相關值）
+        padded[:height, :width] = gray
+        padded[:height, :width] -= float(gray.mean())
+        window_sum, window_sqsum = cv2.integral2(gray, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+        return {
+            'shape': (height, width),
+            'dft_shape': (dft_height, dft_width),
+            'spectrum': cv2.dft(padded),
+            'sum': window_sum,
+            'sqsum': window_sqsum,
+            'inv_std': {}  # (模板高, 模板寬) -> 每個視窗標準差的倒數（不含 1/n）
+        }
+    
+    def frame_state(self, frame):
+        """取得畫面的狀態（快取在 frame.derived，同一張畫面只計算一次）"""
+        state = frame.derived.get('fft')
+        if state is None:
+            state = self.prepare(frame.gray)
+            frame.derived['fft'] = state
+        return state
+    
+    def _template_spectrum(self, variant, dft_shape):
+        key = (variant.name, variant.scale, dft_shape)
+        cached = self._template_spectra.get(key)
+        # 同名模板重新載入後圖像不同，舊的頻譜不能沿用
+        if cached is not None and cached[0] is variant.image:
+            self._template_spectra.move_to_end(key)
+            return cached[1]
+        
+        padded = np.zeros(dft_shape, np.float32)
+        padded[:variant.height, :variant.width] = variant.image
+        padded[:variant.height, :variant.width] -= variant.mean
+        spectrum = cv2.dft(padded)
+        if cached is not None:
+            self._spectra_bytes -= cached[1].nbytes
+        self._template_spectra[key] = (variant.image, spectrum)
+        self._template_spectra.move_to_end(key)
+        self._spectra_bytes += spectrum.nbytes
+        while self._spectra_bytes > self.max_bytes and len(self._template_spectra) > 1:
+            _, (_, evicted) = self._template_spectra.popitem(last=False)
+            self._spectra_bytes -= evicted.nbytes
+        return spectrum
+    
+    def _inverse_window_std(self, state, template_height, template_width):
+        """每個視窗 sqrt(Σ(I - 平均)²) 的倒數，同尺寸模板共用"""
+        key = (template_height, template_width)
+        inv_std = state['inv_std'].get(key)
+        if inv_std is None:
+            s, sq = state['sum'], state['sqsum']
+            th, tw = template_height, template_width
+            window_sum = s[th:, tw:] - s[:-th, tw:] - s[th:, :-tw] + s[:-th, :-tw]
+            window_sqsum = sq[th:, tw:] - sq[:-th, tw:] - sq[th:, :-tw] + sq[:-th, :-tw]
+            variance = np.maximum(window_sqsum - window_sum * window_sum / (th * tw), 0)
+            std = np.sqrt(variance).astype(np.float32)
+            inv_std = np.zeros_like(std)
+            np.divide(1.0, std, out=inv_std, where=std > self.min_std)
+            state['inv_std'][key] = inv_std
+        return inv_std
+    
+    def match(self, state, variant):
+        """回傳與 cv2.matchTemplate(gray, variant.image, TM_CCOEFF_NORMED) 相同大小的分數圖"""
+        height, width = state['shape']
+        if variant.height > height or variant.width > width:
+            return None
+        spectrum = self._template_spectrum(variant, state['dft_shape'])
+        product = cv2.mulSpectrums(state['spectrum'], spectrum, 0, conjB=True)
+        correlation = cv2.idft(product, flags=cv2.DFT_REAL_OUTPUT | cv2.DFT_SCALE)
+        numerator = correlation[:height - variant.height + 1, :width - variant.width + 1]
+        if variant.norm <= self.min_std:
+            return np.zeros_like(numerator)
+        inv_std = self._inverse_window_std(state, variant.height, variant.width)
+        return numerator * inv_std * np.float32(1.0 / variant.norm)
+
+def match_template_variant(frame, variant, region, threshold, coarse_variant=None,
+                           coarse_factor=2, coarse_threshold_drop=0.15, fft_engine=None):
+    """在畫面區域 (x, y, w, h) 內比對單一尺度的模板
+    
+    回傳超過閾值的局部最大值 (xs, ys, scores)，座標為畫面座標（模板左上角）。
+    有 coarse_variant 時先在縮小的畫面上以較低閾值找候選位置，
+    再只在候選位置附近用原始解析度確認信心度與位置。
+    有 fft_engine 時整張畫面的比對改用 FFT 引擎。
+    """
+    region_x, region_y, region_w, region_h = region
+    if variant.width > region_w or variant.height > region_h:
+        return _empty_peaks()
+    
+    windows = [region]
+    if coarse_variant is not None:
+        candidates = coarse_candidate_windows(frame, variant, coarse_variant, region, threshold,
+                                              coarse_factor, coarse_threshold_drop)
+        if candidates is not None:
+            windows = candidates
+    
+    gray = frame.gray
+    frame_width, frame_height = frame.size
+    # 局部最大值的鄰域：模板短邊的一半（同一個物件周圍的高分點只留一個）
+    neighborhood = max(3, (min(variant.width, variant.height) // 2) | 1)
+    all_xs, all_ys, all_scores = [], [], []
+    for window_x, window_y, window_w, window_h in windows:
+        window_gray = gray[window_y:window_y + window_h, window_x:window_x + window_w]
+        if window_gray.shape[0] < variant.height or window_gray.shape[1] < variant.width:
+            continue
+        if fft_engine is not None and (window_w, window_h) == (frame_width, frame_height):
+            # FFT 引擎只用在整張畫面；小區域（差異區塊、候選視窗）直接比對較快
+            result = fft_engine.match(fft_engine.frame_state(frame), variant)
+        else:
+            result = cv2.matchTemplate(window_gray, variant.image, cv2.TM_CCOEFF_NORMED)
+        xs, ys, scores = extract_peaks(result, threshold, neighborhood)
+        if len(xs):
+            all_scores.append(scores)
+            all_xs.append(xs + window_x)
+            all_ys.append(ys + window_y)
+    
+    if not all_xs:
+        return _empty_peaks()
+    return np.concatenate(all_xs), np.concatenate(all_ys), np.concatenate(all_scores)
+
+def coarse_candidate_windows(frame, variant, coarse_variant, region, threshold, factor, threshold_drop):
+    """在縮小 factor 倍的畫面上找候選位置，回傳需要用原始解析度確認的視窗清單
+    
+    縮小後區域太小無法比對時回傳 None（改用完整比對）。
+    """
+    region_x, region_y, region_w, region_h = region
+    small = frame.downscaled(factor)
+    small_x0 = region_x // factor
+    small_y0 = region_y // factor
+    small_region = small[small_y0:(region_y + region_h) // factor, small_x0:(region_x + region_w) // factor]
+    if small_region.shape[0] < coarse_variant.height or small_region.shape[1] < coarse_variant.width:
+        return None
+    
+    coarse_result = cv2.matchTemplate(small_region, coarse_variant.image, cv2.TM_CCOEFF_NORMED)
+    candidate_mask = (coarse_result >= threshold - threshold_drop).astype(np.uint8)
+    if not candidate_mask.any():
+        return []
+    
+    # 相鄰的候選位置合併成一個視窗，每個視窗外擴 factor 像素以涵蓋縮小造成的誤差
+    count, _, stats, _ = cv2.connectedComponentsWithStats(candidate_mask, connectivity=8)
+    windows = []
+    for label in range(1, count):
+        col, row, cols, rows = stats[label][:4]
+        x0 = max(region_x, (small_x0 + col) * factor - factor)
+        y0 = max(region_y, (small_y0 + row) * factor - factor)
+        x1 = min(region_x + region_w, (small_x0 + col + cols) * factor + factor + variant.width)
+        y1 = min(region_y + region_h, (small_y0 + row + rows) * factor + factor + variant.height)
+        windows.append((int(x0), int(y0), int(x1 - x0), int(y1 - y0)))
+    return windows
+
+class ScaleCalibration:
+    """尺度自動鎖定 - 從前幾次高信心度的匹配學到每個模板的尺度，之後只搜尋該尺度
+    
+    遊戲以固定縮放比例繪製，同一個模板每次都是在同一個尺度匹配成功。
+    校正結果依「解析度 + 模板組合」保存到檔案，下次啟動直接沿用。
+    鎖定後若連續多次、且超過 miss_window 秒沒有高信心度的匹配，會做一次全尺度搜尋確認，
+    發現最佳尺度已經改變就重新校正。不論是整張畫面、差異區域或追蹤視窗的比對都算一次，
+    所以平常幾乎都是局部比對時也會觸發；誤判的代價只是多做一次全尺度搜尋。
+    """
+    def __init__(self, path='scale_calibration.json', lock_confidence=0.8, min_votes=5,
+                 miss_limit=10, miss_window=5.0, include_neighbors=True):
+        self.path = path
+        self.lock_confidence = lock_confidence  # 高於此信心度的匹配才算一票
+        self.min_votes = min_votes  # 同一尺度累積幾票後鎖定
+        self.miss_limit = miss_limit  # 連續幾次沒有高信心度匹配後重新確認
+        self.miss_window = miss_window  # 而且距離上次高信心度匹配超過幾秒
+        self.include_neighbors = include_neighbors  # 鎖定後也搜尋相鄰的尺度
+        self.key = None
+        self.locked = {}  # 模板名稱 -> 鎖定的尺度
+        self.votes = {}  # 模板名稱 -> {尺度: 票數}
+        self.misses = {}  # 模板名稱 -> 連續沒有高信心度匹配的次數
+        self.last_confident = {}  # 模板名稱 -> 上次高信心度匹配（或開始計算）的時間
+        self.probing = set()  # 下一次要做全尺度搜尋確認的模板
+    
+    def activate(self, key):
+        """切換到指定解析度與模板組合的校正資料（從檔案載入）"""
+        if key == self.key:
+            return
+        self.key = key
+        self.votes = {}
+        self.misses = {}
+        self.last_confident = {}
+        self.probing = set()
+        self.locked = dict(self._load_all().get(key, {}))
+        if self.locked:
+            print(f"載入尺度校正: {len(self.locked)} 個模板已鎖定尺度")
+    
+    def _load_all(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            print(f"⚠️  無法讀取尺度校正檔 {self.path}，重新校正")
+            return {}
+    
+    def save(self):
+        """保存目前的鎖定尺度"""
+        if self.key is None:
+            return
+        data = self._load_all()
+        data[self.key] = self.locked
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    
+    def reset(self, name=None):
+        """清除校正（name 為 None 時清除全部）"""
+        if name is None:
+            self.locked = {}
+            self.votes = {}
+        else:
+            self.locked.pop(name, None)
+            self.votes.pop(name, None)
+        self.save()
+    
+    def scales_for(self, name, scales):
+        """這次需要搜尋的尺度"""
+        scales = list(scales)
+        locked = self.locked.get(name)
+        if locked is None or name in self.probing or locked not in scales:
+            return scales
+        index = scales.index(locked)
+        if self.include_neighbors:
+            return scales[max(0, index - 1):index + 2]
+        return [locked]
+    
+    def observe(self, name, best_confidence, best_scale, lock_confidence=None, now=None):
+        """記錄這次搜尋中該模板的最佳匹配（沒有匹配時 best_scale 為 None）"""
+        if now is None:
+            now = time.time()
+        if lock_confidence is None:
+            lock_confidence = self.lock_confidence
+        confident = best_scale is not None and best_confidence >= lock_confidence
+        locked = self.locked.get(name)
+        
+        if locked is None:
+            # 校正中：累積高信心度匹配的尺度
+            if confident:
+                votes = self.votes.setdefault(name, {})
+                votes[best_scale] = votes.get(best_scale, 0) + 1
+                if votes[best_scale] >= self.min_votes:
+                    self.locked[name] = best_scale
+                    self.votes.pop(name, None)
+                    print(f"🔒 模板 {name} 鎖定尺度 {best_scale}")
+                    self.save()
+            return
+        
+        if name in self.probing:
+            # 全尺度確認的結果
+            self.probing.discard(name)
+            self.misses[name] = 0
+            self.last_confident[name] = now
+            if confident and best_scale != locked:
+                print(f"🔓 模板 {name} 最佳尺度改變 ({locked} → {best_scale})，重新校正")
+                del self.locked[name]
+                self.votes[name] = {best_scale: 1}
+                self.save()
+            return
+        
+        if confident:
+            self.misses[name] = 0
+            self.last_confident[name] = now
+            return
+        # 信心度下降：連續多次、而且一段時間都沒有高信心度匹配後做一次全尺度確認
+        self.misses[name] = self.misses.get(name, 0) + 1
+        last_confident = self.last_confident.setdefault(name, now)
+        if self.misses[name] >= self.miss_limit and now - last_confident >= self.miss_window:
+            self.probing.add(name)
+
+class Frame:
+    """單一 tick 的畫面快照 - 同一個 tick 內所有偵測器共用同一張截圖"""
+    def __init__(self, bgr, timestamp=None, index=0, origin=(0, 0), gray=None, sequence=0):
+        self._bgr = bgr  # BGR 彩色畫面（高速擷取時可能只有灰階）
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self.index = index  # 第幾個 tick
+        self.sequence = sequence  # 背景擷取的畫面序號（用來判斷是否為新畫面）
+        self.origin = origin  # 畫面左上角在螢幕上的座標（只截遊戲視窗時不為 0）
+        self._gray = gray
+        self._enhanced_gray = None
+        self._hsv = None
+        self._downscaled = {}  # 倍數 -> 縮小的灰階畫面
+        self.derived = {}  # 偵測階段的衍生資料（例如 FFT 頻譜），同一張畫面只算一次
+    
+    @classmethod
+    def from_screenshot(cls, screenshot, index=0, origin=(0, 0)):
+        """從 pyautogui 截圖建立畫面"""
+        return cls(cv2.cvtColor(np.array(screenshot), cv2.COLOR_RGB2BGR), index=index, origin=origin)
+    
+    @property
+    def bgr(self):
+        """彩色畫面（只有灰階時轉換為三通道，供 debug 標記使用）"""
+        if self._bgr is None:
+            self._bgr = cv2.cvtColor(self._gray, cv2.COLOR_GRAY2BGR)
+        return self._bgr
+    
+    @property
+    def gray(self):
+        """灰階畫面（第一次使用時才轉換，之後重複使用）"""
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self._bgr, cv2.COLOR_BGR2GRAY)
+        return self._gray
+    
+    @property
+    def enhanced_gray(self):
+        """對比度增強後的灰階畫面"""
+        if self._enhanced_gray is None:
+            if self._bgr is None:
+                # 只有灰階時直接增強灰階（結果與先增強彩色再轉灰階幾乎相同）
+                self._enhanced_gray = cv2.convertScaleAbs(self._gray, alpha=1.2, beta=10)
+            else:
+                enhanced_img = cv2.convertScaleAbs(self._bgr, alpha=1.2, beta=10)
+                self._enhanced_gray = cv2.cvtColor(enhanced_img, cv2.COLOR_BGR2GRAY)
+        return self._enhanced_gray
+    
+    def enhanced_gray_window(self, x0, y0, x1, y1):
+        """畫面局部區域的對比度增強灰階（整張已增強過時直接切出，否則只增強該區域）"""
+        if self._enhanced_gray is not None:
+            return self._enhanced_gray[y0:y1, x0:x1]
+        if self._bgr is None:
+            return cv2.convertScaleAbs(self._gray[y0:y1, x0:x1], alpha=1.2, beta=10)
+        enhanced_img = cv2.convertScaleAbs(self._bgr[y0:y1, x0:x1], alpha=1.2, beta=10)
+        return cv2.cvtColor(enhanced_img, cv2.COLOR_BGR2GRAY)
+    
+    @property
+    def has_color(self):
+        """是否有彩色畫面（高速灰階擷取時沒有）"""
+        return self._bgr is not None
+    
+    @property
+    def hsv(self):
+        """HSV 畫面（顏色偵測使用，第一次使用時才轉換）"""
+        if self._hsv is None:
+            self._hsv = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2HSV)
+        return self._hsv
+    
+    def downscaled(self, factor):
+        """縮小 factor 倍的灰階畫面（快取，同一張畫面只縮一次）"""
+        if factor not in self._downscaled:
+            width, height = self.size
+            self._downscaled[factor] = cv2.resize(self.gray, (max(1, width // factor), max(1, height // factor)),
+                                                  interpolation=cv2.INTER_AREA)
+        return self._downscaled[factor]
+    
+    @property
+    def size(self):
+        """畫面尺寸 (寬, 高)"""
+        image = self._gray if self._gray is not None else self._bgr
+        return (image.shape[1], image.shape[0])
+    
+    def to_screen(self, x, y):
+        """畫面座標轉換為螢幕座標"""
+        return (x + self.origin[0], y + self.origin[1])
+    
+    def to_local(self, x, y):
+        """螢幕座標轉換為畫面座標（用於在畫面上標記）"""
+        return (int(x - self.origin[0]), int(y - self.origin[1]))
+    
+    def copy(self):
+        """複製一張獨立的畫面（背景擷取的畫面緩衝區會被重複使用，需要保留時先複製）"""
+        return Frame(None if self._bgr is None else self._bgr.copy(), timestamp=self.timestamp,
+                     index=self.index, origin=self.origin,
+                     gray=None if self._gray is None else self._gray.copy(), sequence=self.sequence)
+    
+    def save(self, path):
+        """保存畫面到檔案"""
+        cv2.imwrite(path, self._bgr if self._bgr is not None else self._gray)
+    
+    def snapshot(self):
+        """畫面影像的複本（彩色或灰階），交給背景寫入時使用，之後緩衝區被覆蓋也不影響"""
+        return (self._bgr if self._bgr is not None else self._gray).copy()
+
+class DebugArtifactStore:
+    """debug 圖像的磁碟管理 - 總容量上限與過期刪除、不會重複的遞增檔名、相似畫面去重
+    
+    檔名為 {前綴}_{時間}_{序號}，序號接續資料夾中已有的最大序號，同一秒內的檔案不會互相覆蓋。
+    超過容量上限或保存期限時從最舊的檔案開始刪除。與同一前綴最近保存的圖像感知雜湊
+    （dHash）幾乎相同的圖像不保存。
+    """
+    SEQUENCE_PATTERN = re.compile(r'_(\d{6,})\.(?:png|jpg)$')
+    
+    def __init__(self, directory='screens', max_bytes=2 * 1024 ** 3, max_age=3 * 24 * 3600,
+                 dedup_distance=8, dedup_history=16, hash_size=16):
+        self.directory = directory
+        self.max_bytes = max_bytes  # 資料夾中 debug 圖像的總容量上限（位元組）
+        self.max_age = max_age  # 保存期限（秒），None 表示不限
+        self.dedup_distance = dedup_distance  # 感知雜湊差異位元數不超過此值視為相同畫面（None = 不去重）
+        self.dedup_history = dedup_history  # 每個前綴記住最近幾張圖像的雜湊
+        self.hash_size = hash_size  # dHash 邊長（hash_size² 位元）
+        self.files = deque()  # (修改時間, 路徑, 大小)，由舊到新
+        self.total_bytes = 0
+        self.recent_hashes = {}  # 前綴 -> 最近保存圖像的雜湊
+        self.skipped = 0  # 因為重複而沒有保存的張數
+        self.evicted = 0  # 因為容量或期限刪除的張數
+        self._sequence = itertools.count(self._scan() + 1)
+    
+    def _scan(self):
+        """載入資料夾中已有的圖像（由舊到新），回傳已使用的最大序號"""
+        if not os.path.isdir(self.directory):
+            return 0
+        existing = []
+        max_sequence = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.endswith(('.png', '.jpg')):
+                    continue
+                stat = entry.stat()
+                existing.append((stat.st_mtime, entry.path, stat.st_size))
+                match = self.SEQUENCE_PATTERN.search(entry.name)
+                if match:
+                    max_sequence = max(max_sequence, int(match.group(1)))
+        existing.sort()
+        self.files.extend(existing)
+        self.total_bytes = sum(size for _, _, size in existing)
+        return max_sequence
+    
+    def next_path(self, prefix, extension):
+        """下一個檔案路徑（序號遞增，不會覆蓋已有的檔案）"""
+        return os.path.join(self.directory,
+                            f"{prefix}_{time.strftime('%Y%m%d_%H%M%S')}_{next(self._sequence):06d}.{extension}")
+    
+    def perceptual_hash(self, image):
+        """dHash：縮小後比較相鄰像素的亮度，畫面有些微變化時結果幾乎相同"""
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        small = cv2.resize(gray, (self.hash_size + 1, self.hash_size), interpolation=cv2.INTER_AREA)
+        bits = (small[:, 1:] > small[:, :-1]).ravel()
+        return int(''.join('1' if bit else '0' for bit in bits), 2)
+    
+    def is_duplicate(self, prefix, image):
+        """和同一前綴最近保存的圖像幾乎相同時回傳 True，否則記住這張圖像的雜湊"""
+        if self.dedup_distance is None:
+            return False
+        image_hash = self.perceptual_hash(image)
+        recent = self.recent_hashes.setdefault(prefix, deque(maxlen=self.dedup_history))
+        if any(bin(image_hash ^ known).count('1') <= self.dedup_distance for known in recent):
+            self.skipped += 1
+            return True
+        recent.append(image_hash)
+        return False
+    
+    def record(self, path):
+        """登記剛寫入的檔案，超過容量或期限時刪除最舊的檔案"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        self.files.append((stat.st_mtime, path, stat.st_size))
+        self.total_bytes += stat.st_size
+        self.evict()
+    
+    def evict(self):
+        """刪除超過容量上限或保存期限的最舊檔案"""
+        now = time.time()
+        while len(self.files) > 1 and (self.total_bytes > self.max_bytes or
+                                       (self.max_age is not None and now - self.files[0][0] > self.max_age)):
+            _, path, size = self.files.popleft()
+            self.total_bytes -= size
+            try:
+                os.remove(path)
+                self.evicted += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"⚠️  無法刪除舊的 debug 圖像 {path}: {e}")
+
+class DebugImageJob:
+    """排入 DebugImageWriter 的一張圖像 - path 是預定的檔名，檔案要等 status 為 'written' 才存在
+    
+    status: 'queued'（排隊中）、'written'（已寫入）、'dropped'（佇列滿時被丟棄）、
+    'duplicate'（和上一張幾乎相同，沒有寫入）、'failed'（寫入失敗）。
+    """
+    STATUS_LABELS = {'queued': '排隊中，尚未寫入', 'written': '已寫入', 'dropped': '佇列已滿，已丟棄',
+                     'duplicate': '與上一張幾乎相同，未寫入', 'failed': '寫入失敗'}
+    __slots__ = ('path', 'status', '_done')
+    
+    def __init__(self, path):
+        self.path = path
+        self.status = 'queued'
+        self._done = threading.Event()
+    
+    def finish(self, status):
+        """背景執行緒處理完畢時設定結果"""
+        self.status = status
+        self._done.set()
+    
+    @property
+    def written(self):
+        return self.status == 'written'
+    
+    def wait(self, timeout=None):
+        """等待背景執行緒處理這張圖像，回傳是否已寫入檔案"""
+        self._done.wait(timeout)
+        return self.written
+    
+    def __str__(self):
+        return f"{self.path}（{self.STATUS_LABELS[self.status]}）"
+
+class DebugImageWriter:
+    """背景 debug 圖像寫入 - 編碼與寫檔都在背景執行緒進行，偵測迴圈不會等待硬碟
+    
+    佇列有上限，滿了就丟掉最舊的一張（debug 圖像以最新的為準）。
+    交給 submit 的影像之後不能再修改（需要時傳入 copy=True）；也可以傳入沒有參數的函數，
+    在背景執行緒寫入前才產生影像（標記圖像延後繪製，被丟棄的不會繪製）。
+    檔名、容量上限與去重由 DebugArtifactStore 管理（第一次保存時才掃描資料夾）。
+    """
+    def __init__(self, directory='screens', max_queue=8, image_format='png', png_compression=1, jpeg_quality=85,
+                 max_bytes=2 * 1024 ** 3, max_age=3 * 24 * 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes  # 資料夾容量上限（位元組），第一次保存前設定才有效
+        self.max_age = max_age  # 保存期限（秒）
+        self.store = None  # DebugArtifactStore
+        self.max_queue = max_queue  # 佇列上限（張）
+        self.image_format = image_format  # 'png'（無損）或 'jpg'（編碼最快、檔案最小）
+        self.png_compression = png_compression  # PNG 壓縮等級 0-9，越低越快（檔案越大）
+        self.jpeg_quality = jpeg_quality
+        self.submitted = 0  # 排入的張數
+        self.written = 0  # 已寫入的張數
+        self.dropped = 0  # 佇列滿時丟棄的張數
+        self._queue = deque()
+        self._busy = False  # 背景執行緒正在寫入
+        self._condition = threading.Condition()
+        self._thread = None
+    
+    def get_store(self):
+        """磁碟管理（第一次使用時掃描資料夾）"""
+        if self.store is None:
+            self.store = DebugArtifactStore(self.directory, max_bytes=self.max_bytes, max_age=self.max_age)
+        return self.store
+    
+    def submit(self, prefix, image, copy=False, dedup=True):
+        """排入一張圖像，回傳 DebugImageJob（預定的檔名由前綴、時間與序號組成，寫入後才存在）
+        
+        dedup=True 時和同一前綴最近保存的圖像幾乎相同就不寫入（手動截圖等請傳入 False）。
+        需要確定檔案已寫入時呼叫 job.wait()。
+        """
+        job = DebugImageJob(self.get_store().next_path(prefix, 'jpg' if self.image_format == 'jpg' else 'png'))
+        if copy and not callable(image):
+            image = image.copy()
+        with self._condition:
+            self.submitted += 1
+            if len(self._queue) >= self.max_queue:
+                self._queue.popleft()[0].finish('dropped')
+                self.dropped += 1
+            self._queue.append((job, image, prefix, dedup))
+            self._condition.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="DebugImageWriter", daemon=True)
+                self._thread.start()
+        return job
+    
+    def _encode_params(self, path):
+        if path.endswith('.jpg'):
+            return [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+        return [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression]
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue and self._thread is threading.current_thread():
+                    self._condition.wait()
+                if not self._queue:
+                    return
+                job, image, prefix, dedup = self._queue.popleft()
+                self._busy = True
+            path = job.path
+            try:
+                if callable(image):
+                    image = image()
+                if dedup and self.store.is_duplicate(prefix, image):
+                    job.finish('duplicate')
+                    continue
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                if not cv2.imwrite(path, image, self._encode_params(path)):
+                    raise OSError("cv2.imwrite 回傳失敗")
+                self.written += 1
+                self.store.record(path)
+                job.finish('written')
+            except Exception as e:
+                job.finish('failed')
+                print(f"⚠️  debug 圖像寫入失敗 {path}: {e}")
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+    
+    def flush(self, timeout=None):
+        """等待佇列中的圖像全部寫入，回傳是否在時間內完成"""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._queue and not self._busy, timeout)
+    
+    def close(self, timeout=5.0):
+        """寫完佇列中的圖像後停止背景執行緒"""
+        with self._condition:
+            thread = self._thread
+            self._thread = None
+            self._condition.notify_all()
+        if thread is not None:
+            thread.join(timeout)
+
+class FrameSourceExhausted(Exception):
+    """畫面來源已經沒有畫面（不循環的重播播完，或背景擷取已停止）"""
+    pass
+
+class FrameSource:
+    """畫面來源介面 - 所有偵測器都透過這裡取得畫面"""
+    live = True  # 即時畫面（可以隨時額外擷取小區域）；重播來源每次擷取都會前進一張
+    
+    def grab(self, region=None):
+        """取得下一張畫面（Frame），region=(x, y, w, h) 時只擷取該區域
+        
+        沒有畫面時（不循環的重播播完、檔案都無法讀取）拋出 FrameSourceExhausted，不會回傳 None。
+        """
+        raise NotImplementedError
+    
+    def grab_into(self, out, region=None):
+        """擷取畫面並寫入預先配置的緩衝區 out（灰階為 2 維、BGR 為 3 維），回傳畫面"""
+        frame = self.grab(region=region)
+        np.copyto(out, frame.gray if out.ndim == 2 else frame.bgr)
+        return frame
+    
+    def size(self):
+        """畫面尺寸 (寬, 高)"""
+        raise NotImplementedError
+    
+    def close(self):
+        """釋放資源"""
+        pass
+
+class ScreenFrameSource(FrameSource):
+    """即時螢幕截圖（pyautogui）"""
+    def grab(self, region=None):
+        if region is None:
+            return Frame.from_screenshot(pyautogui.screenshot())
+        return Frame.from_screenshot(pyautogui.screenshot(region=region), origin=(region[0], region[1]))
+    
+    def size(self):
+        return tuple(pyautogui.size())
+
+class ReplayFrameSource(FrameSource):
+    """重播資料夾中的 PNG 截圖（例如 screens/），用於離線測試與效能分析"""
+    live = False
+    
+    def __init__(self, directory, fps=None, pattern='*.png', loop=True):
+        self.files = sorted(glob.glob(os.path.join(directory, pattern)))
+        if not self.files:
+            raise FileNotFoundError(f"重播資料夾 {directory} 中找不到 {pattern}")
+        self.fps = fps  # None 表示不限速，盡可能快地輸出
+        self.loop = loop
+        self.position = 0
+        self._last_grab = None
+        self._size = None
+    
+    def grab(self, region=None):
+        # 依照設定的速率輸出畫面
+        if self.fps:
+            interval = 1.0 / self.fps
+            if self._last_grab is not None:
+                remaining = interval - (time.time() - self._last_grab)
+                if remaining > 0:
+                    time.sleep(remaining)
+            self._last_grab = time.time()
+        
+        # 跳過無法讀取的檔案，最多嘗試一輪
+        for _ in range(len(self.files)):
+            if self.position >= len(self.files):
+                if not self.loop:
+                    raise FrameSourceExhausted("重播畫面已播完")
+                self.position = 0
+            
+            file_path = self.files[self.position]
+            self.position += 1
+            image = cv2.imread(file_path, cv2.IMREAD_COLOR)
+            if image is not None:
+                if region is None:
+                    return Frame(image)
+                # 錄製的是整個桌面，裁切出遊戲視窗區域
+                x, y, w, h = region
+                return Frame(image[y:y + h, x:x + w], origin=(x, y))
+            print(f"  ❌ 無法讀取重播畫面: {file_path}")
+        raise FrameSourceExhausted("重播畫面都無法讀取")
+    
+    def size(self):
+        if self._size is None:
+            image = cv2.imread(self.files[0], cv2.IMREAD_COLOR)
+            self._size = (image.shape[1], image.shape[0])
+        return self._size
+
+class MSSFrameSource(FrameSource):
+    """高速截圖（mss / X11 共享記憶體）- 直接輸出灰階或 BGR 的 NumPy 畫面
+    
+    截圖結果直接轉換到預先配置的緩衝區，省去 PIL → np.array → RGB2BGR → BGR2GRAY
+    的多次整張複製。緩衝區輪流使用，回傳的畫面在之後 buffers 次擷取內保持有效。
+    預設輸出 BGR（顏色預篩選、小地圖讀取需要彩色）；只做模板比對時可選擇 'gray'。
+    """
+    def __init__(self, mode='bgr', buffers=2):
+        if mss is None:
+            raise ImportError("需要安裝 mss 套件: pip install mss")
+        self.mode = mode  # 'bgr' 或 'gray'（較快，但沒有彩色畫面）
+        self.buffer_count = buffers
+        self._buffers = {}  # (寬, 高) -> 預先配置的緩衝區
+        self._next_buffer = 0
+        self._local = threading.local()  # mss 物件不能跨執行緒使用
+    
+    def _grabber(self):
+        if getattr(self._local, 'sct', None) is None:
+            self._local.sct = mss.mss()
+        return self._local.sct
+    
+    def _buffer_for(self, width, height):
+        """取得可重複使用的輸出緩衝區"""
+        key = (width, height)
+        if key not in self._buffers:
+            shape = (height, width) if self.mode == 'gray' else (height, width, 3)
+            self._buffers[key] = [np.empty(shape, dtype=np.uint8) for _ in range(self.buffer_count)]
+        buffers = self._buffers[key]
+        self._next_buffer = (self._next_buffer + 1) % len(buffers)
+        return buffers[self._next_buffer]
+    
+    def grab(self, region=None, out=None):
+        sct = self._grabber()
+        if region is None:
+            monitor = sct.monitors[1]  # 主螢幕
+            origin = (0, 0)
+        else:
+            x, y, w, h = region
+            monitor = {'left': x, 'top': y, 'width': w, 'height': h}
+            origin = (x, y)
+        
+        shot = sct.grab(monitor)
+        raw = np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+        if out is None:
+            out = self._buffer_for(shot.width, shot.height)
+        
+        # BGRA 一次轉換到目標緩衝區
+        if self.mode == 'gray':
+            cv2.cvtColor(raw, cv2.COLOR_BGRA2GRAY, dst=out)
+            return Frame(None, origin=origin, gray=out)
+        cv2.cvtColor(raw, cv2.COLOR_BGRA2BGR, dst=out)
+        return Frame(out, origin=origin)
+    
+    def grab_into(self, out, region=None):
+        if (out.ndim == 2) != (self.mode == 'gray'):
+            return super().grab_into(out, region=region)
+        return self.grab(region=region, out=out)
+    
+    def size(self):
+        monitor = self._grabber().monitors[1]
+        return (monitor['width'], monitor['height'])
+    
+    def close(self):
+        sct = getattr(self._local, 'sct', None)
+        if sct is not None:
+            sct.close()
+            self._local.sct = None
+
+class SessionRecorder:
+    """畫面錄製 - 畫面依序附加到分段檔（chunk_*.bin），每張畫面在 index.bin 記一筆索引
+    
+    compression:
+      'delta' - 與前一張的差值（uint8 環繞相減）再 zlib 壓縮，每 keyframe_interval 張一張完整畫面（無損）
+      'zlib'  - 每張完整畫面各自 zlib 壓縮（無損）
+      'raw'   - 不壓縮，重播時可直接使用 memory-map 的畫面（不複製）
+    session.json 記錄壓縮方式與每個分段的畫面大小；畫面大小改變時自動開始新的分段。
+    
+    append 只複製畫面並排入佇列，壓縮與寫檔都在背景執行緒進行，控制迴圈不等待硬碟；
+    佇列滿時丟掉最舊的一張（錄製檔的 tick 編號會跳號，delta 一律相對於實際寫入的上一張）。
+    """
+    def __init__(self, directory, compression='delta', chunk_frames=300, keyframe_interval=30, level=1,
+                 max_queue=16):
+        if compression not in ('delta', 'zlib', 'raw'):
+            raise ValueError(f"不支援的壓縮方式: {compression}")
+        self.directory = directory
+        self.compression = compression
+        self.chunk_frames = chunk_frames  # 每個分段檔的畫面數
+        self.keyframe_interval = keyframe_interval  # delta 模式下每幾張存一張完整畫面
+        self.level = level  # zlib 壓縮等級（1 最快）
+        self.max_queue = max_queue  # 等待寫入的畫面上限（張）
+        self.chunks = []  # 每個分段的 {'file': 檔名, 'shape': 畫面形狀}
+        self.frames = 0  # 已錄製的畫面數
+        self.dropped = 0  # 佇列滿時丟棄的畫面數
+        self.bytes_written = 0
+        self._chunk_file = None
+        self._chunk_offset = 0
+        self._chunk_count = 0  # 目前分段中的畫面數
+        self._previous = None  # 上一張寫入的畫面（delta 模式）
+        os.makedirs(directory, exist_ok=True)
+        self._index_file = open(os.path.join(directory, 'index.bin'), 'wb')
+        self._write_metadata()
+        self._queue = deque()
+        self._busy = False  # 背景執行緒正在寫入
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="SessionRecorder", daemon=True)
+        self._thread.start()
+    
+    def _write_metadata(self):
+        with open(os.path.join(self.directory, 'session.json'), 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'compression': self.compression, 'chunks': self.chunks}, f, indent=2)
+    
+    def _start_chunk(self, shape):
+        if self._chunk_file is not None:
+            self._chunk_file.close()
+        name = f"chunk_{len(self.chunks):05d}.bin"
+        self.chunks.append({'file': name, 'shape': list(shape)})
+        self._write_metadata()  # 先寫入分段資訊，錄製中斷時已寫入的畫面仍然可以讀取
+        self._chunk_file = open(os.path.join(self.directory, name), 'wb')
+        self._chunk_offset = 0
+        self._chunk_count = 0
+        self._previous = None
+        self._index_file.flush()
+    
+    def append(self, frame):
+        """把一張畫面（彩色或灰階，依畫面本身）排入背景錄製"""
+        image = frame.bgr if frame.has_color else frame.gray
+        item = (image.copy(), frame.index, frame.timestamp, frame.origin)  # 擷取緩衝區會被重複使用
+        with self._condition:
+            if len(self._queue) >= self.max_queue:
+                self._queue.popleft()
+                self.dropped += 1
+            self._queue.append(item)
+            self._condition.notify()
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue and self._thread is threading.current_thread():
+                    self._condition.wait()
+                if not self._queue:
+                    return
+                item = self._queue.popleft()
+                self._busy = True
+            try:
+                self._write(*item)
+            except Exception as e:
+                print(f"⚠️  錄製寫入失敗: {e}")
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+    
+    def _write(self, image, tick, timestamp, origin):
+        """壓縮並寫入一張畫面與它的索引（背景執行緒）"""
+        if (self._chunk_file is None or self._chunk_count >= self.chunk_frames
+                or list(image.shape) != self.chunks[-1]['shape']):
+            self._start_chunk(image.shape)
+        
+        keyframe = (self.compression != 'delta' or self._previous is None
+                    or self._chunk_count % self.keyframe_interval == 0)
+        if self.compression == 'raw':
+            payload = np.ascontiguousarray(image).data
+        elif keyframe:
+            payload = zlib.compress(np.ascontiguousarray(image), self.level)
+        else:
+            payload = zlib.compress(np.subtract(image, self._previous, dtype=np.uint8), self.level)
+        if self.compression == 'delta':
+            self._previous = image  # append 已經複製過，之後不會再被修改
+        
+        self._chunk_file.write(payload)
+        length = len(payload) if self.compression != 'raw' else image.nbytes
+        entry = np.array([(len(self.chunks) - 1, keyframe, self._chunk_offset, length, tick,
+                           timestamp, origin[0], origin[1])], dtype=SESSION_INDEX_DTYPE)
+        self._index_file.write(entry.tobytes())
+        self._chunk_offset += length
+        self._chunk_count += 1
+        self.frames += 1
+        self.bytes_written += length
+    
+    def flush(self, timeout=None):
+        """等待佇列中的畫面全部寫入，回傳是否在時間內完成"""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._queue and not self._busy, timeout)
+    
+    def close(self, timeout=None):
+        """寫完佇列中的畫面後停止背景執行緒並關閉檔案"""
+        with self._condition:
+            thread = self._thread
+            self._thread = None
+            self._condition.notify_all()
+        if thread is not None:
+            thread.join(timeout)
+            if thread.is_alive():
+                print("⚠️  錄製寫入逾時，佇列中的畫面沒有全部寫入")
+                return
+        if self._chunk_file is not None:
+            self._chunk_file.close()
+            self._chunk_file = None
+        if not self._index_file.closed:
+            self._index_file.close()
+            self._write_metadata()
+
+class SessionReader:
+    """讀取錄製的畫面 - 分段檔與索引都 memory-map，可以直接跳到任一個 tick
+    
+    'raw' 錄製的畫面是 memory-map 的唯讀視圖（不複製）；壓縮的畫面解壓一次，
+    delta 模式從最近的完整畫面往後逐張還原（不遞迴），依序讀取時每張只需要一次解壓與相加。
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'session.json'), 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+        self.compression = metadata['compression']
+        self.chunks = metadata['chunks']
+        index_path = os.path.join(directory, 'index.bin')
+        count = os.path.getsize(index_path) // SESSION_INDEX_DTYPE.itemsize  # 錄製中斷時忽略不完整的最後一筆
+        self.index = (np.memmap(index_path, dtype=SESSION_INDEX_DTYPE, mode='r', shape=(count,)) if count
+                      else np.empty(0, dtype=SESSION_INDEX_DTYPE))
+        self._maps = {}  # 分段編號 -> memory-map
+        self._decoded = (-1, None)  # (位置, 畫面)：delta 模式依序讀取時使用
+    
+    def __len__(self):
+        return len(self.index)
+    
+    @property
+    def ticks(self):
+        """每張畫面的 tick 編號"""
+        return self.index['tick']
+    
+    def position_of(self, tick):
+        """第一張 tick 編號 >= tick 的畫面位置（tick 依錄製順序遞增）"""
+        return int(np.searchsorted(self.ticks, tick))
+    
+    def _chunk(self, chunk):
+        if chunk not in self._maps:
+            path = os.path.join(self.directory, self.chunks[chunk]['file'])
+            self._maps[chunk] = np.memmap(path, dtype=np.uint8, mode='r')
+        return self._maps[chunk]
+    
+    def _payload(self, position):
+        entry = self.index[position]
+        offset = int(entry['offset'])
+        return self._chunk(int(entry['chunk']))[offset:offset + int(entry['length'])]
+    
+    def image_at(self, position):
+        """第 position 張畫面的影像（NumPy 陣列）"""
+        entry = self.index[position]
+        shape = tuple(self.chunks[int(entry['chunk'])]['shape'])
+        if self.compression == 'raw':
+            return self._payload(position).reshape(shape)
+        if self.compression == 'zlib' or entry['keyframe']:
+            image = np.frombuffer(zlib.decompress(self._payload(position)), dtype=np.uint8).reshape(shape)
+        else:
+            # 從最近的完整畫面（或剛還原過、位置更近的畫面）往後逐張加上差值
+            last_position, last_image = self._decoded
+            start = position
+            while not self.index[start]['keyframe'] and start - 1 != last_position:
+                start -= 1
+            if self.index[start]['keyframe']:
+                image = np.frombuffer(zlib.decompress(self._payload(start)), dtype=np.uint8).reshape(shape)
+                start += 1
+            else:
+                image = last_image
+            for current in range(start, position + 1):
+                delta = np.frombuffer(zlib.decompress(self._payload(current)), dtype=np.uint8).reshape(shape)
+                image = np.add(image, delta)
+        self._decoded = (position, image)
+        return image
+    
+    def frame_at(self, position):
+        """第 position 張畫面（Frame，保留錄製時的 tick、時間與原點）"""
+        entry = self.index[position]
+        image = self.image_at(position)
+        origin = (int(entry['origin_x']), int(entry['origin_y']))
+        if image.ndim == 2:
+            return Frame(None, timestamp=float(entry['timestamp']), index=int(entry['tick']), origin=origin, gray=image)
+        return Frame(image, timestamp=float(entry['timestamp']), index=int(entry['tick']), origin=origin)
+    
+    def frames(self, start_tick=None):
+        """從 start_tick（不指定時從頭）開始依序產生畫面"""
+        start = 0 if start_tick is None else self.position_of(start_tick)
+        for position in range(start, len(self)):
+            yield self.frame_at(position)
+
+class SessionFrameSource(FrameSource):
+    """重播錄製檔（SessionRecorder 的格式），可從指定的 tick 開始"""
+    live = False
+    
+    def __init__(self, directory, fps=None, start_tick=None, loop=True):
+        self.reader = SessionReader(directory)
+        if not len(self.reader):
+            raise FileNotFoundError(f"錄製檔 {directory} 中沒有畫面")
+        self.fps = fps  # None 表示不限速，盡可能快地輸出
+        self.loop = loop
+        self.position = 0 if start_tick is None else min(self.reader.position_of(start_tick), len(self.reader) - 1)
+        self._last_grab = None
+    
+    def seek(self, tick):
+        """跳到第一張 tick 編號 >= tick 的畫面"""
+        self.position = self.reader.position_of(tick)
+    
+    def grab(self, region=None):
+        # 依照設定的速率輸出畫面
+        if self.fps:
+            interval = 1.0 / self.fps
+            if self._last_grab is not None:
+                remaining = interval - (time.time() - self._last_grab)
+                if remaining > 0:
+                    time.sleep(remaining)
+            self._last_grab = time.time()
+        
+        if self.position >= len(self.reader):
+            if not self.loop:
+                raise FrameSourceExhausted("錄製檔已播完")
+            self.position = 0
+        frame = self.reader.frame_at(self.position)
+        self.position += 1
+        if region is None:
+            return frame
+        
+        # 錄製範圍大於要求的區域時裁切（座標換算成錄製畫面內的位置）
+        x, y = frame.to_local(region[0], region[1])
+        width, height = frame.size
+        if x < 0 or y < 0 or x + region[2] > width or y + region[3] > height:
+            return frame
+        image = frame.bgr if frame.has_color else frame.gray
+        cropped = image[y:y + region[3], x:x + region[2]]
+        if cropped.ndim == 2:
+            return Frame(None, timestamp=frame.timestamp, index=frame.index, origin=(region[0], region[1]), gray=cropped)
+        return Frame(cropped, timestamp=frame.timestamp, index=frame.index, origin=(region[0], region[1]))
+    
+    def size(self):
+        shape = self.reader.chunks[0]['shape']
+        return (shape[1], shape[0])
+
+class DirtyRegionTracker:
+    """區塊式畫面差異偵測 - 在縮小的灰階畫面上比較，找出有變化的區塊
+    
+    每種偵測（key）各自記住上一次偵測時的畫面，因為同一個 tick 內
+    怪物、繩子、平台的偵測都是跟各自上一次的結果比較。
+    """
+    def __init__(self, tile_size=64, downscale=4, diff_threshold=8):
+        self.tile_size = tile_size  # 區塊大小（原始畫面像素）
+        self.downscale = downscale  # 比較前先縮小的倍數
+        self.diff_threshold = diff_threshold  # 灰階差異超過此值視為有變化
+        self._previous = {}  # key -> (縮小畫面, 畫面原點)
+    
+    def reset(self):
+        self._previous.clear()
+    
+    def changed_tiles(self, frame, key):
+        """回傳每個區塊是否有變化的布林陣列；沒有可比較的上一張畫面時回傳 None"""
+        small = frame.downscaled(self.downscale)
+        previous = self._previous.get(key)
+        self._previous[key] = (small, frame.origin)
+        if previous is None:
+            return None
+        previous_small, previous_origin = previous
+        if previous_small.shape != small.shape or previous_origin != frame.origin:
+            return None
+        
+        diff = cv2.absdiff(small, previous_small)
+        
+        # 補齊成整數個區塊後，取每個區塊的最大差異
+        tile = max(1, self.tile_size // self.downscale)
+        rows = -(-diff.shape[0] // tile)
+        cols = -(-diff.shape[1] // tile)
+        padded = np.zeros((rows * tile, cols * tile), dtype=diff.dtype)
+        padded[:diff.shape[0], :diff.shape[1]] = diff
+        tile_max = padded.reshape(rows, tile, cols, tile).max(axis=(1, 3))
+        return tile_max > self.diff_threshold
+    
+    def dirty_regions(self, dirty_tiles, frame_size, margin):
+        """把有變化的區塊轉換為搜尋區域 (x, y, w, h)，每塊外擴 margin 像素
+        
+        外擴後相連的區塊合併成一個矩形，碰到變化區塊的物件一定完整落在某個矩形內。
+        """
+        frame_width, frame_height = frame_size
+        margin_tiles = -(-margin // self.tile_size)
+        kernel = np.ones((2 * margin_tiles + 1, 2 * margin_tiles + 1), np.uint8)
+        expanded = cv2.dilate(dirty_tiles.astype(np.uint8), kernel)
+        
+        count, _, stats, _ = cv2.connectedComponentsWithStats(expanded, connectivity=8)
+        regions = []
+        for label in range(1, count):
+            col, row, cols, rows = stats[label][:4]
+            x = col * self.tile_size
+            y = row * self.tile_size
+            w = min(cols * self.tile_size, frame_width - x)
+            h = min(rows * self.tile_size, frame_height - y)
+            if w > 0 and h > 0:
+                regions.append((int(x), int(y), int(w), int(h)))
+        return regions
+
+class ColorCandidateFilter:
+    """HSV 顏色預篩選 - 用顏色遮罩找出可能有物件的區域，模板比對只在這些區域內執行"""
+    def __init__(self, min_area=100):
+        self.min_area = min_area  # 小於此面積的色塊視為雜訊
+        self.kernel = np.ones((3, 3), np.uint8)
+    
+    def color_mask(self, frame, color_names):
+        """指定顏色（COLOR_RANGES 中的名稱）合併後的遮罩"""
+        hsv = frame.hsv
+        mask = None
+        for color_name in color_names:
+            color_range = COLOR_RANGES[color_name]
+            color_mask = cv2.inRange(hsv, color_range['lower'], color_range['upper'])
+            mask = color_mask if mask is None else cv2.bitwise_or(mask, color_mask)
+        # 形態學操作來清理遮罩
+        return cv2.morphologyEx(mask, cv2.MORPH_OPEN, self.kernel)
+    
+    def candidate_regions(self, frame, color_names, padding):
+        """回傳候選區域 (x, y, w, h) 清單（畫面座標），每個色塊外擴 padding 後合併重疊的區域
+        
+        畫面沒有顏色資訊時回傳 None（無法預篩選）。
+        """
+        if not frame.has_color or not color_names:
+            return None
+        mask = self.color_mask(frame, color_names)
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        blobs = stats[1:count]
+        blobs = blobs[blobs[:, cv2.CC_STAT_AREA] >= self.min_area]
+        if not len(blobs):
+            return []
+        
+        # 外擴後畫在同一張遮罩上，重疊的候選框自然合併成一個區域
+        merged = np.zeros(mask.shape, np.uint8)
+        for x, y, width, height in blobs[:, :4]:
+            cv2.rectangle(merged, (int(x) - padding, int(y) - padding),
+                          (int(x + width) + padding - 1, int(y + height) + padding - 1), 255, -1)
+        count, _, stats, _ = cv2.connectedComponentsWithStats(merged, connectivity=8)
+        return [tuple(int(value) for value in stats[label][:4]) for label in range(1, count)]
+
+def closest_fingerprint(fingerprint, known, max_distance):
+    """known 中與 fingerprint 相同或漢明距離在 max_distance 位元以內最接近的指紋，沒有時回傳 None"""
+    if fingerprint in known:
+        return fingerprint
+    value = int(fingerprint, 16)
+    best, best_distance = None, max_distance + 1
+    for candidate in known:
+        distance = bin(value ^ int(candidate, 16)).count('1')
+        if distance < best_distance:
+            best, best_distance = candidate, distance
+    return best
+
+class MinimapReader:
+    """小地圖讀取 - 小地圖位置只定位一次，之後只在這個小區域用顏色門檻找玩家標記
+    
+    玩家位置以小地圖座標（小地圖左上角為原點的像素）表示；
+    換算成螢幕座標時假設鏡頭跟著玩家，到地圖邊緣時停住。
+    """
+    def __init__(self, player_lower=(20, 120, 180), player_upper=(35, 255, 255), min_marker_area=2):
+        self.player_lower = np.array(player_lower, dtype=np.uint8)  # 玩家標記（黃點）的 HSV 下限
+        self.player_upper = np.array(player_upper, dtype=np.uint8)  # 玩家標記的 HSV 上限
+        self.min_marker_area = min_marker_area  # 標記最少的像素數（過濾雜點）
+        self.region = None  # 小地圖在螢幕上的區域 (x, y, w, h)
+        self.position = None  # 最近一次讀到的玩家位置（小地圖座標）
+        self.timestamp = 0  # 最近一次讀取的時間
+    
+    def locate(self, frame, corner_templates, size, threshold=0.8):
+        """用小地圖邊角模板定位小地圖（螢幕座標），右下角模板可選，沒有時使用 size"""
+        if 'tl' not in corner_templates:
+            return None
+        
+        top_left = corner_templates['tl']
+        result = cv2.matchTemplate(frame.gray, top_left, cv2.TM_CCOEFF_NORMED)
+        _, tl_confidence, _, (x, y) = cv2.minMaxLoc(result)
+        if tl_confidence < threshold:
+            print(f"⚠️  無法定位小地圖 (信心度: {tl_confidence:.2f})")
+            return None
+        
+        width, height = size
+        if 'br' in corner_templates:
+            bottom_right = corner_templates['br']
+            result = cv2.matchTemplate(frame.gray[y:, x:], bottom_right, cv2.TM_CCOEFF_NORMED)
+            _, br_confidence, _, br_loc = cv2.minMaxLoc(result)
+            if br_confidence >= threshold:
+                width = br_loc[0] + bottom_right.shape[1]
+                height = br_loc[1] + bottom_right.shape[0]
+        
+        self.region = frame.to_screen(x, y) + (width, height)
+        return self.region
+    
+    def roi(self, frame):
+        """畫面中的小地圖部分（BGR），小地圖不完整在畫面內或畫面沒有彩色時回傳 None"""
+        if self.region is None or not frame.has_color:
+            return None
+        x, y = frame.to_local(self.region[0], self.region[1])
+        width, height = self.region[2], self.region[3]
+        frame_width, frame_height = frame.size
+        if x < 0 or y < 0 or x + width > frame_width or y + height > frame_height:
+            return None
+        return frame.bgr[y:y + height, x:x + width]
+    
+    def read(self, frame):
+        """從畫面中的小地圖讀取玩家標記位置（小地圖座標），找不到時回傳 None（position 也清除）"""
+        image = self.roi(frame)
+        if image is None:
+            return None
+        
+        mask = cv2.inRange(cv2.cvtColor(image, cv2.COLOR_BGR2HSV), self.player_lower, self.player_upper)
+        count, _, stats, centroids = cv2.connectedComponentsWithStats(mask)
+        # 最大的符合顏色區塊就是玩家標記（0 是背景）；找不到時清除舊位置，不讓呼叫端沿用過期的位置
+        self.position = None
+        self.timestamp = frame.timestamp
+        if count < 2:
+            return None
+        largest = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+        if stats[largest, cv2.CC_STAT_AREA] < self.min_marker_area:
+            return None
+        
+        self.position = (float(centroids[largest][0]), float(centroids[largest][1]))
+        return self.position
+    
+    def fingerprint(self, frame, size=16, saturation_limit=150):
+        """小地圖的平均雜湊（size × size 位元的十六進位字串）- 用來辨識目前在哪張地圖
+        
+        高飽和度的像素（玩家、其他玩家、NPC 的標記點）不算在內，只留下地形。
+        """
+        image = self.roi(frame)
+        if image is None:
+            return None
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        gray[hsv[:, :, 1] > saturation_limit] = 0
+        small = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA)
+        bits = (small > small.mean()).ravel()
+        return f"{int(''.join('1' if bit else '0' for bit in bits), 2):0{size * size // 4}x}"
+    
+    def camera_offset(self, player_position, view_size, scale):
+        """鏡頭左上角的地圖座標（遊戲畫面像素）：以玩家為中心，到地圖邊緣時停住"""
+        offsets = []
+        for axis in (0, 1):
+            map_length = self.region[2 + axis] * scale
+            offset = player_position[axis] * scale - view_size[axis] / 2
+            offsets.append(max(0.0, min(offset, map_length - view_size[axis])) if map_length > view_size[axis] else 0.0)
+        return offsets
+    
+    def to_screen(self, map_position, player_position, view_origin, view_size, scale):
+        """小地圖座標換算成螢幕座標（scale = 1 個小地圖像素對應的遊戲畫面像素）"""
+        offset_x, offset_y = self.camera_offset(player_position, view_size, scale)
+        return (int(view_origin[0] + map_position[0] * scale - offset_x),
+                int(view_origin[1] + map_position[1] * scale - offset_y))
+    
+    def view_box(self, player_position, view_size, scale):
+        """遊戲畫面目前涵蓋的地圖範圍 (x0, y0, x1, y1)（小地圖座標）"""
+        offset_x, offset_y = self.camera_offset(player_position, view_size, scale)
+        return (offset_x / scale, offset_y / scale, (offset_x + view_size[0]) / scale, (offset_y + view_size[1]) / scale)
+    
+    def to_map(self, screen_position, player_position, view_origin, view_size, scale):
+        """螢幕座標換算成小地圖座標"""
+        offset_x, offset_y = self.camera_offset(player_position, view_size, scale)
+        return ((screen_position[0] - view_origin[0] + offset_x) / scale,
+                (screen_position[1] - view_origin[1] + offset_y) / scale)
+
+class MinimapCalibration:
+    """小地圖校正 - 每張地圖的比例（1 個小地圖像素對應的遊戲畫面像素）與每個解析度的小地圖大小，保存到檔案
+    
+    比例從鏡頭捲動估算：玩家在小地圖上水平移動 Δm 時，畫面上靜止的繩子、平台往反方向移動 Δm × 比例。
+    每兩次直接比對得到一個估計值，累積 min_samples 個後取中位數鎖定，下次啟動直接沿用。
+    鏡頭在地圖邊緣停住時物件不動，這種估計值落在 scale_range 之外會被忽略。
+    """
+    def __init__(self, path='minimap_calibration.json', min_samples=5, min_motion=2.0,
+                 scale_range=(4.0, 40.0), tolerance=0.1, max_distance=16):
+        self.path = path
+        self.min_samples = min_samples  # 累積幾個估計值後鎖定
+        self.min_motion = min_motion  # 玩家在小地圖上至少水平移動幾個像素才估計
+        self.scale_range = scale_range  # 合理的比例範圍
+        self.tolerance = tolerance  # 同一次估計中各物件的比例相對誤差在此以內視為一致
+        self.max_distance = max_distance  # 指紋漢明距離在此以內視為同一張地圖
+        data = self._load_all()
+        self.scales = data.get('scales', {})  # 地圖指紋 -> 鎖定的比例
+        self.sizes = data.get('sizes', {})  # 解析度 -> 小地圖大小 [w, h]
+        self.samples = {}  # 地圖指紋 -> [比例估計值]
+        self.last_observations = {}  # 物件類型 -> (地圖指紋, 玩家小地圖位置, 物件名稱, 物件 x)
+    
+    def _load_all(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            print(f"⚠️  無法讀取小地圖校正檔 {self.path}，重新校正")
+            return {}
+    
+    def save(self):
+        """保存所有地圖的比例與小地圖大小"""
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({'scales': self.scales, 'sizes': self.sizes}, f, ensure_ascii=False, indent=2)
+    
+    def scale_for(self, fingerprint):
+        """地圖已鎖定的比例，還沒校正時回傳 None"""
+        known = closest_fingerprint(fingerprint, self.scales, self.max_distance)
+        return self.scales[known] if known is not None else None
+    
+    def size_for(self, resolution):
+        """這個解析度保存的小地圖大小 (w, h)，沒有時回傳 None"""
+        size = self.sizes.get(resolution)
+        return tuple(size) if size is not None else None
+    
+    def store_size(self, resolution, size):
+        """保存這個解析度的小地圖大小"""
+        size = [int(size[0]), int(size[1])]
+        if self.sizes.get(resolution) != size:
+            self.sizes[resolution] = size
+            self.save()
+    
+    def reset(self, fingerprint=None):
+        """清除比例校正（fingerprint 為 None 時清除所有地圖）"""
+        if fingerprint is None:
+            self.scales = {}
+        else:
+            self.scales.pop(closest_fingerprint(fingerprint, self.scales, self.max_distance), None)
+        self.samples = {}
+        self.last_observations = {}
+        self.save()
+    
+    def observe(self, fingerprint, kind, player_map, objects):
+        """記錄一次直接比對的靜止物件（螢幕座標）與當時的玩家位置，比例鎖定時回傳比例，否則回傳 None"""
+        names = [objects.names[i] for i in objects.template_id]
+        previous = self.last_observations.get(kind)
+        self.last_observations[kind] = (fingerprint, player_map, names, objects.x.astype(np.float64))
+        if previous is None or closest_fingerprint(fingerprint, [previous[0]], self.max_distance) is None:
+            return None
+        motion = player_map[0] - previous[1][0]
+        if abs(motion) < self.min_motion:
+            return None
+        
+        # 同名物件兩兩配對，正確的配對會得到一致的比例；取最多估計值落在 tolerance 以內的一群
+        estimates = [(previous_x - x) / motion
+                     for name, x in zip(names, objects.x)
+                     for previous_name, previous_x in zip(previous[2], previous[3]) if name == previous_name]
+        estimates = np.array([value for value in estimates if self.scale_range[0] <= value <= self.scale_range[1]])
+        if len(estimates) == 0:
+            return None
+        values = np.sort(np.log(estimates))
+        ends = np.searchsorted(values, values + np.log1p(self.tolerance), side='right')
+        best = int(np.argmax(ends - np.arange(len(values))))
+        estimate = float(np.exp(np.median(values[best:ends[best]])))
+        
+        known = closest_fingerprint(fingerprint, self.samples, self.max_distance) or fingerprint
+        samples = self.samples.setdefault(known, [])
+        samples.append(estimate)
+        if len(samples) < self.min_samples:
+            return None
+        scale = round(float(np.median(samples)), 3)
+        self.scales[known] = scale
+        del self.samples[known]
+        self.save()
+        print(f"🔒 小地圖比例鎖定: 1 個小地圖像素 = {scale} 個遊戲畫面像素")
+        return scale
+
+class MapGeometryCache:
+    """地圖靜態物件快取 - 繩子、平台在同一張地圖內不會移動，依地圖指紋保存位置（小地圖座標）
+    
+    每次比對只看得到畫面範圍內的物件，所以同時記錄比對過的範圍（cell × cell 小地圖像素的格子）；
+    畫面移到還沒比對過的範圍時再比對一次，結果合併進已保存的物件（位置相近的同名物件視為同一個），
+    之後（包含下次啟動）直接換算成螢幕座標使用。
+    指紋漢明距離在 max_distance 位元以內視為同一張地圖（小地圖有少量雜訊）。
+    檔案在背景執行緒寫入，save_delay 秒內的多次更新只寫一次。
+    """
+    def __init__(self, path='map_geometry.json', max_distance=16, cell=4, merge_distance=1.5, save_delay=1.0):
+        self.path = path
+        self.max_distance = max_distance
+        self.cell = cell  # 記錄比對範圍的格子大小（小地圖像素）
+        self.merge_distance = merge_distance  # 同名物件位置相差在此以內（小地圖像素）視為同一個
+        self.save_delay = save_delay  # 更新後等幾秒才寫入檔案
+        # 地圖指紋 -> {物件鍵: {'records': [[名稱, 小地圖 x, 小地圖 y, 寬, 高, 信心度, 尺度], ...],
+        #                      'scanned': [[格 x, 格 y], ...]}}
+        self.maps = self._load_all()
+        self._dirty = False
+        self._lock = threading.Lock()  # 保護 maps 的更新與寫入前的快照
+        self._write_lock = threading.Lock()
+        self._thread = None
+    
+    def _load_all(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                maps = json.load(f)
+        except (OSError, ValueError):
+            print(f"⚠️  無法讀取地圖快取 {self.path}，重新偵測")
+            return {}
+        # 舊格式只有物件清單，沒有比對範圍：之後看到的範圍都會再比對一次並合併
+        return {known: {key: entry if isinstance(entry, dict) else {'records': entry, 'scanned': []}
+                        for key, entry in entries.items()}
+                for known, entries in maps.items()}
+    
+    def save(self):
+        """在背景寫入檔案（save_delay 秒內的更新合併成一次）"""
+        with self._lock:
+            self._dirty = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="MapGeometryCache", daemon=True)
+                self._thread.start()
+    
+    def _run(self):
+        time.sleep(self.save_delay)
+        with self._lock:
+            self._thread = None
+        self.flush()
+    
+    def flush(self):
+        """立即寫入還沒保存的更新（結束前呼叫）"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            # 更新時整個項目替換，不修改原本的清單，所以淺層複製就是一致的快照
+            snapshot = {known: dict(entries) for known, entries in self.maps.items()}
+        with self._write_lock:
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path)
+    
+    def find_map(self, fingerprint):
+        """找出已保存的同一張地圖（指紋相同或足夠接近），沒有時回傳 None"""
+        return closest_fingerprint(fingerprint, self.maps, self.max_distance)
+    
+    def lookup(self, fingerprint, key):
+        """取得地圖上已保存的物件（小地圖座標），沒有時回傳 None"""
+        known = self.find_map(fingerprint)
+        if known is None or key not in self.maps[known]:
+            return None
+        return self.maps[known][key]['records']
+    
+    def view_cells(self, view_box):
+        """完整落在畫面範圍 (x0, y0, x1, y1)（小地圖座標）內的格子"""
+        x0, y0, x1, y1 = view_box
+        columns = range(int(np.ceil(x0 / self.cell)), int(np.floor(x1 / self.cell)))
+        rows = range(int(np.ceil(y0 / self.cell)), int(np.floor(y1 / self.cell)))
+        return {(column, row) for column in columns for row in rows}
+    
+    def is_scanned(self, fingerprint, key, view_box):
+        """畫面範圍是否都已經比對過"""
+        known = self.find_map(fingerprint)
+        if known is None or key not in self.maps[known]:
+            return False
+        scanned = {tuple(cell) for cell in self.maps[known][key]['scanned']}
+        return self.view_cells(view_box) <= scanned
+    
+    def store(self, fingerprint, key, records, view_box):
+        """把畫面範圍 view_box 內比對到的物件合併進地圖，回傳合併後的全部物件
+        
+        已保存的物件和新的同名物件位置相近時以新的為準；
+        落在這次比對範圍內（離邊緣超過一格）卻沒有再比對到的物件視為已經不存在，一併移除。
+        """
+        known = self.find_map(fingerprint) or fingerprint
+        entry = self.maps.get(known, {}).get(key, {'records': [], 'scanned': []})
+        x0, y0, x1, y1 = view_box
+        margin = self.cell
+        merged = list(records)
+        for record in entry['records']:
+            if any(new[0] == record[0] and abs(new[1] - record[1]) <= self.merge_distance
+                   and abs(new[2] - record[2]) <= self.merge_distance for new in records):
+                continue
+            if x0 + margin <= record[1] <= x1 - margin and y0 + margin <= record[2] <= y1 - margin:
+                continue
+            merged.append(record)
+        scanned = {tuple(cell) for cell in entry['scanned']} | self.view_cells(view_box)
+        with self._lock:
+            self.maps.setdefault(known, {})[key] = {'records': merged, 'scanned': sorted(list(cell) for cell in scanned)}
+        self.save()
+        return merged
+    
+    def invalidate(self, fingerprint=None):
+        """清除快取（fingerprint 為 None 時清除所有地圖）"""
+        with self._lock:
+            if fingerprint is None:
+                self.maps = {}
+            else:
+                self.maps.pop(self.find_map(fingerprint), None)
+        self.save()
+
+class NavigationGraph:
+    """平台 / 繩子導航圖 - 節點是平台區段，邊是跳躍、下跳、爬繩子，權重為預估移動時間（秒）
+    
+    座標為地圖座標（遊戲畫面像素，y 向下）。同一區段內的走路時間依進入與起跳的 x 計算，
+    每條邊記錄可以起跳的 x 範圍。A* 選的路徑與起點、終點的 x 有關，
+    所以區段路徑依 (起點區段, 起點 x 格, 終點區段, 終點 x 格) 快取，格寬為 plan_bucket 像素。
+    """
+    def __init__(self, platforms, ropes, walk_speed=200, climb_speed=120, fall_speed=600, jump_height=90,
+                 jump_reach=140, jump_time=0.6, merge_gap=24, level_tolerance=12, stand_height=120, plan_bucket=32):
+        self.walk_speed = walk_speed  # 每秒水平移動的像素
+        self.climb_speed = climb_speed  # 每秒爬繩的像素
+        self.fall_speed = fall_speed  # 每秒下落的像素（概略）
+        self.jump_height = jump_height  # 跳躍可到達的高度
+        self.jump_reach = jump_reach  # 跳躍可越過的水平距離
+        self.jump_time = jump_time  # 一次跳躍的時間
+        self.merge_gap = merge_gap  # 同一高度、間隔小於此值的平台視為同一區段
+        self.level_tolerance = level_tolerance  # 高度差小於此值視為同一高度
+        self.stand_height = stand_height  # 角色 / 怪物中心點到腳下平台的最大距離
+        self.plan_bucket = plan_bucket  # 路徑快取的 x 格寬（同一格內的起點、終點沿用同一條路徑）
+        self.segments = self._merge_segments(np.asarray(platforms, dtype=np.float64).reshape(-1, 4))  # [(左, 右, 表面 y)]
+        self.ropes = [(x + w / 2, y, y + h) for x, y, w, h in np.asarray(ropes, dtype=np.float64).reshape(-1, 4).tolist()]
+        self.edges = [[] for _ in self.segments]  # 區段 -> [(目標, 動作, 方向, 起跳 x 下限, 上限, 落地 x, 時間)]
+        self.plans = {}  # (起點區段, 起點 x 格, 終點區段, 終點 x 格) -> 區段路徑（找不到時為 None）
+        self._build_edges()
+    
+    def _merge_segments(self, platforms):
+        """把同一高度、互相重疊或相鄰的平台框合併成區段"""
+        segments = []
+        for x, y, w, _ in platforms[np.lexsort((platforms[:, 0], platforms[:, 1]))].tolist():
+            for index, (left, right, surface) in enumerate(segments):
+                if (abs(y - surface) <= self.level_tolerance and x <= right + self.merge_gap
+                        and x + w >= left - self.merge_gap):
+                    segments[index] = (min(left, x), max(right, x + w), surface)
+                    break
+            else:
+                segments.append((x, x + w, y))
+        return segments
+    
+    def _build_edges(self):
+        """建立區段之間的跳躍、下跳與爬繩子邊"""
+        for a, (a_left, a_right, a_y) in enumerate(self.segments):
+            for b, (b_left, b_right, b_y) in enumerate(self.segments):
+                if a == b:
+                    continue
+                drop = b_y - a_y  # 正值表示 b 比較低
+                overlap_left, overlap_right = max(a_left, b_left), min(a_right, b_right)
+                if overlap_left <= overlap_right:
+                    if drop > self.level_tolerance:
+                        self.edges[a].append((b, 'down_jump', None, overlap_left, overlap_right, None,
+                                              0.3 + drop / self.fall_speed))
+                    elif -drop > self.level_tolerance and -drop <= self.jump_height:
+                        self.edges[a].append((b, 'jump', None, overlap_left, overlap_right, None, self.jump_time))
+                    continue
+                
+                # 沒有水平重疊：從靠近 b 的邊緣跳過去（往上最多 jump_height，往下不限）
+                gap = max(b_left - a_right, a_left - b_right)
+                if gap > self.jump_reach or -drop > self.jump_height:
+                    continue
+                if b_left > a_right:
+                    direction, launch, land = 'right', a_right, b_left
+                else:
+                    direction, launch, land = 'left', a_left, b_right
+                self.edges[a].append((b, 'jump', direction, launch, launch, land,
+                                      self.jump_time + max(drop, 0) / self.fall_speed))
+        
+        for rope_x, rope_top, rope_bottom in self.ropes:
+            # 繩子下端附近（跳得到）的區段爬到繩子上端的區段
+            bottom = self._segment_near(rope_x, rope_bottom, -self.level_tolerance, self.jump_height)
+            top = self._segment_near(rope_x, rope_top, -self.jump_height / 2, self.jump_height / 2)
+            if bottom is None or top is None or bottom == top or self.segments[top][2] >= self.segments[bottom][2]:
+                continue
+            climb = (self.segments[bottom][2] - self.segments[top][2]) / self.climb_speed
+            self.edges[bottom].append((top, 'climb', 'up', rope_x, rope_x, rope_x, self.jump_time + climb))
+    
+    def _segment_near(self, x, y, low, high):
+        """x 在範圍內、表面與 y 的距離在 [low, high] 之間且最靠近 y 的區段"""
+        best, best_distance = None, None
+        for index, (left, right, surface) in enumerate(self.segments):
+            distance = surface - y
+            if left - self.merge_gap <= x <= right + self.merge_gap and low <= distance <= high:
+                if best is None or abs(distance) < best_distance:
+                    best, best_distance = index, abs(distance)
+        return best
+    
+    def locate(self, x, y):
+        """點 (x, y)（角色或怪物中心）所在的區段：腳下最近的平台，沒有時回傳 None"""
+        return self._segment_near(x, y, -self.level_tolerance, self.stand_height)
+    
+    def plan(self, start, goal):
+        """規劃從 start (x, y) 到 goal (x, y) 的動作序列，無法定位或沒有路徑時回傳 None
+        
+        每個動作為 {'action': 'walk'/'jump'/'down_jump'/'climb', 'direction', 'x', 'time'}，
+        x 為動作結束時的地圖 x 座標。
+        """
+        start_node, goal_node = self.locate(*start), self.locate(*goal)
+        if start_node is None or goal_node is None:
+            return None
+        key = (start_node, int(start[0] // self.plan_bucket), goal_node, int(goal[0] // self.plan_bucket))
+        if key not in self.plans:
+            self.plans[key] = self._search(start_node, start[0], goal_node, goal[0])
+        path = self.plans[key]
+        if path is None:
+            return None
+        return self._steps(path, start[0], goal[0], goal_node)
+    
+    def _search(self, start_node, start_x, goal_node, goal_x):
+        """A* 搜尋區段路徑（每個區段記住最快抵達時的 x），回傳邊的清單"""
+        max_speed = max(self.walk_speed, self.climb_speed, self.fall_speed, self.jump_reach / self.jump_time)
+        goal_y = self.segments[goal_node][2]
+        
+        def heuristic(node, x):
+            return np.hypot(x - goal_x, self.segments[node][2] - goal_y) / max_speed
+        
+        best = {start_node: 0.0}
+        came_from = {start_node: None}
+        queue = [(heuristic(start_node, start_x), 0.0, start_node, start_x)]
+        while queue:
+            _, cost, node, x = heapq.heappop(queue)
+            if node == goal_node:
+                path = []
+                while came_from[node] is not None:
+                    node, edge = came_from[node]
+                    path.append(edge)
+                return path[::-1]
+            if cost > best[node]:
+                continue
+            for edge in self.edges[node]:
+                target, _, _, launch_low, launch_high, land, duration = edge
+                launch = min(max(x, launch_low), launch_high)
+                arrival = launch if land is None else land
+                new_cost = cost + abs(x - launch) / self.walk_speed + duration
+                if new_cost < best.get(target, np.inf):
+                    best[target] = new_cost
+                    came_from[target] = (node, edge)
+                    heapq.heappush(queue, (new_cost + heuristic(target, arrival), new_cost, target, arrival))
+        return None
+    
+    def _steps(self, path, start_x, goal_x, goal_node):
+        """把區段路徑展開成動作序列（起跳前先走到起跳點，最後走到目標 x）"""
+        steps = []
+        x = start_x
+        for _, action, direction, launch_low, launch_high, land, duration in path:
+            launch = min(max(x, launch_low), launch_high)
+            if abs(launch - x) > self.merge_gap:
+                steps.append({'action': 'walk', 'direction': 'right' if launch > x else 'left',
+                              'x': launch, 'time': abs(launch - x) / self.walk_speed})
+            x = launch if land is None else land
+            steps.append({'action': action, 'direction': direction, 'x': x, 'time': duration})
+        
+        left, right, _ = self.segments[goal_node]
+        goal_x = min(max(goal_x, left), right)
+        if abs(goal_x - x) > self.merge_gap:
+            steps.append({'action': 'walk', 'direction': 'right' if goal_x > x else 'left',
+                          'x': goal_x, 'time': abs(goal_x - x) / self.walk_speed})
+        return steps
+
+class ObjectTracker:
+    """物件追蹤 - 已知物件只在預測位置附近的小視窗重新比對
+    
+    每 full_scan_interval 次比對，或有物件追蹤失敗（離開畫面、被打倒）時，
+    才做整張畫面的比對並重建追蹤。沒有任何追蹤中的物件時每次都做完整比對。
+    """
+    def __init__(self, full_scan_interval=10, motion_margin=24):
+        self.full_scan_interval = full_scan_interval
+        self.motion_margin = motion_margin  # 每次比對之間物件可能移動的像素（搜尋視窗外擴）
+        # 追蹤中的物件以陣列保存（每次比對不為每個物件建立 Detection）
+        self.boxes = np.empty((0, 4), np.int32)  # 最近一次的物件框 (x, y, w, h)，螢幕座標
+        self.velocities = np.empty((0, 2), np.int32)  # 每次比對之間的位移 (dx, dy)
+        self.names = np.empty(0, object)  # 模板名稱
+        self.scans_since_full = None  # 距離上次完整比對的次數（None = 還沒做過）
+        self.last_scan_full = False  # 上一次是否為完整比對（差異區塊快取只在此時有效）
+    
+    def reset(self):
+        self._set_tracks(DetectionBatch.empty(), np.empty((0, 2), np.int32))
+        self.scans_since_full = None
+        self.last_scan_full = False
+    
+    def __len__(self):
+        return len(self.boxes)
+    
+    @staticmethod
+    def object_names(objects):
+        """每個物件的模板名稱陣列"""
+        if not len(objects.names):
+            return np.full(len(objects), "unknown", object)
+        return np.array(objects.names, object)[objects.template_id]
+    
+    def _set_tracks(self, objects, velocities):
+        self.boxes = objects.boxes.astype(np.int32).reshape(-1, 4)
+        self.velocities = np.asarray(velocities, np.int32).reshape(-1, 2)
+        self.names = self.object_names(objects)
+    
+    def needs_full_scan(self):
+        """是否需要整張畫面比對"""
+        return (self.scans_since_full is None or not len(self)
+                or self.scans_since_full >= self.full_scan_interval)
+    
+    def search_windows(self, frame):
+        """每個追蹤物件的搜尋視窗 (x, y, w, h)，畫面座標，依物件速度預測位置並外擴"""
+        frame_width, frame_height = frame.size
+        origin_x, origin_y = frame.origin
+        predicted = self.boxes[:, :2] + self.velocities - (origin_x, origin_y)
+        margins = self.motion_margin + np.abs(self.velocities)
+        x0 = np.maximum(0, predicted[:, 0] - margins[:, 0])
+        y0 = np.maximum(0, predicted[:, 1] - margins[:, 1])
+        x1 = np.minimum(frame_width, predicted[:, 0] + self.boxes[:, 2] + margins[:, 0])
+        y1 = np.minimum(frame_height, predicted[:, 1] + self.boxes[:, 3] + margins[:, 1])
+        return [(int(left), int(top), max(0, int(right - left)), max(0, int(bottom - top)))
+                for left, top, right, bottom in zip(x0, y0, x1, y1)]
+    
+    def update_full(self, objects):
+        """完整比對後重建追蹤（objects 為 DetectionBatch）"""
+        self._set_tracks(objects, np.zeros((len(objects), 2), np.int32))
+        self.scans_since_full = 0
+        self.last_scan_full = True
+    
+    def update_local(self, frame, windows, objects):
+        """視窗比對後更新追蹤，回傳 False 表示有物件追蹤失敗（需要完整比對）
+        
+        每個追蹤物件取自己視窗內、離預測位置最近的偵測結果（同名模板優先）；
+        沒被任何追蹤認領的偵測結果（視窗內新出現的物件）加入為新的追蹤。
+        """
+        origin_x, origin_y = frame.origin
+        center_x = objects.center_x - origin_x
+        center_y = objects.center_y - origin_y
+        names = self.object_names(objects)
+        claimed = np.zeros(len(objects), bool)
+        matched = []
+        for track, (window_x, window_y, window_w, window_h) in enumerate(windows):
+            candidates = np.flatnonzero(~claimed & (center_x >= window_x) & (center_x < window_x + window_w) &
+                                        (center_y >= window_y) & (center_y < window_y + window_h))
+            if not len(candidates):
+                return False
+            predicted_x, predicted_y = self.boxes[track, :2] + self.velocities[track]
+            distance = np.abs(objects.x[candidates] - predicted_x) + np.abs(objects.y[candidates] - predicted_y)
+            # 同名優先，其次距離最近（距離相同時取先出現的）
+            best = candidates[np.lexsort((distance, names[candidates] != self.names[track]))[0]]
+            claimed[best] = True
+            matched.append(best)
+        
+        matched = np.array(matched, np.intp)
+        order = np.concatenate([matched, np.flatnonzero(~claimed)])
+        velocities = np.zeros((len(order), 2), np.int32)
+        velocities[:len(matched), 0] = objects.x[matched] - self.boxes[:len(matched), 0]
+        velocities[:len(matched), 1] = objects.y[matched] - self.boxes[:len(matched), 1]
+        self._set_tracks(objects.take(order), velocities)
+        self.scans_since_full += 1
+        self.last_scan_full = False
+        return True
+
+class CaptureThread:
+    """背景擷取執行緒 - 持續把畫面寫入固定大小的環狀緩衝區，偵測只取最新的一張
+    
+    緩衝區在第一張畫面時一次配置完成，之後不再配置記憶體。偵測還沒取走的舊畫面
+    會直接被覆蓋（丟棄），不會排隊。正在被偵測使用的那一格不會被覆蓋，直到下一次
+    呼叫 latest() 為止。
+    """
+    def __init__(self, source, region=None, mode='bgr', slots=3):
+        self.source = source
+        self.region = region
+        self.mode = mode  # 'bgr' 或 'gray'（較省記憶體，但沒有彩色畫面）
+        self.slot_count = max(3, slots)  # 至少 3 格：寫入中、最新、使用中
+        self._buffers = None
+        self._meta = [None] * self.slot_count  # 每格的 (序號, 時間, 原點)
+        self._latest_slot = -1
+        self._held_slot = -1
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.sequence = 0  # 已擷取的畫面數
+        self.dropped = 0  # 沒被使用就被覆蓋的畫面數
+        self._consumed_sequence = 0
+    
+    def start(self):
+        """啟動擷取執行緒"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="capture", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """停止擷取執行緒"""
+        self._stop_event.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+    
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+    
+    def _allocate(self, frame):
+        """依第一張畫面的尺寸預先配置所有緩衝區"""
+        width, height = frame.size
+        shape = (height, width) if self.mode == 'gray' else (height, width, 3)
+        self._buffers = [np.empty(shape, dtype=np.uint8) for _ in range(self.slot_count)]
+    
+    def _publish(self, slot, frame):
+        """把寫好的緩衝區標記為最新畫面"""
+        with self._condition:
+            self.sequence += 1
+            if self._latest_slot >= 0 and self._meta[self._latest_slot][0] > self._consumed_sequence:
+                self.dropped += 1  # 上一張還沒被使用就被新畫面取代
+            self._meta[slot] = (self.sequence, frame.timestamp, frame.origin)
+            self._latest_slot = slot
+            self._condition.notify_all()
+    
+    def _run(self):
+        try:
+            while not self._stop_event.is_set():
+                if self._buffers is None:
+                    frame = self.source.grab(region=self.region)
+                    self._allocate(frame)
+                    np.copyto(self._buffers[0], frame.gray if self.mode == 'gray' else frame.bgr)
+                    self._publish(0, frame)
+                    continue
+                
+                # 選一格不是「最新」也不是「使用中」的緩衝區來寫入
+                with self._condition:
+                    slot = next(i for i in range(self.slot_count)
+                                if i != self._latest_slot and i != self._held_slot)
+                
+                frame = self.source.grab_into(self._buffers[slot], region=self.region)
+                self._publish(slot, frame)
+        except FrameSourceExhausted:
+            pass  # 重播結束，latest() 之後回傳 None，由 capture_frame 拋出例外
+        
+        # 畫面來源結束時喚醒等待中的偵測
+        self._stop_event.set()
+        with self._condition:
+            self._condition.notify_all()
+    
+    def latest(self, after_sequence=None, timeout=1.0):
+        """取得最新畫面；若最新畫面序號不大於 after_sequence，最多等待 timeout 秒
+        
+        after_sequence 預設為上一次取走的畫面序號，也就是等待一張還沒用過的新畫面。
+        回傳的畫面直接引用緩衝區（不複製），在下一次呼叫 latest() 前有效。
+        沒有任何畫面時回傳 None。
+        """
+        if after_sequence is None:
+            after_sequence = self._consumed_sequence
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._stop_event.is_set() or
+                (self._latest_slot >= 0 and self._meta[self._latest_slot][0] > after_sequence),
+                timeout=timeout)
+            if self._latest_slot < 0:
+                return None
+            if self._stop_event.is_set() and self._meta[self._latest_slot][0] <= after_sequence:
+                return None  # 畫面來源已結束，沒有新畫面了
+            slot = self._latest_slot
+            self._held_slot = slot
+            sequence, timestamp, origin = self._meta[slot]
+            self._consumed_sequence = sequence
+        
+        buffer = self._buffers[slot]
+        if self.mode == 'gray':
+            return Frame(None, timestamp=timestamp, origin=origin, gray=buffer, sequence=sequence)
+        return Frame(buffer, timestamp=timestamp, origin=origin, sequence=sequence)
+
+def match_owned_templates(frame, pyramids, request, fft_engine):
+    """工作行程比對自己負責的模板，回傳精簡的陣列（不建立 dict，減少序列化成本）"""
+    settings = request['settings']
+    fft_engine = fft_engine if settings['match_engine'] == 'fft' else None
+    hit_xs, hit_ys, hit_widths, hit_heights, hit_scores, hit_scales, hit_templates = [], [], [], [], [], [], []
+    best_templates, best_confidences, best_scales = [], [], []
+    for template_index in sorted(pyramids):
+        scales = request['scales'].get(template_index)
+        if scales is None:
+            continue
+        pyramid = pyramids[template_index]
+        best_confidence = 0
+        best_scale = None
+        for scale in scales:
+            variant = pyramid.get(scale)
+            if variant is None:
+                continue
+            coarse_variant = None
+            if request['match_mode'] == 'coarse':
+                coarse_variant = pyramid.coarse(scale, settings['coarse_factor'])
+            for region in request['regions']:
+                xs, ys, scores = match_template_variant(frame, variant, region, request['threshold'], coarse_variant,
+                                                        settings['coarse_factor'], settings['coarse_threshold_drop'],
+                                                        fft_engine)
+                if not len(scores):
+                    continue
+                if scores.max() > best_confidence:
+                    best_confidence = float(scores.max())
+                    best_scale = scale
+                hit_xs.append(xs)
+                hit_ys.append(ys)
+                hit_widths.append(np.full(len(xs), variant.width))
+                hit_heights.append(np.full(len(xs), variant.height))
+                hit_scores.append(scores)
+                hit_scales.append(np.full(len(xs), scale))
+                hit_templates.append(np.full(len(xs), template_index))
+        if best_scale is not None:
+            best_templates.append(template_index)
+            best_confidences.append(best_confidence)
+            best_scales.append(best_scale)
+    
+    def pack(arrays, dtype):
+        return np.concatenate(arrays).astype(dtype) if arrays else np.empty(0, dtype)
+    
+    return {
+        'xs': pack(hit_xs, np.int32),
+        'ys': pack(hit_ys, np.int32),
+        'widths': pack(hit_widths, np.int32),
+        'heights': pack(hit_heights, np.int32),
+        'scores': pack(hit_scores, np.float32),
+        'scales': pack(hit_scales, np.float32),
+        'templates': pack(hit_templates, np.int32),
+        'best_templates': np.array(best_templates, np.int32),
+        'best_confidences': np.array(best_confidences, np.float32),
+        'best_scales': np.array(best_scales, np.float32)
+    }
+
+def detection_worker(connection, shared_frame_name, owned_templates):
+    """偵測工作行程：啟動時只建立一次自己負責的模板金字塔，之後每個請求直接讀取共享記憶體中的畫面"""
+    shared_frame = shared_memory.SharedMemory(name=shared_frame_name)
+    pyramids = {template_type: {index: TemplatePyramid(image, scales, f"{template_type}:{index}")
+                                for index, image, scales in templates}
+                for template_type, templates in owned_templates.items()}
+    fft_engine = FFTCorrelationEngine()
+    frame = None
+    frame_token = None
+    try:
+        while True:
+            request = connection.recv()
+            if request is None:
+                break
+            try:
+                if request['token'] != frame_token:
+                    # 新的畫面（同一張畫面的縮小圖、FFT 頻譜在怪物、繩子、平台之間共用）
+                    gray = np.ndarray(request['shape'], np.uint8, buffer=shared_frame.buf)
+                    frame = Frame(None, gray=gray)
+                    frame_token = request['token']
+                    gray = None
+                result = match_owned_templates(frame, pyramids.get(request['type'], {}), request, fft_engine)
+                connection.send(('ok', result))
+            except Exception:
+                connection.send(('error', traceback.format_exc()))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        frame = None  # 釋放共享記憶體的參照後才能關閉
+        shared_frame.close()
+
+class DetectionProcessPool:
+    """行程池偵測 - 畫面只寫入共享記憶體一次，每個工作行程負責一部分模板
+    
+    峰值擷取等 Python 運算在執行緒中無法平行，改用多個行程。
+    模板在啟動工作行程時傳入一次（每個行程只建立自己負責的金字塔），
+    每個請求只傳送比對參數，工作行程回傳精簡的 numpy 陣列而不是 dict 清單。
+    """
+    def __init__(self, template_sets, workers=2, capacity=1920 * 1080):
+        self.workers = workers
+        self.capacity = capacity  # 共享記憶體可容納的灰階畫面大小（位元組）
+        self.signature = self.make_signature(template_sets)
+        self.shared_frame = shared_memory.SharedMemory(create=True, size=capacity)
+        self._frame = None
+        self._frame_token = 0
+        self._shape = None
+        
+        # 使用 spawn 避免複製主行程的執行緒（背景擷取、比對執行緒池）
+        context = multiprocessing.get_context('spawn')
+        self.connections = []
+        self.processes = []
+        for worker_index in range(workers):
+            owned_templates = {
+                template_type: [(index, image, scales) for index, (image, scales) in enumerate(templates)
+                                if index % workers == worker_index]
+                for template_type, templates in template_sets.items()
+            }
+            parent_connection, child_connection = context.Pipe()
+            process = context.Process(target=detection_worker, name=f'detection-{worker_index}', daemon=True,
+                                      args=(child_connection, self.shared_frame.name, owned_templates))
+            process.start()
+            child_connection.close()
+            self.connections.append(parent_connection)
+            self.processes.append(process)
+    
+    @staticmethod
+    def make_signature(template_sets):
+        """模板組合的識別（模板改變時需要重建行程池）"""
+        return tuple((template_type, tuple((id(image), tuple(scales)) for image, scales in templates))
+                     for template_type, templates in sorted(template_sets.items()))
+    
+    def write_frame(self, frame):
+        """把畫面寫入共享記憶體（同一張畫面只寫一次）"""
+        if frame is self._frame:
+            return
+        gray = frame.gray
+        if gray.nbytes > self.capacity:
+            raise ValueError(f"畫面 {gray.shape} 超過共享記憶體容量 {self.capacity}")
+        shared_gray = np.ndarray(gray.shape, np.uint8, buffer=self.shared_frame.buf)
+        np.copyto(shared_gray, gray)
+        del shared_gray
+        self._frame = frame
+        self._frame_token += 1
+        self._shape = gray.shape
+    
+    def match(self, frame, template_type, threshold, regions, match_mode, scales_by_template, settings):
+        """所有工作行程比對同一張畫面，回傳 (hits, best_matches)
+        
+        hits 為 (xs, ys, sizes, scores, scales, template_indices) 陣列，沒有結果時為 None；
+        best_matches 為 {模板索引: (最佳信心度, 最佳尺度)}。
+        """
+        self.write_frame(frame)
+        request = {
+            'token': self._frame_token,
+            'shape': self._shape,
+            'type': template_type,
+            'threshold': threshold,
+            'regions': [tuple(int(value) for value in region) for region in regions],
+            'match_mode': match_mode,
+            'scales': scales_by_template,
+            'settings': settings
+        }
+        for connection in self.connections:
+            connection.send(request)
+        
+        # 依工作行程順序合併，結果固定
+        results = []
+        errors = []
+        for connection in self.connections:
+            status, payload = connection.recv()
+            if status == 'ok':
+                results.append(payload)
+            else:
+                errors.append(payload)
+        if errors:
+            raise RuntimeError("偵測行程發生錯誤:\n" + "\n".join(errors))
+        
+        best_matches = {}
+        for result in results:
+            for template_index, confidence, scale in zip(result['best_templates'], result['best_confidences'],
+                                                         result['best_scales']):
+                best_matches[int(template_index)] = (float(confidence), float(scale))
+        
+        if not any(len(result['scores']) for result in results):
+            return None, best_matches
+        
+        def merged(key):
+            return np.concatenate([result[key] for result in results])
+        
+        hits = (merged('xs'), merged('ys'), np.column_stack((merged('widths'), merged('heights'))),
+                merged('scores'), merged('scales'), merged('templates'))
+        return hits, best_matches
+    
+    def close(self):
+        """停止所有工作行程並釋放共享記憶體"""
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join(timeout=2.0)
+            if process.is_alive():
+                process.terminate()
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
+        self.processes = []
+        self._frame = None
+        self.shared_frame.close()
+        self.shared_frame.unlink()
 
 class AutoTrainingBot:
-    def __init__(self):
+    # 效能測試名稱 -> 方法名稱
+    BENCHMARKS = {
+        'capture': 'benchmark_capture',
+        'coarse': 'benchmark_coarse_matching',
+        'fft': 'benchmark_fft_engine',
+        'workers': 'benchmark_match_workers',
+        'processes': 'benchmark_detection_processes',
+        'clusters': 'benchmark_monster_clusters',
+        'rope': 'benchmark_player_on_rope',
+        'minimap': 'benchmark_minimap',
+        'recording': 'benchmark_recording',
+        'debug': 'benchmark_debug_levels',
+    }
+    
+    def __init__(self, frame_source=None):
         self.mouse = MouseController()
         self.keyboard = KeyboardController()
         self.templates_dir = 'templates'
@@ -19,6 +2558,9 @@ class AutoTrainingBot:
         self.rope_templates = []
         self.platform_templates = []
         self.player_on_rope_template = None  # 新增：玩家在繩子上的模板
+        self.player_on_rope_pyramid = None  # 玩家在繩子上模板的多尺度版本
+        self.game_window_templates = {}  # 遊戲視窗邊框模板（用於自動定位視窗）
+        self.minimap_templates = {}  # 小地圖邊角模板（用於定位小地圖）
         
         # 遊戲設定
         # 遊戲設定 - 修改為方向鍵
@@ -37,6 +2579,7 @@ class AutoTrainingBot:
         self.safe_distance = 80   # 安全距離
         self.platform_threshold = 0.8  # 平台識別閾值
         self.rope_threshold = 0.8     # 繩子識別閾值
+        self.rope_query_threshold = 0.7  # 每個 tick 只以這個（較低的）閾值比對一次繩子，各用途再依信心度過濾
         
         # 按鍵方法選擇
         self.use_pyautogui_keys = True  # 如果 pynput 不工作，使用 pyautogui
@@ -44,6 +2587,106 @@ class AutoTrainingBot:
         # 下繩子策略設定
         self.climb_down_strategy = 'simple'  # 'simple' 或 'smart'
         
+        # 畫面擷取
+        self.frame_source = frame_source or ScreenFrameSource()  # 即時截圖或重播
+        self.frame_count = 0  # 已擷取的畫面數（tick 編號）
+        self.game_region = None  # 遊戲視窗區域 (x, y, w, h)，None 表示整個螢幕
+        self.game_window_size = (1280, 720)  # 只有左上角邊框模板時使用的視窗大小
+        self.window_locate_attempted = False  # 自動定位只嘗試一次
+        self.use_capture_thread = False  # 使用背景執行緒持續擷取畫面
+        self.capture_thread = None
+        self.capture_mode = 'bgr'  # 背景擷取的畫面格式，'gray' 只在沒有需要彩色的功能時使用
+        self.max_frame_wait = 0.5  # 等待新畫面的最長時間（秒）
+        
+        # 區塊差異偵測：畫面沒變化的區域不重新比對
+        self.use_dirty_regions = True
+        self.dirty_tracker = DirtyRegionTracker()
+        self.detection_cache = {}  # (物件類型, 閾值, 比對模式) -> 上次的偵測結果
+        
+        # 顏色預篩選：完整比對時先用顏色遮罩找候選區域，只在候選區域內比對（找不到候選時比對整張畫面）
+        self.use_color_prefilter = False
+        self.color_prefilters = {  # 物件類型 -> COLOR_RANGES 中的顏色名稱
+            'monsters': ['怪物紅色', '怪物橙色', 'HP條綠色'],
+            'ropes': ['繩子棕色']
+        }
+        self.color_filter = ColorCandidateFilter()
+        
+        # 物件追蹤：已知物件只在上次位置附近的小視窗重新比對，每 N 次或追蹤失敗時才完整比對
+        self.use_tracking = True
+        self.full_scan_interval = 10  # 每幾次偵測做一次完整比對（找新出現的物件）
+        self.tracking_margin = 24  # 搜尋視窗外擴的像素（物件每個 tick 最大移動量）
+        self.object_trackers = {}  # (物件類型, 閾值, 比對模式) -> ObjectTracker
+        
+        # 比對模式：'exhaustive' 完整比對，'coarse' 先在縮小畫面找候選再用原始解析度確認
+        self.match_modes = {'monsters': 'exhaustive', 'ropes': 'exhaustive', 'platforms': 'exhaustive'}
+        self.coarse_factor = 2  # 縮小倍數（2 或 4）
+        self.coarse_threshold_drop = 0.15  # 縮小畫面上使用較低的閾值以免漏掉候選
+        self.nms_iou_threshold = 0.3  # 重疊比例超過此值視為同一個物件
+        
+        # 比對引擎：'opencv'（cv2.matchTemplate）或 'fft'（整張畫面共用頻譜，適合大量模板）
+        self.match_engine = 'opencv'
+        self.fft_engine = FFTCorrelationEngine()
+        
+        # 平行比對：模板 × 尺度的工作分給執行緒池（cv2.matchTemplate 會釋放 GIL）
+        self.match_workers = 1  # 1 = 在主執行緒依序比對
+        self.match_pool = None
+        self.match_pool_workers = 0
+        self.opencv_threads = cv2.getNumThreads()  # 單執行緒比對時 OpenCV 內部使用的執行緒數
+        
+        # 行程池偵測：畫面寫入共享記憶體，每個工作行程負責一部分模板（Python 運算也能平行）
+        self.detection_processes = 0  # 0 = 不使用行程池
+        self.detection_pool = None
+        
+        # 尺度自動鎖定：學到每個模板的尺度後只搜尋該尺度（與相鄰尺度）
+        self.use_scale_lock = True
+        self.scale_calibration = ScaleCalibration('scale_calibration.json')
+        
+        # 繩子上角色偵測快速模式：只在預期位置附近搜尋，任一尺度達標立即結束，原始灰階不夠才用增強畫面
+        self.player_rope_fast_mode = True
+        self.player_search_margin = 120  # 搜尋視窗在模板大小之外外擴的像素
+        self.player_rope_confidence = 0.7  # 達到此信心度就不再嘗試其他尺度與增強畫面
+        self.save_player_rope_debug = False  # 快速模式下是否仍保存偵測 debug 圖像
+        self.last_player_on_rope = None  # 上次偵測到的角色（Detection），作為下一次的預期位置
+        self.tick_detections = (None, {})  # (畫面, {(物件類型, 閾值, 比對模式): 偵測結果})，同一個 tick 直接沿用
+        self.current_frame = None  # 這個 tick 的畫面（小地圖位置從這張畫面讀取）
+        
+        # 小地圖定位：玩家位置從小地圖上的標記讀取（只處理小地圖區域，比整張畫面比對快很多）
+        self.use_minimap = True
+        self.minimap_reader = MinimapReader()
+        self.minimap_size = (200, 150)  # 只有左上角模板、而且這個解析度還沒保存大小時使用的小地圖大小
+        self.default_minimap_scale = 16.0  # 地圖還沒校正比例時使用的比例
+        self.minimap_scale = self.default_minimap_scale  # 目前地圖的比例（1 個小地圖像素對應的遊戲畫面像素）
+        self.minimap_scale_calibrated = False  # 目前地圖的比例是否已校正（校正前不使用地圖快取）
+        self.minimap_calibration = MinimapCalibration('minimap_calibration.json')
+        self.minimap_max_age = 0.05  # 動作之間需要目前位置時，超過這個秒數才只擷取小地圖區域重新讀取
+        self.minimap_locate_attempted = False  # 自動定位只嘗試一次
+        
+        # 地圖快取：繩子、平台的位置依地圖指紋保存（小地圖座標），同一張地圖只比對一次
+        self.use_map_cache = True
+        self.map_cache = MapGeometryCache('map_geometry.json')
+        self.map_cache_verify_interval = 300  # 沿用快取幾次後重新比對一次（地圖改版或快取錯誤時自動修正）
+        self.map_cache_uses = {}  # (地圖指紋, 物件鍵) -> 沿用快取的次數
+        
+        # 導航：平台區段與繩子組成導航圖，A* 規劃到目標平台的動作序列（導航圖依地圖快取）
+        self.use_navigation = True
+        self.walk_speed = 200  # 每秒水平移動的像素
+        self.climb_speed = 120  # 每秒爬繩的像素
+        self.jump_height = 90  # 跳躍可到達的高度
+        self.jump_reach = 140  # 跳躍可越過的水平距離
+        self.navigation_snap = 8  # 導航圖的物件框（地圖座標）以此像素為單位，相差在此以內視為同一個
+        self.navigation_miss_limit = 3  # 完整在畫面內的物件框連續幾次沒有看到就從導航圖移除
+        self.navigation_maps = {}  # 地圖指紋 -> {'platforms': {平台框: 連續沒看到的次數}, 'ropes': {繩子框: 次數}, 'graph': NavigationGraph}
+        
+        # debug 圖像：由背景執行緒寫入 screens/（佇列滿時丟棄最舊的），偵測迴圈不等待硬碟
+        self.debug_writer = DebugImageWriter('screens')
+        self.debug_level = 1  # 0 = 不保存也不標記（偵測路徑沒有額外成本）, 1 = 抽樣保存, 2 = 每個 tick 保存並輸出偵測過程
+        self.debug_image_interval = 10  # 每幾個 tick 保存一次偵測 debug 圖像（0 = 只在狀態改變時保存）
+        self.debug_on_change = True  # 偵測到的數量改變時也保存
+        self.debug_states = {}  # 偵測種類 -> 上次的偵測數量（判斷狀態改變）
+        
+        # 畫面錄製：每個 tick 擷取的畫面附加到錄製檔（SessionRecorder），可用 SessionFrameSource 重播
+        self.session_recorder = None
+        
         self.load_all_templates()
         
     def load_all_templates(self):
@@ -66,6 +2709,7 @@ class AutoTrainingBot:
                     monster_info = {
                         'name': os.path.basename(file_path),
                         'template': template,
+                        'pyramid': TemplatePyramid(template, OBJECT_SCALES, os.path.basename(file_path)),
                         'priority': self.get_monster_priority(file_path)
                     }
                     self.monster_templates.append(monster_info)
@@ -84,7 +2728,8 @@ class AutoTrainingBot:
                 if template is not None:
                     rope_info = {
                         'name': os.path.basename(file_path),
-                        'template': template
+                        'template': template,
+                        'pyramid': TemplatePyramid(template, OBJECT_SCALES, os.path.basename(file_path))
                     }
                     self.rope_templates.append(rope_info)
                     print(f"  ✅ 載入繩子模板: {rope_info['name']}")
@@ -102,7 +2747,8 @@ class AutoTrainingBot:
                 if template is not None:
                     platform_info = {
                         'name': os.path.basename(file_path),
-                        'template': template
+                        'template': template,
+                        'pyramid': TemplatePyramid(template, OBJECT_SCALES, os.path.basename(file_path))
                     }
                     self.platform_templates.append(platform_info)
                     print(f"  ✅ 載入平台模板: {platform_info['name']}")
@@ -113,10 +2759,30 @@ class AutoTrainingBot:
         role_on_rope_file = os.path.join(self.templates_dir, 'role_on_rope.png')
         if os.path.exists(role_on_rope_file):
             self.player_on_rope_template = cv2.imread(role_on_rope_file, 0)
+            self.player_on_rope_pyramid = TemplatePyramid(self.player_on_rope_template, PLAYER_ON_ROPE_SCALES,
+                                                         'role_on_rope.png')
             print("✅ 載入玩家在繩子上的模板: role_on_rope.png")
         else:
             print("⚠️  找不到 role_on_rope.png，將使用位置估算方法")
         
+        # 載入遊戲視窗邊框模板（左上角必要，右下角可選）
+        for corner in ['tl', 'br']:
+            corner_file = os.path.join(self.templates_dir, f'game_window_{corner}.png')
+            if os.path.exists(corner_file):
+                corner_template = cv2.imread(corner_file, 0)
+                if corner_template is not None:
+                    self.game_window_templates[corner] = corner_template
+                    print(f"✅ 載入遊戲視窗邊框模板: game_window_{corner}.png")
+        
+        # 載入小地圖邊角模板（左上角必要，右下角可選）
+        for corner in ['tl', 'br']:
+            corner_file = os.path.join(self.templates_dir, f'minimap_{corner}.png')
+            if os.path.exists(corner_file):
+                corner_template = cv2.imread(corner_file, 0)
+                if corner_template is not None:
+                    self.minimap_templates[corner] = corner_template
+                    print(f"✅ 載入小地圖邊角模板: minimap_{corner}.png")
+        
         print("=" * 50)
         print(f"載入完成: {len(self.monster_templates)} 怪物, {len(self.rope_templates)} 繩子, {len(self.platform_templates)} 平台")
         
@@ -150,146 +2816,776 @@ class AutoTrainingBot:
         else:
             return 5
     
-    def find_objects(self, templates, threshold=0.7, debug=False):
-        """通用物件偵測函數 - 保留所有偵測結果"""
-        screenshot = pyautogui.screenshot()
-        screenshot_np = cv2.cvtColor(np.array(screenshot), cv2.COLOR_RGB2BGR)
-        screenshot_gray = cv2.cvtColor(screenshot_np, cv2.COLOR_BGR2GRAY)
+    def set_game_region(self, region):
+        """手動設定遊戲視窗區域 (x, y, w, h)，None 表示使用整個螢幕"""
+        if region is not None:
+            screen_width, screen_height = self.frame_source.size()
+            x, y, w, h = [int(v) for v in region]
+            x = max(0, min(x, screen_width - 1))
+            y = max(0, min(y, screen_height - 1))
+            region = (x, y, min(w, screen_width - x), min(h, screen_height - y))
+        self.game_region = region
+        print(f"遊戲視窗區域: {region if region else '整個螢幕'}")
+    
+    def locate_game_window(self, threshold=0.8):
+        """使用視窗邊框模板自動定位遊戲視窗（只需執行一次）"""
+        self.window_locate_attempted = True
+        if 'tl' not in self.game_window_templates:
+            return None
         
-        # 創建 screens 目錄（如果不存在）
-        screens_dir = 'screens'
-        if not os.path.exists(screens_dir):
-            os.makedirs(screens_dir)
+        try:
+            frame = self.frame_source.grab()
+        except FrameSourceExhausted:
+            return None
         
-        # 保存原始截圖
-        timestamp = time.strftime("%Y%m%d_%H%M%S")
-        screenshot_path = os.path.join(screens_dir, f"screenshot_{timestamp}.png")
-        screenshot.save(screenshot_path)
+        top_left = self.game_window_templates['tl']
+        result = cv2.matchTemplate(frame.gray, top_left, cv2.TM_CCOEFF_NORMED)
+        _, tl_confidence, _, tl_loc = cv2.minMaxLoc(result)
+        if tl_confidence < threshold:
+            print(f"⚠️  無法定位遊戲視窗 (信心度: {tl_confidence:.2f})，使用整個螢幕")
+            return None
         
-        objects_found = []
-        debug_image = screenshot_np.copy()  # 用於標記偵測結果
+        x, y = tl_loc
+        width, height = self.game_window_size
+        
+        # 有右下角模板時，用兩個角決定視窗大小
+        if 'br' in self.game_window_templates:
+            bottom_right = self.game_window_templates['br']
+            result = cv2.matchTemplate(frame.gray[y:, x:], bottom_right, cv2.TM_CCOEFF_NORMED)
+            _, br_confidence, _, br_loc = cv2.minMaxLoc(result)
+            if br_confidence >= threshold:
+                width = br_loc[0] + bottom_right.shape[1]
+                height = br_loc[1] + bottom_right.shape[0]
+        
+        self.set_game_region((x, y, width, height))
+        return self.game_region
+    
+    def set_minimap_region(self, region):
+        """手動設定小地圖區域 (x, y, w, h)（螢幕座標），None 表示不使用小地圖"""
+        self.minimap_reader.region = tuple(int(v) for v in region) if region is not None else None
+        self.minimap_reader.position = None
+        self.minimap_reader.timestamp = 0
+        self.minimap_locate_attempted = True
+        if region is not None:
+            self.minimap_calibration.store_size(self.get_resolution_key(), region[2:])
+        print(f"小地圖區域: {self.minimap_reader.region if region else '未使用'}")
+    
+    def locate_minimap(self, frame=None):
+        """使用小地圖邊角模板自動定位小地圖（只需執行一次）"""
+        self.minimap_locate_attempted = True
+        if 'tl' not in self.minimap_templates:
+            return None
+        if frame is None:
+            try:
+                frame = self.frame_source.grab(region=self.game_region)
+            except FrameSourceExhausted:
+                return None
+        resolution = self.get_resolution_key()
+        size = self.minimap_calibration.size_for(resolution) or self.minimap_size
+        region = self.minimap_reader.locate(frame, self.minimap_templates, size)
+        if region is not None:
+            print(f"小地圖區域: {region}")
+            if 'br' in self.minimap_templates:
+                self.minimap_calibration.store_size(resolution, region[2:])
+        return region
+    
+    def get_resolution_key(self):
+        """目前遊戲畫面的解析度（小地圖大小依解析度保存）"""
+        width, height = self.get_view()[1]
+        return f"{width}x{height}"
+    
+    def read_minimap(self, frame=None):
+        """讀取小地圖上的玩家位置（小地圖座標），找不到時回傳 None
+        
+        彩色畫面直接讀取，結果存在畫面上（同一張畫面只讀一次）；沒有傳入畫面
+        （或畫面是沒有彩色的高速灰階擷取）時只擷取小地圖區域。重播畫面時不額外擷取。
+        """
+        if frame is not None and 'minimap_position' in frame.derived:
+            return frame.derived['minimap_position']
+        minimap_frame = self.get_minimap_frame(frame)
+        if minimap_frame is None:
+            return None
+        position = self.minimap_reader.read(minimap_frame)
+        if minimap_frame is frame:
+            frame.derived['minimap_position'] = position
+        return position
+    
+    def get_minimap_frame(self, frame=None):
+        """包含小地圖的彩色畫面：傳入的畫面可用時直接使用，否則只擷取小地圖區域"""
+        if not self.use_minimap:
+            return None
+        if self.minimap_reader.region is None and not self.minimap_locate_attempted:
+            self.locate_minimap(frame)
+        if self.minimap_reader.region is None:
+            return None
+        
+        if frame is not None and frame.has_color:
+            return frame
+        if not self.frame_source.live:
+            return None
+        return self.frame_source.grab(region=self.minimap_reader.region)
+    
+    def get_map_fingerprint(self, frame=None):
+        """目前地圖的指紋（小地圖的平均雜湊），同一張畫面只計算一次，沒有小地圖時回傳 None"""
+        if frame is not None and 'map_fingerprint' in frame.derived:
+            return frame.derived['map_fingerprint']
+        minimap_frame = self.get_minimap_frame(frame)
+        fingerprint = self.minimap_reader.fingerprint(minimap_frame) if minimap_frame is not None else None
+        if frame is not None:
+            frame.derived['map_fingerprint'] = fingerprint
+        if fingerprint is not None:
+            self.activate_minimap_scale(fingerprint)
+        return fingerprint
+    
+    def activate_minimap_scale(self, fingerprint):
+        """切換到這張地圖校正過的比例，還沒校正時使用 default_minimap_scale"""
+        scale = self.minimap_calibration.scale_for(fingerprint)
+        self.minimap_scale_calibrated = scale is not None
+        self.minimap_scale = scale if scale is not None else self.default_minimap_scale
+    
+    def find_ropes(self, frame=None, threshold=None):
+        """偵測繩子：以 rope_query_threshold 比對一次（同一個 tick 沿用），再過濾出信心度 >= threshold 的結果
+        
+        threshold 為 None 時使用 rope_threshold（主迴圈），角色在繩子上的判斷使用較低的閾值，
+        兩者共用同一次比對、同一份偵測快取與地圖快取。
+        """
+        query_threshold = self.rope_query_threshold
+        if threshold is None:
+            threshold = self.rope_threshold
+        ropes = self.find_static_objects(self.rope_templates, min(threshold, query_threshold), frame=frame)
+        if threshold <= query_threshold:
+            return ropes
+        return ropes.take(ropes.confidence >= threshold)
+    
+    def find_static_objects(self, templates, threshold, frame=None):
+        """偵測繩子、平台：地圖上的每個範圍只比對一次，之後從地圖快取換算成目前的螢幕座標
+        
+        需要小地圖（地圖指紋與玩家位置）與校正過的比例；沒有小地圖或停用快取時每次都比對。
+        只回傳目前遊戲畫面範圍內的物件，與直接比對的結果一致。
+        """
+        template_type = self.get_template_type(templates)
+        if not self.use_map_cache or template_type not in ('ropes', 'platforms'):
+            return self.find_objects(templates, threshold=threshold, frame=frame)
+        if frame is None:
+            frame = self.capture_frame()
+        fingerprint = self.get_map_fingerprint(frame)
+        player_map = self.get_player_map_position(frame) if fingerprint is not None else None
+        if player_map is None:
+            return self.find_objects(templates, threshold=threshold, frame=frame)
+        if not self.minimap_scale_calibrated:
+            # 這張地圖的比例還沒校正（換算的座標不準）：直接比對，並用鏡頭捲動的距離估算比例
+            objects = self.find_objects(templates, threshold=threshold, frame=frame)
+            if self.minimap_calibration.observe(fingerprint, template_type, player_map, objects) is not None:
+                self.activate_minimap_scale(fingerprint)
+            return objects
+        
+        key = f"{template_type}@{threshold}:" + ",".join(sorted(template['name'] for template in templates))
+        use_key = (self.map_cache.find_map(fingerprint) or fingerprint, key)
+        view_origin, view_size = self.get_view()
+        view_box = self.minimap_reader.view_box(player_map, view_size, self.minimap_scale)
+        records = self.map_cache.lookup(fingerprint, key)
+        if (records is None or not self.map_cache.is_scanned(fingerprint, key, view_box)
+                or self.map_cache_uses.get(use_key, 0) >= self.map_cache_verify_interval):
+            # 第一次來到這張地圖、畫面移到還沒比對過的範圍，或定期確認：比對後合併進地圖快取
+            objects = self.find_objects(templates, threshold=threshold, frame=frame)
+            # 所有物件用同一個玩家位置換算成小地圖座標
+            offset_x, offset_y = self.minimap_reader.camera_offset(player_map, view_size, self.minimap_scale)
+            map_x = (objects.x - view_origin[0] + offset_x) / self.minimap_scale
+            map_y = (objects.y - view_origin[1] + offset_y) / self.minimap_scale
+            records = [[objects.names[template_id], round(float(x), 2), round(float(y), 2), int(width), int(height),
+                        round(float(confidence), 4), float(scale)]
+                       for template_id, x, y, width, height, confidence, scale in
+                       zip(objects.template_id, map_x, map_y, objects.width, objects.height,
+                           objects.confidence, objects.scale)]
+            merged = self.map_cache.store(fingerprint, key, records, view_box)
+            self.map_cache_uses[use_key] = 0
+            print(f"🗺️  已記錄這張地圖的 {template_type} 位置: 這次 {len(records)} 個，共 {len(merged)} 個")
+            return objects
+        self.map_cache_uses[use_key] = self.map_cache_uses.get(use_key, 0) + 1
+        
+        if not records:
+            return DetectionBatch.empty()
+        names = sorted({record[0] for record in records})
+        columns = list(zip(*records))
+        offset_x, offset_y = self.minimap_reader.camera_offset(player_map, view_size, self.minimap_scale)
+        x = np.rint(view_origin[0] + np.array(columns[1]) * self.minimap_scale - offset_x)
+        y = np.rint(view_origin[1] + np.array(columns[2]) * self.minimap_scale - offset_y)
+        objects = DetectionBatch(x, y, columns[3], columns[4], columns[5], columns[6],
+                                 [names.index(name) for name in columns[0]],
+                                 np.full(len(records), DETECTION_TYPES.index(template_type)),
+                                 names, np.full(len(names), np.nan))
+        visible = ((objects.x + objects.width > view_origin[0]) & (objects.x < view_origin[0] + view_size[0]) &
+                   (objects.y + objects.height > view_origin[1]) & (objects.y < view_origin[1] + view_size[1]))
+        return objects.take(visible)
+    
+    def invalidate_map_cache(self, current_map_only=True):
+        """清除地圖快取（預設只清除目前的地圖），下一次偵測會重新比對繩子與平台"""
+        fingerprint = self.get_map_fingerprint() if current_map_only else None
+        if current_map_only and fingerprint is None:
+            print("⚠️  讀不到小地圖，無法判斷目前的地圖")
+            return
+        self.map_cache.invalidate(fingerprint)
+        self.map_cache_uses = {}
+        print("🗺️  地圖快取已清除")
+    
+    def get_player_map_position(self, frame=None, fresh=False):
+        """玩家在小地圖上的位置（小地圖座標），讀不到玩家標記或沒有小地圖時回傳 None
+        
+        預設從這個 tick 的畫面讀取（同一張畫面只讀一次），不另外擷取；
+        fresh=True（動作之間需要目前位置）或畫面沒有彩色時，上次讀取超過 minimap_max_age 秒
+        才只擷取小地圖區域重新讀取。上次讀取失敗時回傳 None，不沿用更早的位置。
+        """
+        if frame is None and not fresh:
+            frame = self.current_frame
+        if frame is not None and frame.has_color:
+            return self.read_minimap(frame)
+        reader = self.minimap_reader
+        if time.time() - reader.timestamp > self.minimap_max_age:
+            self.read_minimap()
+        return reader.position
+    
+    def get_view(self):
+        """遊戲畫面的 (左上角螢幕座標, 大小)"""
+        if self.game_region is not None:
+            x, y, w, h = self.game_region
+            return (x, y), (w, h)
+        return (0, 0), self.frame_source.size()
+    
+    def map_to_screen(self, map_position):
+        """小地圖座標換算成螢幕座標（需要已讀到玩家位置）"""
+        view_origin, view_size = self.get_view()
+        return self.minimap_reader.to_screen(map_position, self.get_player_map_position(), view_origin, view_size,
+                                             self.minimap_scale)
+    
+    def screen_to_map(self, screen_position):
+        """螢幕座標換算成小地圖座標（需要已讀到玩家位置）"""
+        view_origin, view_size = self.get_view()
+        return self.minimap_reader.to_map(screen_position, self.get_player_map_position(), view_origin, view_size,
+                                          self.minimap_scale)
+    
+    def needs_color_frames(self):
+        """是否有需要彩色畫面的功能（顏色預篩選、小地圖讀取）"""
+        return (self.use_color_prefilter and bool(self.color_prefilters)) or self.use_minimap
+    
+    def start_capture_thread(self, mode=None):
+        """啟動背景擷取執行緒，讓截圖與偵測、按鍵操作同時進行
+        
+        mode 預設為 self.capture_mode；有需要彩色畫面的功能時一律擷取 BGR。
+        """
+        mode = mode or self.capture_mode
+        if mode == 'gray' and self.needs_color_frames():
+            print("⚠️  顏色預篩選或小地圖需要彩色畫面，背景擷取改為 BGR")
+            mode = 'bgr'
+        if self.game_region is None and not self.window_locate_attempted:
+            self.locate_game_window()
+        self.stop_capture_thread()
+        self.capture_thread = CaptureThread(self.frame_source, region=self.game_region, mode=mode)
+        self.capture_thread.start()
+        print(f"背景擷取已啟動（{mode}）")
+    
+    def stop_capture_thread(self):
+        """停止背景擷取執行緒"""
+        if self.capture_thread is not None:
+            self.capture_thread.stop()
+            print(f"背景擷取已停止: 共 {self.capture_thread.sequence} 張，丟棄 {self.capture_thread.dropped} 張過期畫面")
+            self.capture_thread = None
+    
+    def capture_frame(self):
+        """擷取一張畫面 - 每個 tick 只呼叫一次，結果傳給所有偵測器
+        
+        畫面來源沒有畫面時（重播結束）拋出 FrameSourceExhausted，呼叫端不會拿到 None：
+        直接擷取時由畫面來源拋出，背景擷取停止後 latest() 回傳 None 時在這裡拋出。
+        """
+        if self.game_region is None and not self.window_locate_attempted:
+            self.locate_game_window()
+        
+        if self.capture_thread is not None:
+            # 背景擷取：取最新的一張，盡量等到比上一個 tick 更新的畫面
+            frame = self.capture_thread.latest(timeout=self.max_frame_wait)
+            if frame is None:
+                raise FrameSourceExhausted("畫面來源已結束，沒有新的畫面")
+        else:
+            frame = self.frame_source.grab(region=self.game_region)
+        self.frame_count += 1
+        frame.index = self.frame_count
+        self.current_frame = frame
+        if self.session_recorder is not None:
+            self.session_recorder.append(frame)
+        return frame
+    
+    def start_recording(self, directory, compression='delta'):
+        """開始把每個 tick 的畫面錄製到 directory"""
+        self.stop_recording()
+        self.session_recorder = SessionRecorder(directory, compression=compression)
+        print(f"開始錄製畫面: {directory}（{compression}）")
+    
+    def stop_recording(self):
+        """停止錄製並關閉錄製檔"""
+        if self.session_recorder is not None:
+            recorder = self.session_recorder
+            self.session_recorder = None
+            recorder.close()
+            print(f"錄製結束: {recorder.frames} 張畫面, {recorder.bytes_written / 1024 ** 2:.1f} MB，"
+                  f"佇列滿時丟棄 {recorder.dropped} 張")
+    
+    def get_template_type(self, templates):
+        """判斷模板清單屬於哪一類物件"""
+        if templates is self.monster_templates:
+            return "monsters"
+        elif templates is self.rope_templates:
+            return "ropes"
+        elif templates is self.platform_templates:
+            return "platforms"
+        return "unknown"
+    
+    def find_objects(self, templates, threshold=0.7, debug=False, frame=None, match_mode=None):
+        """通用物件偵測函數 - 保留所有偵測結果
+        
+        match_mode: 'exhaustive'（完整比對）或 'coarse'（由粗到細），
+        不指定時依 self.match_modes 中該物件類型的設定。
+        """
+        if frame is None:
+            frame = self.capture_frame()
         
         # 確定模板類型（用於debug）
-        template_type = "unknown"
-        if templates == self.monster_templates:
-            template_type = "monsters"
-        elif templates == self.rope_templates:
-            template_type = "ropes"
-        elif templates == self.platform_templates:
-            template_type = "platforms"
+        template_type = self.get_template_type(templates)
+        if match_mode is None:
+            match_mode = self.match_modes.get(template_type, 'exhaustive')
+        
+        # 區塊差異偵測：只在有變化的區域重新比對，沒變化的區域沿用上次結果
+        search_regions = None
+        carried_objects = DetectionBatch.empty()
+        cache_key = (template_type, threshold, match_mode)
+        
+        # 同一個 tick（同一張畫面）已經偵測過時直接沿用，不重新比對也不重複保存圖像
+        tick_frame, tick_results = self.tick_detections
+        if not debug and tick_frame is frame and cache_key in tick_results:
+            return tick_results[cache_key]
+        if self.use_dirty_regions and not debug and template_type != "unknown":
+            dirty_tiles = self.dirty_tracker.changed_tiles(frame, cache_key)
+            cached = self.detection_cache.get(cache_key)
+            if dirty_tiles is not None and cached is not None:
+                if not dirty_tiles.any():
+                    # 畫面完全相同（暫停、開啟選單）- 直接沿用上次結果
+                    return cached
+                margin = self.get_template_margin(templates)
+                search_regions = self.dirty_tracker.dirty_regions(dirty_tiles, frame.size, margin)
+                local_boxes = cached.boxes - np.array([frame.origin[0], frame.origin[1], 0, 0])
+                carried_objects = cached.take(~self.box_inside_regions(local_boxes, search_regions))
+        
+        verbose = debug or self.debug_level >= 2  # 只影響輸出，不影響快取與追蹤
+        if verbose:
+            print(f"開始偵測 {template_type}，使用 {len(templates)} 個模板，閾值: {threshold}，模式: {match_mode}")
+        
+        calibration = None
+        if self.use_scale_lock and template_type != "unknown":
+            calibration = self.get_scale_calibration(frame)
+        
+        # 物件追蹤：已知物件只在預測位置附近的小視窗重新比對
+        objects_found = None
+        tracker = None
+        if self.use_tracking and not debug and template_type != "unknown":
+            tracker = self.object_trackers.get(cache_key)
+            if tracker is None:
+                tracker = ObjectTracker(self.full_scan_interval, self.tracking_margin)
+                self.object_trackers[cache_key] = tracker
+            if not tracker.needs_full_scan():
+                windows = tracker.search_windows(frame)
+                objects_found = self.match_templates(frame, templates, threshold, template_type,
+                                                     search_regions=windows, match_mode=match_mode,
+                                                     calibration=calibration)
+                if not tracker.update_local(frame, windows, objects_found):
+                    objects_found = None  # 有物件追蹤失敗，改做完整比對
+        
+        if objects_found is None:
+            if tracker is not None and not tracker.last_scan_full:
+                # 上一次是追蹤比對，快取可能缺少新出現的物件，差異區塊不可靠
+                search_regions = None
+                carried_objects = DetectionBatch.empty()
+            
+            if search_regions is None and self.use_color_prefilter and template_type in self.color_prefilters:
+                candidates = self.color_filter.candidate_regions(frame, self.color_prefilters[template_type],
+                                                                 self.get_template_margin(templates))
+                if candidates:
+                    search_regions = candidates
+                if verbose:
+                    print(f"顏色預篩選: {len(candidates) if candidates else 0} 個候選區域"
+                          f"{'' if candidates else '，改為比對整張畫面'}")
+            
+            objects_found = self.match_templates(frame, templates, threshold, template_type,
+                                                 search_regions=search_regions, match_mode=match_mode, debug=verbose,
+                                                 calibration=calibration)
+            
+            # 加上沒有變化區域沿用的結果
+            objects_found = DetectionBatch.concatenate([objects_found, carried_objects])
+            if tracker is not None:
+                tracker.update_full(objects_found)
+        
+        if template_type != "unknown":
+            self.detection_cache[cache_key] = objects_found
+            if tick_frame is not frame:
+                self.tick_detections = (frame, {})
+            self.tick_detections[1][cache_key] = objects_found
+        
+        # 抽樣保存原始截圖與標記後的偵測結果（背景寫入，標記在寫入前才從最終結果繪製）
+        if debug or self.should_save_debug(frame, template_type, len(objects_found)):
+            screenshot_job, debug_job = self.save_detection_debug(frame, template_type, objects_found)
+            if verbose:
+                print(f"Debug 圖像排入背景保存: {screenshot_job}, {debug_job}")
+        
+        if verbose:
+            print(f"偵測到 {len(objects_found)} 個 {template_type}（已去除重疊）")
         
-        if debug:
-            print(f"開始偵測 {template_type}，使用 {len(templates)} 個模板，閾值: {threshold}")
+        return objects_found
+    
+    def should_save_debug(self, frame, kind, state):
+        """這個 tick 是否保存 kind 的 debug 圖像：每 debug_image_interval 個 tick 一次，或狀態改變時
         
-        for template_info in templates:
-            template = template_info['template']
+        debug_level 為 0 時永遠不保存，為 2 時每個 tick 都保存。
+        """
+        if self.debug_level <= 0:
+            return False
+        if self.debug_level >= 2:
+            return True
+        changed = self.debug_states.get(kind) != state
+        self.debug_states[kind] = state
+        if self.debug_on_change and changed:
+            return True
+        return bool(self.debug_image_interval) and frame.index % self.debug_image_interval == 0
+    
+    def debug_image(self, frame):
+        """這張畫面交給背景寫入用的影像複本（同一張畫面只複製一次）"""
+        image = frame.derived.get('debug_image')
+        if image is None:
+            image = frame.snapshot()
+            frame.derived['debug_image'] = image
+        return image
+    
+    def save_detection_debug(self, frame, template_type, objects_found):
+        """把原始截圖（同一張畫面只保存一次）與標記偵測結果的圖像排入背景寫入，回傳兩個 DebugImageJob
+        
+        標記圖像在背景執行緒寫入前才從最終偵測結果繪製，偵測迴圈只負責複製一次畫面。
+        """
+        image = self.debug_image(frame)
+        screenshot_job = frame.derived.get('debug_screenshot')
+        if screenshot_job is None:
+            screenshot_job = self.debug_writer.submit("screenshot", image)
+            frame.derived['debug_screenshot'] = screenshot_job
+        
+        if template_type == "monsters":
+            color = (0, 255, 0)  # 綠色
+        elif template_type == "ropes":
+            color = (255, 0, 0)  # 藍色
+        elif template_type == "platforms":
+            color = (0, 0, 255)  # 紅色
+        else:
+            color = (255, 255, 0)  # 青色
+        origin_x, origin_y = frame.origin
+        
+        def render():
+            # 在 debug 圖像上標記偵測到的物件
+            debug_image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR) if image.ndim == 2 else image.copy()
+            for obj in objects_found:
+                x, y = obj.x - origin_x, obj.y - origin_y
+                cv2.rectangle(debug_image, (x, y), (x + obj.width, y + obj.height), color, 2)
+                cv2.putText(debug_image, f"{obj.name}:{obj.confidence:.2f}", (x, y-10), 
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+            return debug_image
+        
+        debug_job = self.debug_writer.submit(f"detection_{template_type}", render)
+        return screenshot_job, debug_job
+    
+    def match_templates(self, frame, templates, threshold, template_type="unknown",
+                        search_regions=None, match_mode='exhaustive', debug=False, calibration=None):
+        """對畫面比對所有模板與尺度，回傳偵測結果（不保存圖像，不使用快取）
+        
+        有 calibration 時只搜尋已鎖定的尺度，並把每個模板的最佳匹配回報給校正。
+        """
+        frame_width, frame_height = frame.size
+        if search_regions is None:
+            search_regions = [(0, 0, frame_width, frame_height)]
+        
+        # 先列出所有 (模板, 尺度) 工作，比對可以平行執行
+        jobs = []
+        for template_index, template_info in enumerate(templates):
             name = template_info['name']
+            pyramid = self.get_template_pyramid(template_info)
             
-            if debug:
-                print(f"  正在匹配模板: {name} (尺寸: {template.shape})")
+            # 多尺度匹配（使用載入時建好的模板金字塔）
+            variants = pyramid.variants
+            if calibration is not None:
+                variants = [pyramid.get(scale) for scale in
+                            calibration.scales_for(name, [variant.scale for variant in variants])]
             
-            # 多尺度匹配
-            best_matches_for_template = []
-            for scale in [0.8, 0.9, 1.0, 1.1, 1.2]:
-                width = int(template.shape[1] * scale)
-                height = int(template.shape[0] * scale)
-                
-                if width > screenshot_gray.shape[1] or height > screenshot_gray.shape[0]:
+            for variant in variants:
+                if variant.width > frame_width or variant.height > frame_height:
                     continue
-                    
-                resized_template = cv2.resize(template, (width, height))
-                result = cv2.matchTemplate(screenshot_gray, resized_template, cv2.TM_CCOEFF_NORMED)
-                locations = np.where(result >= threshold)
+                coarse_variant = None
+                if match_mode == 'coarse':
+                    coarse_variant = pyramid.coarse(variant.scale, self.coarse_factor)
+                jobs.append((template_index, variant, coarse_variant))
+        
+        detection_pool = self.get_detection_pool(frame, template_type, templates)
+        if detection_pool is not None:
+            # 行程池：畫面寫入共享記憶體一次，各工作行程比對自己負責的模板後回傳陣列
+            scales_by_template = {}
+            for template_index, variant, _ in jobs:
+                scales_by_template.setdefault(template_index, []).append(variant.scale)
+            settings = {'match_engine': self.match_engine, 'coarse_factor': self.coarse_factor,
+                        'coarse_threshold_drop': self.coarse_threshold_drop}
+            hits, best_matches = detection_pool.match(frame, template_type, threshold, search_regions, match_mode,
+                                                      scales_by_template, settings)
+            if debug:
+                peak_count = len(hits[3]) if hits is not None else 0
+                print(f"  行程池 ({detection_pool.workers} 個行程) 找到 {peak_count} 個峰值")
+        else:
+            hits, best_matches = self.merge_match_jobs(
+                templates, jobs, self.run_match_jobs(frame, jobs, search_regions, threshold, match_mode), debug)
+        
+        if calibration is not None:
+            for template_index, template_info in enumerate(templates):
+                best_confidence, best_scale = best_matches.get(template_index, (0, None))
+                calibration.observe(template_info['name'], best_confidence, best_scale)
+        
+        if hits is None:
+            return DetectionBatch.empty()
+        xs, ys, sizes, scores, scales, template_indices = hits
+        
+        # 跨尺度、跨模板的非極大值抑制：每個實際物件只保留信心度最高的一個
+        boxes = np.column_stack((xs, ys, sizes))
+        keep = non_max_suppression(boxes, scores, self.nms_iou_threshold)
+        if debug:
+            print(f"  非極大值抑制: {len(scores)} 個峰值 → {len(keep)} 個物件")
+        
+        # 直接以陣列回傳（螢幕座標：只截遊戲視窗時需要加上視窗位置）
+        # 怪物模板的優先級依 template_id 對應，沒有設定的模板為 NaN
+        origin_x, origin_y = frame.origin
+        type_code = DETECTION_TYPES.index(template_type) if template_type in DETECTION_TYPES else len(DETECTION_TYPES) - 1
+        return DetectionBatch(xs[keep] + origin_x, ys[keep] + origin_y, sizes[keep, 0], sizes[keep, 1],
+                              scores[keep], scales[keep], template_indices[keep], np.full(len(keep), type_code),
+                              [template_info['name'] for template_info in templates],
+                              [template_info.get('priority', np.nan) for template_info in templates])
+    
+    def merge_match_jobs(self, templates, jobs, job_results, debug=False):
+        """把各工作的峰值依工作清單順序合併成陣列（與執行緒數無關，結果固定）
+        
+        回傳 (hits, best_matches)，與 DetectionProcessPool.match 相同格式。
+        """
+        # 所有模板、所有尺度的峰值先收集成陣列，最後一起做非極大值抑制
+        hit_xs, hit_ys, hit_sizes, hit_scores, hit_scales, hit_templates = [], [], [], [], [], []
+        best_matches = {}
+        job_position = 0
+        for template_index, template_info in enumerate(templates):
+            name = template_info['name']
+            
+            if debug:
+                print(f"  正在匹配模板: {name} (尺寸: {template_info['template'].shape})")
+            
+            template_matches = 0
+            best_confidence = 0
+            best_scale = None
+            while job_position < len(jobs) and jobs[job_position][0] == template_index:
+                variant = jobs[job_position][1]
+                region_results = job_results[job_position]
+                job_position += 1
                 
                 scale_matches = 0
-                for pt in zip(*locations[::-1]):
-                    x, y = pt
-                    center_x = x + width // 2
-                    center_y = y + height // 2
-                    confidence = result[y, x]
-                    
-                    obj_info = {
-                        'name': name,
-                        'position': (center_x, center_y),
-                        'box': (x, y, width, height),
-                        'confidence': confidence,
-                        'scale': scale,
-                        'type': template_type
-                    }
-                    
-                    # 如果是怪物，添加優先級
-                    if 'priority' in template_info:
-                        obj_info['priority'] = template_info['priority']
-                    
-                    objects_found.append(obj_info)
-                    best_matches_for_template.append(obj_info)
-                    scale_matches += 1
-                    
-                    # 在 debug 圖像上標記偵測到的物件
-                    if template_type == "monsters":
-                        color = (0, 255, 0)  # 綠色
-                    elif template_type == "ropes":
-                        color = (255, 0, 0)  # 藍色
-                    elif template_type == "platforms":
-                        color = (0, 0, 255)  # 紅色
-                    else:
-                        color = (255, 255, 0)  # 青色
+                for xs, ys, scores in region_results:
+                    if not len(scores):
+                        continue
+                    if scores.max() > best_confidence:
+                        best_confidence = float(scores.max())
+                        best_scale = variant.scale
                     
-                    cv2.rectangle(debug_image, (x, y), (x + width, y + height), color, 2)
-                    cv2.putText(debug_image, f"{name}:{confidence:.2f}", (x, y-10), 
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+                    hit_xs.append(xs)
+                    hit_ys.append(ys)
+                    hit_sizes.append(np.tile((variant.width, variant.height), (len(xs), 1)))
+                    hit_scores.append(scores)
+                    hit_scales.append(np.full(len(xs), variant.scale))
+                    hit_templates.append(np.full(len(xs), template_index))
+                    scale_matches += len(xs)
                 
+                template_matches += scale_matches
                 if debug and scale_matches > 0:
-                    print(f"    尺度 {scale}: 找到 {scale_matches} 個匹配")
+                    print(f"    尺度 {variant.scale}: 找到 {scale_matches} 個峰值")
+            
+            if best_scale is not None:
+                best_matches[template_index] = (best_confidence, best_scale)
             
             if debug:
-                print(f"  模板 {name} 總共找到 {len(best_matches_for_template)} 個匹配")
+                print(f"  模板 {name} 總共找到 {template_matches} 個峰值")
+        
+        if not hit_scores:
+            return None, best_matches
+        
+        hits = (np.concatenate(hit_xs), np.concatenate(hit_ys), np.concatenate(hit_sizes),
+                np.concatenate(hit_scores), np.concatenate(hit_scales), np.concatenate(hit_templates))
+        return hits, best_matches
+    
+    def get_scale_calibration(self, frame):
+        """取得目前解析度與模板組合對應的尺度校正"""
+        names = sorted(info['name'] for info in
+                       self.monster_templates + self.rope_templates + self.platform_templates)
+        if self.player_on_rope_template is not None:
+            names.append('role_on_rope.png')
+        template_hash = hashlib.md5('|'.join(names).encode('utf-8')).hexdigest()[:12]
+        width, height = frame.size
+        self.scale_calibration.activate(f"{width}x{height}:{template_hash}")
+        return self.scale_calibration
+    
+    def run_match_jobs(self, frame, jobs, search_regions, threshold, match_mode):
+        """執行 (模板索引, 尺度, 縮小尺度) 工作，回傳與 jobs 同順序的 [每個區域的 (xs, ys, scores)]"""
+        def run(job):
+            _, variant, coarse_variant = job
+            return [self.match_variant(frame, variant, region, threshold, coarse_variant)
+                    for region in search_regions]
+        
+        pool = self.get_match_pool()
+        if pool is None or len(jobs) < 2:
+            return [run(job) for job in jobs]
+        
+        # 畫面的延遲計算結果（灰階、縮小畫面、FFT 頻譜）先在主執行緒算好，避免各執行緒重複計算
+        frame.gray
+        if match_mode == 'coarse':
+            frame.downscaled(self.coarse_factor)
+        if self.match_engine == 'fft':
+            self.get_fft_state(frame)
+        # executor.map 依輸入順序回傳結果
+        return list(pool.map(run, jobs))
+    
+    def get_match_pool(self):
+        """依 match_workers 建立（或重建）比對執行緒池，1 個執行緒時回傳 None
+        
+        執行緒池與 OpenCV 內部的平行化會互相搶 CPU：
+        使用多個工作執行緒時，把 OpenCV 的執行緒數分配為 CPU 數 / 工作執行緒數。
+        """
+        workers = max(1, int(self.match_workers))
+        if workers == self.match_pool_workers:
+            return self.match_pool
+        
+        self.shutdown_match_pool()
+        if workers > 1:
+            self.match_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='match')
+            cv2.setNumThreads(max(1, (os.cpu_count() or 1) // workers))
+        self.match_pool_workers = workers
+        return self.match_pool
+    
+    def shutdown_match_pool(self):
+        """關閉比對執行緒池並恢復 OpenCV 的執行緒數"""
+        if self.match_pool is not None:
+            self.match_pool.shutdown(wait=True)
+            self.match_pool = None
+            cv2.setNumThreads(self.opencv_threads)
+        self.match_pool_workers = 0
     
-        # 保存標記後的偵測結果圖像
-        debug_path = os.path.join(screens_dir, f"detection_{template_type}_{timestamp}.png")
-        cv2.imwrite(debug_path, debug_image)
+    def get_detection_pool(self, frame, template_type, templates):
+        """依 detection_processes 取得偵測行程池，不使用或模板不屬於已知類型時回傳 None
         
-        if debug:
-            print(f"Debug 圖像已保存: {screenshot_path}, {debug_path}")
-            print(f"偵測到 {len(objects_found)} 個 {template_type}（保留所有重疊）")
+        模板組合改變、行程數改變或畫面超過共享記憶體容量時重建行程池。
+        """
+        if self.detection_processes <= 0 or template_type == "unknown":
+            return None
         
-        return objects_found
+        template_sets = {}
+        for set_type, set_templates in [("monsters", self.monster_templates),
+                                        ("ropes", self.rope_templates),
+                                        ("platforms", self.platform_templates)]:
+            template_sets[set_type] = [(info['template'], [variant.scale for variant in self.get_template_pyramid(info)])
+                                       for info in set_templates]
+        width, height = frame.size
+        pool = self.detection_pool
+        if pool is not None and (pool.workers != self.detection_processes or pool.capacity < width * height
+                                 or pool.signature != DetectionProcessPool.make_signature(template_sets)):
+            self.shutdown_detection_pool()
+            pool = None
+        
+        if pool is None:
+            capacity = max(width * height, 1920 * 1080)
+            pool = DetectionProcessPool(template_sets, self.detection_processes, capacity)
+            self.detection_pool = pool
+            print(f"✅ 偵測行程池已啟動: {self.detection_processes} 個行程")
+        return pool
+    
+    def shutdown_detection_pool(self):
+        """停止偵測行程池"""
+        if self.detection_pool is not None:
+            self.detection_pool.close()
+            self.detection_pool = None
+    
+    def match_variant(self, frame, variant, region, threshold, coarse_variant=None):
+        """在畫面區域 (x, y, w, h) 內比對單一尺度的模板（使用目前的比對設定）"""
+        fft_engine = self.fft_engine if self.match_engine == 'fft' else None
+        return match_template_variant(frame, variant, region, threshold, coarse_variant,
+                                      self.coarse_factor, self.coarse_threshold_drop, fft_engine)
+    
+    def get_fft_state(self, frame):
+        """取得畫面的 FFT 頻譜與積分圖（每張畫面只計算一次）"""
+        return self.fft_engine.frame_state(frame)
+    
+    def get_template_pyramid(self, template_info):
+        """取得模板的多尺度金字塔（外部加入、沒有金字塔的模板會在第一次使用時建立）"""
+        pyramid = template_info.get('pyramid')
+        if pyramid is None:
+            pyramid = TemplatePyramid(template_info['template'], OBJECT_SCALES, template_info['name'])
+            template_info['pyramid'] = pyramid
+        return pyramid
+    
+    def get_template_margin(self, templates):
+        """模板在所有尺度中的最大寬高（區域搜尋需要外擴的邊界）"""
+        margin = 0
+        for template_info in templates:
+            margin = max(margin, self.get_template_pyramid(template_info).max_size())
+        return margin
+    
+    def box_inside_regions(self, boxes, regions):
+        """檢查每個 box (x, y, w, h) 是否完全落在任一搜尋區域內，回傳布林陣列"""
+        boxes = np.asarray(boxes).reshape(-1, 4)
+        x, y = boxes[:, 0], boxes[:, 1]
+        x2, y2 = x + boxes[:, 2], y + boxes[:, 3]
+        inside = np.zeros(len(boxes), dtype=bool)
+        for region_x, region_y, region_w, region_h in regions:
+            inside |= ((region_x <= x) & (region_y <= y) &
+                       (x2 <= region_x + region_w) & (y2 <= region_y + region_h))
+        return inside
 
     def remove_duplicates(self, objects, min_distance=50):
-        """移除重複偵測"""
-        if not objects:
-            return []
-        
-        # 先按信心度排序
-        objects.sort(key=lambda x: x['confidence'], reverse=True)
-        
-        filtered = []
-        for obj in objects:
-            is_duplicate = False
-            for existing in filtered:
-                dx = obj['position'][0] - existing['position'][0]
-                dy = obj['position'][1] - existing['position'][1]
-                distance = (dx**2 + dy**2)**0.5
-                
-                if distance < min_distance:
-                    is_duplicate = True
-                    break
-            
-            if not is_duplicate:
-                filtered.append(obj)
+        """移除重複偵測（objects 為 DetectionBatch）"""
+        if not len(objects):
+            return objects
         
-        return filtered
+        # 先按信心度排序
+        remaining = np.argsort(-objects.confidence, kind='stable')
+        positions = objects.positions.astype(np.float64)
+        
+        # 每次保留最高信心度的物件，並一次移除它附近的所有物件
+        filtered = []
+        while remaining.size:
+            best = remaining[0]
+            filtered.append(best)
+            distance = np.hypot(*(positions[remaining[1:]] - positions[best]).T)
+            remaining = remaining[1:][distance >= min_distance]
+        
+        return objects.take(np.array(filtered, dtype=np.intp))
     
     def get_player_position(self):
-        """估算玩家位置（螢幕中心）- 這只是估算"""
-        screen_width, screen_height = pyautogui.size()
+        """玩家位置（螢幕座標）
+        
+        有小地圖時由小地圖上的玩家標記換算；否則估算為遊戲視窗中心（未設定時為螢幕中心）。
+        """
+        map_position = self.get_player_map_position()
+        if map_position is not None:
+            return self.map_to_screen(map_position)
+        if self.game_region is not None:
+            x, y, w, h = self.game_region
+            return (x + w // 2, y + h // 2)
+        screen_width, screen_height = self.frame_source.size()
         return (screen_width // 2, screen_height // 2)
     
-    def get_precise_player_position(self):
+    def get_precise_player_position(self, frame=None):
         """嘗試精確檢測玩家位置（使用圖像辨識）"""
         # 如果有角色在繩子上的模板，可以嘗試使用它來檢測角色
         if self.player_on_rope_template is not None:
-            on_rope, rope_info = self.detect_player_on_rope()
+            on_rope, rope_info = self.detect_player_on_rope(frame)
             if on_rope and rope_info and 'position' in rope_info:
                 print(f"透過繩子模板檢測到角色位置: {rope_info['position']}")
                 return rope_info['position']
@@ -303,13 +3599,13 @@ class AutoTrainingBot:
     def detect_position_change_by_screenshot(self):
         """通過截圖比較檢測位置變化"""
         # 截取兩張圖片來比較變化
-        screenshot1 = pyautogui.screenshot()
+        # 背景擷取的畫面在下一次擷取後會被覆蓋，先複製
+        frame1 = self.capture_frame().copy()
         time.sleep(0.5)  # 短暫等待
-        screenshot2 = pyautogui.screenshot()
+        frame2 = self.capture_frame()
         
-        # 轉換為numpy陣列
-        img1 = cv2.cvtColor(np.array(screenshot1), cv2.COLOR_RGB2BGR)
-        img2 = cv2.cvtColor(np.array(screenshot2), cv2.COLOR_RGB2BGR)
+        img1 = frame1.bgr
+        img2 = frame2.bgr
         
         # 計算圖像差異
         diff = cv2.absdiff(img1, img2)
@@ -328,7 +3624,7 @@ class AutoTrainingBot:
         
         # 方法1: 截圖前後比較
         print("  截取動作前的畫面...")
-        screenshot_before = pyautogui.screenshot()
+        frame_before = self.capture_frame().copy()  # 背景擷取的緩衝區在下一次擷取後會被覆蓋
         
         # 執行動作
         print(f"  執行動作: {action_name}")
@@ -338,11 +3634,11 @@ class AutoTrainingBot:
         time.sleep(1.5)  # 增加等待時間讓動作充分完成
         
         print("  截取動作後的畫面...")
-        screenshot_after = pyautogui.screenshot()
+        frame_after = self.capture_frame()
         
         # 比較圖像差異
-        img1 = cv2.cvtColor(np.array(screenshot_before), cv2.COLOR_RGB2BGR)
-        img2 = cv2.cvtColor(np.array(screenshot_after), cv2.COLOR_RGB2BGR)
+        img1 = frame_before.bgr
+        img2 = frame_after.bgr
         
         diff = cv2.absdiff(img1, img2)
         gray_diff = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY)
@@ -351,25 +3647,16 @@ class AutoTrainingBot:
         total_pixels = gray_diff.shape[0] * gray_diff.shape[1]
         change_percentage = (change_pixels / total_pixels) * 100
         
-        # 保存對比圖像
-        timestamp = time.strftime("%Y%m%d_%H%M%S")
-        screens_dir = 'screens'
-        if not os.path.exists(screens_dir):
-            os.makedirs(screens_dir)
-        
-        # 保存差異圖像和前後對比
+        # 保存差異圖像和前後對比（背景寫入）
         safe_action_name = action_name.replace(' ', '_').replace('/', '_')
-        diff_path = os.path.join(screens_dir, f"diff_{safe_action_name}_{timestamp}.png")
-        before_path = os.path.join(screens_dir, f"before_{safe_action_name}_{timestamp}.png")
-        after_path = os.path.join(screens_dir, f"after_{safe_action_name}_{timestamp}.png")
-        
-        cv2.imwrite(diff_path, diff)
-        screenshot_before.save(before_path)
-        screenshot_after.save(after_path)
+        diff_job = self.debug_writer.submit(f"diff_{safe_action_name}", diff, dedup=False)
+        self.debug_writer.submit(f"before_{safe_action_name}", frame_before.snapshot(), dedup=False)
+        self.debug_writer.submit(f"after_{safe_action_name}", frame_after.snapshot(), dedup=False)
         
         print(f"  畫面變化: {change_percentage:.2f}%")
         print(f"  變化像素: {change_pixels:,} / {total_pixels:,}")
-        print(f"  圖像已保存: {safe_action_name}_{timestamp}.png")
+        diff_job.wait(timeout=5.0)
+        print(f"  差異圖像: {diff_job}（動作前後畫面另外排入保存）")
         
         # 調整判斷閾值並提供更詳細的分析
         if change_percentage > 2.0:  # 明顯變化
@@ -390,30 +3677,29 @@ class AutoTrainingBot:
             return False
     
     def select_target_monster(self, monsters):
-        """選擇目標怪物（優先怪物密集區域）"""
+        """選擇目標怪物（優先怪物密集區域），回傳 TargetArea"""
         if not monsters:
             return None
         
-        # 使用新的群組選擇邏輯
-        best_target = self.select_best_target_area(monsters)
-        
-        if best_target:
-            # 建立一個虛擬的目標物件
-            target_monster = {
-                'name': f"群組目標({best_target['monster_count']}隻)",
-                'position': best_target['position'],
-                'priority': 10,  # 群組目標給予高優先級
-                'is_cluster': True,
-                'monster_count': best_target['monster_count']
-            }
-            return target_monster
-        
-        return None
+        # 使用群組選擇邏輯
+        return self.select_best_target_area(monsters)
     
-    def move_to_target(self, target_pos):
-        """移動到目標位置"""
-        player_x, player_y = self.get_player_position()
-        target_x, target_y = target_pos
+    def move_to_target(self, target_pos, map_coordinates=False):
+        """移動到目標位置
+        
+        map_coordinates=True 時 target_pos 為小地圖座標，直接與小地圖上的玩家位置比較
+        （距離換算成遊戲畫面像素）。
+        """
+        if map_coordinates:
+            player_map = self.get_player_map_position()
+            if player_map is None:
+                print("⚠️  讀不到小地圖上的玩家位置，無法移動到小地圖座標")
+                return
+            player_x, player_y = player_map[0] * self.minimap_scale, player_map[1] * self.minimap_scale
+            target_x, target_y = target_pos[0] * self.minimap_scale, target_pos[1] * self.minimap_scale
+        else:
+            player_x, player_y = self.get_player_position()
+            target_x, target_y = target_pos
         
         dx = target_x - player_x
         dy = target_y - player_y
@@ -465,9 +3751,143 @@ class AutoTrainingBot:
                 self.keyboard.release(self.jump_key)
                 self.keyboard.release(self.move_keys['down'])
     
+    def hold_direction(self, direction, duration, jump=False):
+        """按住方向鍵 duration 秒（jump=True 時先按一次跳躍；direction 為 None 時只跳躍）"""
+        if self.use_pyautogui_keys:
+            if direction is not None:
+                pyautogui.keyDown(direction)
+            if jump:
+                pyautogui.press('space')
+            time.sleep(duration)
+            if direction is not None:
+                pyautogui.keyUp(direction)
+        else:
+            if direction is not None:
+                self.keyboard.press(self.move_keys[direction])
+            if jump:
+                self.keyboard.press(self.jump_key)
+                time.sleep(0.1)
+                self.keyboard.release(self.jump_key)
+            time.sleep(duration)
+            if direction is not None:
+                self.keyboard.release(self.move_keys[direction])
+    
+    def get_world_offset(self):
+        """螢幕座標加上這個位移就是地圖座標（遊戲畫面像素）；沒有小地圖時回傳 None"""
+        player_map = self.get_player_map_position()
+        if player_map is None:
+            return None
+        view_origin, view_size = self.get_view()
+        offset_x, offset_y = self.minimap_reader.camera_offset(player_map, view_size, self.minimap_scale)
+        return (offset_x - view_origin[0], offset_y - view_origin[1])
+    
+    def get_navigation_graph(self, platforms, ropes, frame=None):
+        """取得目前地圖的導航圖，回傳 (導航圖, 螢幕座標轉地圖座標的位移)
+        
+        有小地圖時導航圖依地圖指紋快取，看到新的平台或繩子、或畫面內已知的物件連續幾次沒有再看到時才重建（A* 路徑快取一併清除）；
+        沒有小地圖時以目前畫面的螢幕座標建立，不快取，位移為 None。
+        """
+        offset = self.get_world_offset()
+        fingerprint = self.get_map_fingerprint(frame) if offset is not None else None
+        if fingerprint is None:
+            return self.build_navigation_graph(platforms.boxes, ropes.boxes), None
+        
+        shift = np.array([offset[0], offset[1], 0, 0])
+        view_origin, view_size = self.get_view()
+        view = (view_origin[0] + offset[0], view_origin[1] + offset[1], view_size[0], view_size[1])
+        known = self.navigation_maps.get(self.map_cache.find_map(fingerprint) or fingerprint)
+        if known is None:
+            known = {'platforms': {}, 'ropes': {}, 'graph': None}
+            self.navigation_maps[self.map_cache.find_map(fingerprint) or fingerprint] = known
+        changed = self.update_navigation_boxes(known['platforms'], platforms.boxes + shift, view)
+        changed = self.update_navigation_boxes(known['ropes'], ropes.boxes + shift, view) or changed
+        if known['graph'] is None or changed:
+            known['graph'] = self.build_navigation_graph(sorted(known['platforms']), sorted(known['ropes']))
+            print(f"🧭 導航圖更新: {len(known['graph'].segments)} 個平台區段, {len(known['graph'].ropes)} 條繩子")
+        return known['graph'], offset
+    
+    def update_navigation_boxes(self, known_boxes, boxes, view):
+        """把這次看到的物件框（地圖座標）合併進導航圖的物件框 {框: 連續沒看到的次數}，回傳是否有變動
+        
+        和已知的框每個值相差在 navigation_snap 像素以內視為同一個（偵測誤差不會變成新物件）；
+        完整在畫面範圍 view (x, y, w, h) 內的已知框連續 navigation_miss_limit 次沒有看到就移除（誤判或已經不存在）。
+        """
+        snap = self.navigation_snap
+        keys = list(known_boxes)
+        known = np.array(keys, dtype=np.float64).reshape(-1, 4)
+        seen = np.zeros(len(keys), dtype=bool)
+        changed = False
+        for box in np.asarray(boxes, dtype=np.float64).reshape(-1, 4):
+            matches = np.all(np.abs(known - box) <= snap, axis=1)
+            if matches.any():
+                seen |= matches
+            else:
+                known_boxes[tuple(int(v) for v in np.rint(box / snap) * snap)] = 0
+                changed = True
+        
+        x, y, w, h = view
+        inside = ((known[:, 0] >= x) & (known[:, 1] >= y) &
+                  (known[:, 0] + known[:, 2] <= x + w) & (known[:, 1] + known[:, 3] <= y + h))
+        for key, was_seen, in_view in zip(keys, seen, inside):
+            if was_seen:
+                known_boxes[key] = 0
+            elif in_view:
+                known_boxes[key] += 1
+                if known_boxes[key] >= self.navigation_miss_limit:
+                    del known_boxes[key]
+                    changed = True
+        return changed
+    
+    def build_navigation_graph(self, platforms, ropes):
+        """用目前的移動參數建立導航圖"""
+        return NavigationGraph(platforms, ropes, walk_speed=self.walk_speed, climb_speed=self.climb_speed,
+                               jump_height=self.jump_height, jump_reach=self.jump_reach)
+    
+    def navigate_to(self, target_pos, platforms, ropes, frame=None):
+        """依導航圖規劃並執行到目標位置（螢幕座標）所在平台的路徑，無法規劃時回傳 False"""
+        if not self.use_navigation or not platforms:
+            return False
+        graph, offset = self.get_navigation_graph(platforms, ropes, frame)
+        shift_x, shift_y = offset if offset is not None else (0, 0)
+        player_x, player_y = self.get_player_position()
+        start = (player_x + shift_x, player_y + shift_y)
+        goal = (target_pos[0] + shift_x, target_pos[1] + shift_y)
+        steps = graph.plan(start, goal)
+        if not steps:
+            return False
+        
+        print(f"🧭 路徑: {' → '.join(step['action'] for step in steps)}（預估 {sum(step['time'] for step in steps):.1f} 秒）")
+        for step in steps:
+            self.execute_navigation_step(step, map_coordinates=offset is not None)
+        return True
+    
+    def execute_navigation_step(self, step, map_coordinates=False):
+        """執行一個導航動作
+        
+        導航圖使用地圖座標時，走路距離依小地圖上目前的玩家位置修正；否則按照規劃的時間移動。
+        """
+        action = step['action']
+        if action == 'walk':
+            # 前一個動作已經移動過，這裡需要目前的位置（不是這個 tick 畫面上的位置）
+            player_map = self.get_player_map_position(fresh=True) if map_coordinates else None
+            if player_map is None:
+                self.hold_direction(step['direction'], min(step['time'], 3.0))
+                return
+            distance = step['x'] - player_map[0] * self.minimap_scale
+            if abs(distance) > 10:
+                self.hold_direction('right' if distance > 0 else 'left', min(abs(distance) / self.walk_speed, 3.0))
+        elif action == 'jump':
+            self.hold_direction(step['direction'], 0.4 if step['direction'] else 0.1, jump=True)
+            time.sleep(max(step['time'] - 0.4, 0))
+        elif action == 'down_jump':
+            self.hold_direction('down', 0.2, jump=True)
+            time.sleep(step['time'])
+        elif action == 'climb':
+            self.hold_direction('up', step['time'], jump=True)
+    
     def attack_target(self, target_monster):
         """攻擊目標"""
-        if isinstance(target_monster, dict) and 'position' in target_monster:
+        if isinstance(target_monster, (dict, RecordAccess)) and 'position' in target_monster:
             target_pos = target_monster['position']
             is_cluster = target_monster.get('is_cluster', False)
             monster_count = target_monster.get('monster_count', 1)
@@ -549,11 +3969,10 @@ class AutoTrainingBot:
         player_x, player_y = self.get_player_position()
         
         # 找最近的繩子
-        closest_rope = min(ropes, key=lambda r: 
-            ((r['position'][0] - player_x)**2 + (r['position'][1] - player_y)**2)**0.5)
-        
-        rope_x, rope_y = closest_rope['position']
-        distance = ((rope_x - player_x)**2 + (rope_y - player_y)**2)**0.5
+        distances = np.hypot(ropes.center_x - player_x, ropes.center_y - player_y)
+        closest = int(np.argmin(distances))
+        rope_x = int(ropes.center_x[closest])
+        distance = float(distances[closest])
         
         if distance < 80:  # 靠近繩子
             print("移動到繩子並開始爬行")
@@ -593,22 +4012,23 @@ class AutoTrainingBot:
         
         return False
     
-    def detect_player_on_rope(self):
+    def detect_player_on_rope(self, frame=None):
         """改進版：偵測玩家是否在繩子上（使用圖像模板）"""
+        if frame is None:
+            frame = self.capture_frame()
+        
         if self.player_on_rope_template is None:
             print("沒有玩家在繩子上的模板，使用位置估算")
-            return self.detect_player_on_rope_fallback()
+            return self.detect_player_on_rope_fallback(frame)
         
-        # 截取螢幕
-        screenshot = pyautogui.screenshot()
-        screenshot_np = cv2.cvtColor(np.array(screenshot), cv2.COLOR_RGB2BGR)
+        if self.player_rope_fast_mode:
+            return self.detect_player_on_rope_fast(frame)
         
         # 使用多種預處理方式增強特徵
-        original_gray = cv2.cvtColor(screenshot_np, cv2.COLOR_BGR2GRAY)
+        original_gray = frame.gray
         
         # 圖像增強 - 對比度提升
-        enhanced_img = cv2.convertScaleAbs(screenshot_np, alpha=1.2, beta=10)
-        enhanced_gray = cv2.cvtColor(enhanced_img, cv2.COLOR_BGR2GRAY)
+        enhanced_gray = frame.enhanced_gray
         
         # 混合偵測策略
         detection_results = []
@@ -616,8 +4036,18 @@ class AutoTrainingBot:
         # 定義較低閾值以增加召回率
         base_threshold = 0.55
         
+        # 已鎖定尺度時只搜尋該尺度
+        variants = self.player_on_rope_pyramid.variants
+        calibration = None
+        if self.use_scale_lock:
+            calibration = self.get_scale_calibration(frame)
+            variants = [self.player_on_rope_pyramid.get(scale) for scale in
+                        calibration.scales_for('role_on_rope.png', [variant.scale for variant in variants])]
+        
         # 1. 先使用模板匹配 - 使用不同圖像和更寬的尺度範圍
         gray_images = [original_gray, enhanced_gray]
+        overall_confidence = 0
+        overall_scale = None
         for gray_idx, screenshot_gray in enumerate(gray_images):
             img_type = "原始" if gray_idx == 0 else "增強對比度"
             
@@ -626,16 +4056,16 @@ class AutoTrainingBot:
             best_location = None
             best_scale = 0
             
-            # 擴展尺度範圍
-            for scale in [0.7, 0.8, 0.9, 1.0, 1.1, 1.2, 1.3]:
-                # 調整模板大小
-                width = int(self.player_on_rope_template.shape[1] * scale)
-                height = int(self.player_on_rope_template.shape[0] * scale)
+            # 擴展尺度範圍（使用預先縮放好的模板）
+            for variant in variants:
+                scale = variant.scale
+                width = variant.width
+                height = variant.height
                 
                 if width > screenshot_gray.shape[1] or height > screenshot_gray.shape[0]:
                     continue
                     
-                resized_template = cv2.resize(self.player_on_rope_template, (width, height))
+                resized_template = variant.image
                 
                 # 模板匹配
                 result = cv2.matchTemplate(screenshot_gray, resized_template, cv2.TM_CCOEFF_NORMED)
@@ -643,9 +4073,13 @@ class AutoTrainingBot:
                 
                 if max_confidence > best_confidence:
                     best_confidence = max_confidence
-                    best_location = (max_loc[0] + width // 2, max_loc[1] + height // 2)
+                    best_location = frame.to_screen(max_loc[0] + width // 2, max_loc[1] + height // 2)
                     best_scale = scale
             
+            if best_confidence > overall_confidence:
+                overall_confidence = best_confidence
+                overall_scale = best_scale
+            
             if best_confidence >= base_threshold:
                 detection_results.append({
                     'confidence': best_confidence,
@@ -654,30 +4088,26 @@ class AutoTrainingBot:
                     'scale': best_scale
                 })
         
+        if calibration is not None:
+            calibration.observe('role_on_rope.png', overall_confidence, overall_scale, lock_confidence=0.7)
+        
         # 2. 如果上述方法沒有足夠的信心度，嘗試位置關係判斷
         if not detection_results or max(r['confidence'] for r in detection_results) < 0.7:
             # 找到畫面中的繩子
-            ropes = self.find_objects(self.rope_templates, threshold=0.7, debug=False)
+            ropes = self.find_ropes(frame, threshold=0.7)
             if ropes:
                 player_pos = self.get_player_position()
                 
-                for rope in ropes:
-                    rope_x, rope_y = rope['position']
-                    rope_box = rope['box']
-                    rope_width = rope_box[2]
-                    
-                    # 計算玩家與繩子中心的水平距離
-                    dx = abs(player_pos[0] - rope_x)
-                    
-                    # 如果玩家在繩子上方，dx應該很小
-                    if dx < rope_width/2 + 20:  # 加上一點容忍度
-                        rope_confidence = 0.6  # 基於位置的置信度設定
-                        detection_results.append({
-                            'confidence': rope_confidence,
-                            'position': (rope_x, player_pos[1]),  # 使用繩子的X座標和玩家的Y座標
-                            'method': "繩子位置關係",
-                            'rope_info': rope
-                        })
+                # 計算玩家與繩子中心的水平距離，如果玩家在繩子上方，dx應該很小（加上一點容忍度）
+                dx = np.abs(player_pos[0] - ropes.center_x)
+                for index in np.flatnonzero(dx < ropes.width / 2 + 20):
+                    rope_confidence = 0.6  # 基於位置的置信度設定
+                    detection_results.append({
+                        'confidence': rope_confidence,
+                        'position': (int(ropes.center_x[index]), player_pos[1]),  # 使用繩子的X座標和玩家的Y座標
+                        'method': "繩子位置關係",
+                        'rope_info': ropes[int(index)]
+                    })
         
         # 3. 選擇最佳結果
         if detection_results:
@@ -686,16 +4116,38 @@ class AutoTrainingBot:
             best_result = detection_results[0]
             
             print(f"偵測到玩家在繩子上！方法: {best_result['method']}, 信心度: {best_result['confidence']:.2f}")
+            if self.should_save_debug(frame, 'player_on_rope', True):
+                self.save_player_on_rope_debug(frame, best_result, detection_results)
             
-            # 保存debug圖像
-            timestamp = time.strftime("%Y%m%d_%H%M%S")
-            debug_image = screenshot_np.copy()
-            x, y = best_result['position']
-            
-            if 'scale' in best_result:  # 從模板匹配來的結果
-                scale = best_result['scale']
-                w = int(self.player_on_rope_template.shape[1] * scale)
-                h = int(self.player_on_rope_template.shape[0] * scale)
+            return True, self.player_on_rope_detection(best_result)
+        else:
+            self.debug_states['player_on_rope'] = False
+            print(f"玩家不在繩子上 (最高信心度: {max([r['confidence'] for r in detection_results] or [0]):.2f})")
+            return False, None
+    
+    def player_on_rope_detection(self, best_result):
+        """把最佳偵測結果轉成 Detection（中心點為偵測位置；位置關係判斷沒有大小）"""
+        width = height = 0
+        if 'scale' in best_result:
+            variant = self.player_on_rope_pyramid.get(best_result['scale'])
+            width, height = variant.width, variant.height
+        position_x, position_y = best_result['position']
+        return Detection('player_on_rope', position_x - width // 2, position_y - height // 2, width, height,
+                         float(best_result['confidence']), best_result.get('scale', 1.0), 'player_on_rope')
+    
+    def save_player_on_rope_debug(self, frame, best_result, detection_results):
+        """保存繩子上角色偵測的 debug 圖像（標記最佳結果並列出所有偵測結果，寫入前才繪製）"""
+        image = self.debug_image(frame)
+        x, y = frame.to_local(*best_result['position'])
+        size = None
+        if 'scale' in best_result:  # 從模板匹配來的結果
+            variant = self.player_on_rope_pyramid.get(best_result['scale'])
+            size = (variant.width, variant.height)
+        
+        def render():
+            debug_image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR) if image.ndim == 2 else image.copy()
+            if size is not None:
+                w, h = size
                 cv2.rectangle(debug_image, (x-w//2, y-h//2), (x+w//2, y+h//2), (0, 255, 255), 3)
             else:  # 從位置關係判斷來的結果
                 cv2.circle(debug_image, (int(x), int(y)), 30, (0, 255, 255), 3)
@@ -703,47 +4155,115 @@ class AutoTrainingBot:
             # 顯示所有偵測結果
             y_offset = 30
             for idx, result in enumerate(detection_results):
-                confidence = result['confidence']
-                method = result['method']
-                text = f"{idx+1}. {method}: {confidence:.2f}"
+                text = f"{idx+1}. {result['method']}: {result['confidence']:.2f}"
                 cv2.putText(debug_image, text, (10, y_offset), 
                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
                 y_offset += 25
-            
-            screens_dir = 'screens'
-            if not os.path.exists(screens_dir):
-                os.makedirs(screens_dir)
-            debug_path = os.path.join(screens_dir, f"player_on_rope_{timestamp}.png")
-            cv2.imwrite(debug_path, debug_image)
-            print(f"偵測結果已保存: {debug_path}")
-            
-            return True, {'name': 'player_on_rope', 'confidence': best_result['confidence'], 'position': best_result['position']}
-        else:
-            print(f"玩家不在繩子上 (最高信心度: {max([r['confidence'] for r in detection_results] or [0]):.2f})")
+            return debug_image
+        
+        debug_job = self.debug_writer.submit("player_on_rope", render)
+        print(f"偵測結果圖像: {debug_job}")
+    
+    def detect_player_on_rope_fast(self, frame):
+        """快速模式：只在預期位置附近的視窗搜尋繩子上的角色
+        
+        預期位置為上次偵測到的位置（沒有時用畫面中心估算），尺度從上次的尺度開始嘗試，
+        任一尺度達到 player_rope_confidence 立即結束；原始灰階不夠時才比對增強畫面，
+        最後才用同一個 tick 的繩子偵測結果判斷位置關係。
+        """
+        base_threshold = 0.55
+        
+        variants = self.player_on_rope_pyramid.variants
+        calibration = None
+        if self.use_scale_lock:
+            calibration = self.get_scale_calibration(frame)
+            variants = [self.player_on_rope_pyramid.get(scale) for scale in
+                        calibration.scales_for('role_on_rope.png', [variant.scale for variant in variants])]
+        last = self.last_player_on_rope
+        if last is not None:
+            variants = sorted(variants, key=lambda variant: abs(variant.scale - last.scale))
+        
+        # 搜尋視窗：預期位置周圍（畫面座標）
+        expected_x, expected_y = frame.to_local(*(last.position if last is not None else self.get_player_position()))
+        frame_width, frame_height = frame.size
+        reach_x = max(variant.width for variant in variants) + self.player_search_margin
+        reach_y = max(variant.height for variant in variants) + self.player_search_margin
+        x0, y0 = max(0, expected_x - reach_x), max(0, expected_y - reach_y)
+        x1, y1 = min(frame_width, expected_x + reach_x), min(frame_height, expected_y + reach_y)
+        
+        best_result = None
+        if x1 > x0 and y1 > y0:
+            windows = [("原始", lambda: frame.gray[y0:y1, x0:x1]),
+                       ("增強對比度", lambda: frame.enhanced_gray_window(x0, y0, x1, y1))]
+            for img_type, window_of in windows:
+                window = window_of()
+                for variant in variants:
+                    if variant.width > window.shape[1] or variant.height > window.shape[0]:
+                        continue
+                    result = cv2.matchTemplate(window, variant.image, cv2.TM_CCOEFF_NORMED)
+                    _, confidence, _, location = cv2.minMaxLoc(result)
+                    if best_result is None or confidence > best_result['confidence']:
+                        best_result = {
+                            'confidence': confidence,
+                            'position': frame.to_screen(x0 + location[0] + variant.width // 2,
+                                                        y0 + location[1] + variant.height // 2),
+                            'method': f"模板匹配 ({img_type}，局部視窗)",
+                            'scale': variant.scale
+                        }
+                    if confidence >= self.player_rope_confidence:
+                        break
+                if best_result is not None and best_result['confidence'] >= self.player_rope_confidence:
+                    break
+        
+        if calibration is not None and best_result is not None:
+            calibration.observe('role_on_rope.png', best_result['confidence'], best_result['scale'], lock_confidence=0.7)
+        
+        detection_results = [best_result] if best_result is not None and best_result['confidence'] >= base_threshold else []
+        
+        # 模板信心度不足時才用繩子位置關係判斷（沿用同一個 tick 的繩子偵測結果）
+        if not detection_results or detection_results[0]['confidence'] < self.player_rope_confidence:
+            ropes = self.find_ropes(frame, threshold=0.7)
+            player_pos = self.get_player_position()
+            dx = np.abs(player_pos[0] - ropes.center_x)
+            if (dx < ropes.width / 2 + 20).any():
+                index = int(np.argmin(dx))  # 最靠近玩家的繩子
+                detection_results.append({
+                    'confidence': 0.6,  # 基於位置的置信度設定
+                    'position': (int(ropes.center_x[index]), player_pos[1]),  # 使用繩子的X座標和玩家的Y座標
+                    'method': "繩子位置關係",
+                    'rope_info': ropes[index]
+                })
+                detection_results.sort(key=lambda x: x['confidence'], reverse=True)
+        
+        if not detection_results:
+            self.last_player_on_rope = None
+            self.debug_states['player_on_rope'] = False
+            print(f"玩家不在繩子上 (局部視窗最高信心度: {best_result['confidence'] if best_result else 0:.2f})")
             return False, None
+        
+        best_result = detection_results[0]
+        print(f"偵測到玩家在繩子上！方法: {best_result['method']}, 信心度: {best_result['confidence']:.2f}")
+        if self.save_player_rope_debug and self.should_save_debug(frame, 'player_on_rope', True):
+            self.save_player_on_rope_debug(frame, best_result, detection_results)
+        
+        detection = self.player_on_rope_detection(best_result)
+        self.last_player_on_rope = detection if 'scale' in best_result else None
+        return True, detection
     
-    def detect_player_on_rope_fallback(self):
+    def detect_player_on_rope_fallback(self, frame=None):
         """備用方法：使用位置估算偵測玩家是否在繩子上"""
         player_x, player_y = self.get_player_position()
         
         # 檢查玩家位置附近是否有繩子
-        ropes = self.find_objects(self.rope_templates, threshold=0.7)
+        ropes = self.find_ropes(frame, threshold=0.7)
         
-        for rope in ropes:
-            rope_x, rope_y = rope['position']
-            rope_box = rope['box']
-            
-            # 檢查玩家是否在繩子的範圍內
-            rope_left = rope_box[0]
-            rope_right = rope_box[0] + rope_box[2]
-            rope_top = rope_box[1]
-            rope_bottom = rope_box[1] + rope_box[3]
-            
-            # 如果玩家的 x 座標在繩子範圍內，且 y 座標也在繩子範圍內
-            if (rope_left - 20 <= player_x <= rope_right + 20 and 
-                rope_top - 20 <= player_y <= rope_bottom + 20):
-                print(f"偵測到玩家在繩子上: {rope['name']}")
-                return True, rope
+        # 如果玩家的 x 座標在繩子範圍內，且 y 座標也在繩子範圍內
+        inside = ((ropes.x - 20 <= player_x) & (player_x <= ropes.x + ropes.width + 20) &
+                  (ropes.y - 20 <= player_y) & (player_y <= ropes.y + ropes.height + 20))
+        if inside.any():
+            rope = ropes[int(np.argmax(inside))]
+            print(f"偵測到玩家在繩子上: {rope.name}")
+            return True, rope
         
         return False, None
 
@@ -846,8 +4366,13 @@ class AutoTrainingBot:
         return False
     
     def check_same_platform(self, monster_pos, tolerance=50):
-        """檢查怪物是否與玩家在同一平台"""
+        """檢查怪物是否與玩家在同一平台
+        
+        monster_pos 可以是單一座標，或 DetectionBatch（回傳每隻怪物的布林陣列）。
+        """
         player_x, player_y = self.get_player_position()
+        if isinstance(monster_pos, DetectionBatch):
+            return np.abs(player_y - monster_pos.center_y) <= tolerance
         monster_x, monster_y = monster_pos
         
         # 檢查 y 座標差異（垂直距離）
@@ -865,10 +4390,7 @@ class AutoTrainingBot:
             monsters = self.find_objects(self.monster_templates, threshold=0.7)
             
             # 檢查是否還有怪物在同一平台
-            platform_monsters = []
-            for monster in monsters:
-                if self.check_same_platform(monster['position']):
-                    platform_monsters.append(monster)
+            platform_monsters = monsters.take(self.check_same_platform(monsters))
             
             if not platform_monsters:
                 print("平台已清空")
@@ -885,22 +4407,28 @@ class AutoTrainingBot:
         print("開始自動練功...")
         print("按 Ctrl+C 可以停止")
         
+        if self.use_capture_thread:
+            self.start_capture_thread()
+        
         try:
             while True:
+                # 每個 tick 只截一次圖，所有偵測共用同一張畫面
+                try:
+                    frame = self.capture_frame()
+                except FrameSourceExhausted:
+                    print("畫面來源已結束（重播完畢）")
+                    break
+                self.read_minimap(frame)  # 讀取玩家位置（只處理小地圖區域，這個 tick 的換算都沿用）
+                
                 # 0. 首先檢查是否在繩子上
-                on_rope, rope_info = self.detect_player_on_rope()
+                on_rope, rope_info = self.detect_player_on_rope(frame)
                 if on_rope:
                     print("偵測到玩家在繩子上")
                     
                     # 檢查下方是否有怪物
-                    monsters = self.find_objects(self.monster_templates, threshold=0.7)
-                    monsters_below = []
+                    monsters = self.find_objects(self.monster_templates, threshold=0.7, frame=frame)
                     player_x, player_y = self.get_player_position()
-                    
-                    for monster in monsters:
-                        mx, my = monster['position']
-                        if my > player_y + 50:  # 怪物在下方
-                            monsters_below.append(monster)
+                    monsters_below = monsters.take(monsters.center_y > player_y + 50)  # 怪物在下方
                     
                     if monsters_below:
                         print(f"發現下方有 {len(monsters_below)} 隻怪物，下繩子攻擊")
@@ -927,9 +4455,9 @@ class AutoTrainingBot:
                         continue
                 
                 # 偵測所有物件
-                monsters = self.find_objects(self.monster_templates, threshold=0.7)
-                ropes = self.find_objects(self.rope_templates, threshold=self.rope_threshold)
-                platforms = self.find_objects(self.platform_templates, threshold=self.platform_threshold)
+                monsters = self.find_objects(self.monster_templates, threshold=0.7, frame=frame)
+                ropes = self.find_ropes(frame)
+                platforms = self.find_static_objects(self.platform_templates, self.platform_threshold, frame=frame)
                 
                 print(f"偵測到: {len(monsters)} 怪物, {len(ropes)} 繩子, {len(platforms)} 平台")
                 
@@ -946,6 +4474,9 @@ class AutoTrainingBot:
                     # 檢查是否在同一平台
                     if not self.check_same_platform(target_pos):
                         print("怪物不在同一平台，需要移動到相同平台")
+                        # 有平台資訊時規劃路徑，一次移動到怪物所在的平台
+                        if self.navigate_to(target_pos, platforms, ropes, frame):
+                            continue
                         # 如果怪物在上方，找繩子爬上去
                         if target_pos[1] < player_pos[1] - 50 and ropes:
                             print("怪物在上方，爬繩子")
@@ -1008,6 +4539,15 @@ class AutoTrainingBot:
                 
         except KeyboardInterrupt:
             print("\n自動練功已停止")
+        finally:
+            self.stop_capture_thread()
+            self.shutdown_match_pool()
+            self.shutdown_detection_pool()
+            self.stop_recording()
+            self.debug_writer.flush(timeout=5.0)
+            store = self.debug_writer.store
+            print(f"debug 圖像: 已寫入 {self.debug_writer.written} 張，丟棄 {self.debug_writer.dropped} 張"
+                  + (f"，重複略過 {store.skipped} 張，清除舊檔 {store.evicted} 張" if store is not None else ""))
 
     def test_keyboard_controls(self):
         """測試鍵盤控制是否正常工作"""
@@ -1078,83 +4618,142 @@ class AutoTrainingBot:
             pyautogui.keyUp('down')
 
     def take_debug_screenshot(self, description="manual"):
-        """手動拍照用於 debug"""
-        screens_dir = 'screens'
-        if not os.path.exists(screens_dir):
-            os.makedirs(screens_dir)
-        
-        screenshot = pyautogui.screenshot()
-        timestamp = time.strftime("%Y%m%d_%H%M%S")
-        screenshot_path = os.path.join(screens_dir, f"{description}_{timestamp}.png")
-        screenshot.save(screenshot_path)
-        print(f"截圖已保存: {screenshot_path}")
-        return screenshot_path
+        """手動拍照用於 debug，回傳已寫入的檔案路徑（沒有寫入時回傳 None）"""
+        frame = self.capture_frame()
+        job = self.debug_writer.submit(description, frame.snapshot(), dedup=False)
+        job.wait(timeout=5.0)
+        print(f"截圖: {job}")
+        return job.path if job.written else None
 
-    def find_monster_clusters(self, monsters, cluster_radius=100):
-        """找到怪物密集區域"""
+    def find_monster_clusters(self, monsters, cluster_radius=100, cells_per_radius=8):
+        """找到怪物密集區域
+        
+        偵測結果先依位置放進邊長 cluster_radius / cells_per_radius 的格子（重疊的原始偵測結果落在同一格），
+        每個有怪物的格子是一個候選群組：成員為格子距離在 cells_per_radius 格以內的所有怪物，
+        數量、座標總和與優先級總和用每一列的前綴和一次算出，不展開怪物之間的點對。
+        去除重複時每個群組中心所在的格子只留怪物最多的一個，再只保留 cluster_radius / 2 範圍內
+        怪物最多的群組（局部最大值，與 extract_peaks 相同的侵蝕比較）。
+        中心、數量、優先級總和與密度分數的定義不變，成員距離以格子計算，誤差在一格以內。
+        群組的 'monsters' 與成員索引在讀取時才建立（MonsterCluster）。
+        """
+        if not monsters:
+            return []
         if not monsters:
             return []
         
-        clusters = []
+        reach = cells_per_radius
+        step = cluster_radius / reach
+        monster_x = monsters.center_x
+        monster_y = monsters.center_y
+        origin_x = int(monster_x.min())
+        origin_y = int(monster_y.min())
+        cell_x = ((monster_x - origin_x) / step).astype(np.int64)
+        cell_y = ((monster_y - origin_y) / step).astype(np.int64)
+        columns = int(cell_x.max()) + 1
+        rows = int(cell_y.max()) + 1
+        # 格子依列展開成編號（上下各留 reach 列，每列後面留 2 * reach 格空白，圓的每一列不會跨到別列）
+        stride = columns + 2 * reach
+        keys = (cell_y + reach) * stride + cell_x
+        cell_counts = np.bincount(keys, minlength=(rows + 2 * reach) * stride)
+        seeds = np.flatnonzero(cell_counts).astype(np.int32)  # 有怪物的格子
+        # 編號 k 之前的怪物數（依編號排序後的位置），以及排序後 (怪物數, x 總和, y 總和, 優先級總和) 的累計值
+        starts = np.zeros(len(cell_counts) + 1, np.int32)
+        np.cumsum(cell_counts, out=starts[1:])
+        values = np.column_stack((np.ones(len(keys)), monster_x - origin_x, monster_y - origin_y, monsters.priority(5)))
+        cumulative = np.zeros((len(keys) + 1, 4))
+        np.cumsum(np.take(values, np.argsort(keys), axis=0), axis=0, out=cumulative[1:])
+        
+        # 圓內每一列的左右邊界（格子距離 dx² + dy² <= reach²），該列結束與開始位置的累計值相減就是該列的總和
+        dy = np.arange(-reach, reach + 1, dtype=np.int32)
+        widths = np.floor(np.sqrt(reach * reach - dy * dy)).astype(np.int32)
+        ends = np.take(starts, seeds + (dy * stride + widths + 1)[:, None])
+        begins = np.take(starts, seeds + (dy * stride - widths)[:, None])
+        totals = np.zeros((len(seeds), 4))
+        for end, begin in zip(ends, begins):  # 逐列累加，暫存陣列只有候選群組的大小
+            totals += np.take(cumulative, end, axis=0)
+            totals -= np.take(cumulative, begin, axis=0)
+        monster_counts = np.rint(totals[:, 0]).astype(np.int64)
+        center_x = totals[:, 1] / monster_counts + origin_x
+        center_y = totals[:, 2] / monster_counts + origin_y
+        total_priorities = totals[:, 3]
+        density_scores = monster_counts * total_priorities
+        
+        # 去除重複的群組（中心點太近時保留怪物數量較多的群組，數量相同時保留格子在前的）
+        # 群組依排名放到中心所在的格子（同一格只留排名最前的），侵蝕後仍是最小值的就是範圍內排名最前的
+        count = len(seeds)
+        ranking = np.argsort(np.arange(count) - monster_counts * count)
+        rank = np.empty(count, np.int64)
+        rank[ranking] = np.arange(count)
+        center_cells = (np.minimum(((center_y - origin_y) / step).astype(np.int64), rows - 1) * columns +
+                        np.minimum(((center_x - origin_x) / step).astype(np.int64), columns - 1))
+        best = np.full(rows * columns, count, np.int64)
+        np.minimum.at(best, center_cells, rank)
+        rank_grid = best.astype(np.float32).reshape(rows, columns)
+        half_reach = np.arange(-(reach // 2), reach // 2 + 1)
+        kernel = ((half_reach[:, None] ** 2 + half_reach ** 2) <= (reach // 2) ** 2).astype(np.uint8)
+        local_best = cv2.erode(rank_grid, kernel)
+        unique = ranking[rank_grid[(rank_grid < count) & (rank_grid <= local_best)].astype(np.int64)]
         
-        # 為每個怪物計算周圍的怪物密度
-        for i, monster in enumerate(monsters):
-            x, y = monster['position']
-            nearby_monsters = []
-            
-            for j, other_monster in enumerate(monsters):
-                if i != j:  # 不包括自己
-                    ox, oy = other_monster['position']
-                    distance = ((x - ox)**2 + (y - oy)**2)**0.5
-                    
-                    if distance <= cluster_radius:
-                        nearby_monsters.append(other_monster)
-            
-            # 包括自己
-            cluster_monsters = [monster] + nearby_monsters
-            
-            # 計算群組的中心點和總優先級
-            center_x = sum(m['position'][0] for m in cluster_monsters) / len(cluster_monsters)
-            center_y = sum(m['position'][1] for m in cluster_monsters) / len(cluster_monsters)
-            total_priority = sum(m.get('priority', 5) for m in cluster_monsters)
-            
-            cluster_info = {
-                'center': (center_x, center_y),
-                'monster_count': len(cluster_monsters),
-                'monsters': cluster_monsters,
+        # 按密度分數排序（怪物越多、優先級越高的群組排在前面）
+        unique = unique[np.argsort(-density_scores[unique], kind='stable')]
+        seeds = seeds[unique]
+        
+        clusters = []
+        for seed_x, seed_y, x, y, monster_count, total_priority, density_score in zip(
+                (seeds % stride).tolist(), (seeds // stride - reach).tolist(),
+                center_x[unique].tolist(), center_y[unique].tolist(), monster_counts[unique].tolist(),
+                total_priorities[unique].tolist(), density_scores[unique].tolist()):
+            # 直接設定欄位，不經過 Python 的 __init__（與 DetectionBatch.take 相同）
+            cluster = MonsterCluster(
+                center=(x, y),
+                monster_count=monster_count,
+                total_priority=total_priority,
+                density_score=density_score  # 密度分數
+            )
+            cluster._source = monsters
+            cluster._member_indices = lambda seed_x=seed_x, seed_y=seed_y: np.flatnonzero(
+                (cell_x - seed_x) ** 2 + (cell_y - seed_y) ** 2 <= reach * reach)
+            clusters.append(cluster)
+        
+        return clusters
+    @staticmethod
+    def reference_monster_clusters(monsters, cluster_radius=100):
+        """逐一比較所有怪物的群組計算（O(n²)，成員距離以像素計算），只用來在效能測試中對照最佳群組"""
+        positions = [obj['position'] for obj in monsters]
+        priorities = [obj.get('priority', 5) for obj in monsters]
+        clusters = []
+        for i, (x, y) in enumerate(positions):
+            members = [i] + [j for j, (other_x, other_y) in enumerate(positions)
+                             if i != j and ((x - other_x)**2 + (y - other_y)**2)**0.5 <= cluster_radius]
+            total_priority = sum(priorities[j] for j in members)
+            clusters.append({
+                'center': (sum(positions[j][0] for j in members) / len(members),
+                           sum(positions[j][1] for j in members) / len(members)),
+                'monster_count': len(members),
+                'members': members,
                 'total_priority': total_priority,
-                'density_score': len(cluster_monsters) * total_priority  # 密度分數
-            }
-            
-            clusters.append(cluster_info)
+                'density_score': len(members) * total_priority
+            })
         
-        # 去除重複的群組（基於中心點距離）
         unique_clusters = []
         for cluster in clusters:
             is_duplicate = False
             for existing in unique_clusters:
                 cx, cy = cluster['center']
                 ex, ey = existing['center']
-                distance = ((cx - ex)**2 + (cy - ey)**2)**0.5
-                
-                if distance < cluster_radius / 2:  # 如果群組中心太近，認為是重複
-                    # 保留怪物數量更多的群組
+                if ((cx - ex)**2 + (cy - ey)**2)**0.5 < cluster_radius / 2:
                     if cluster['monster_count'] > existing['monster_count']:
                         unique_clusters.remove(existing)
                         unique_clusters.append(cluster)
                     is_duplicate = True
                     break
-            
             if not is_duplicate:
                 unique_clusters.append(cluster)
-        
-        # 按密度分數排序（怪物越多、優先級越高的群組排在前面）
-        unique_clusters.sort(key=lambda x: x['density_score'], reverse=True)
-        
+        unique_clusters.sort(key=lambda cluster: cluster['density_score'], reverse=True)
         return unique_clusters
     
     def select_best_target_area(self, monsters):
-        """選擇最佳攻擊區域"""
+        """選擇最佳攻擊區域（TargetArea）"""
         if not monsters:
             return None
         
@@ -1166,19 +4765,11 @@ class AutoTrainingBot:
             print(f"選中最佳區域: {best_cluster['monster_count']} 隻怪物，密度分數: {best_cluster['density_score']}")
             
             # 返回群組中心位置作為目標
-            return {
-                'position': best_cluster['center'],
-                'monster_count': best_cluster['monster_count'],
-                'cluster_info': best_cluster
-            }
+            return TargetArea(best_cluster['center'], best_cluster['monster_count'], best_cluster)
         else:
             # 如果沒有群組，選擇單一怪物
-            best_monster = max(monsters, key=lambda m: m.get('priority', 5))
-            return {
-                'position': best_monster['position'],
-                'monster_count': 1,
-                'cluster_info': None
-            }
+            best = int(np.argmax(monsters.priority(5)))
+            return TargetArea((int(monsters.center_x[best]), int(monsters.center_y[best])))
     
     def test_rope_detection_with_threshold(self, threshold=0.7):
         """改進版：測試不同閾值下的繩子偵測效果，並診斷問題"""
@@ -1189,16 +4780,15 @@ class AutoTrainingBot:
         print(f"測試閾值: {threshold}")
         print("=" * 60)
         
-        # 截取螢幕
-        screenshot = pyautogui.screenshot()
-        screenshot_np = cv2.cvtColor(np.array(screenshot), cv2.COLOR_RGB2BGR)
+        # 截取螢幕（繩子偵測也共用這張畫面）
+        frame = self.capture_frame()
+        screenshot_np = frame.bgr
         
         # 準備不同處理的圖像
-        original_gray = cv2.cvtColor(screenshot_np, cv2.COLOR_BGR2GRAY)
+        original_gray = frame.gray
         
         # 增強對比度
-        enhanced_img = cv2.convertScaleAbs(screenshot_np, alpha=1.2, beta=10)
-        enhanced_gray = cv2.cvtColor(enhanced_img, cv2.COLOR_BGR2GRAY)
+        enhanced_gray = frame.enhanced_gray
         
         # 嘗試不同圖像處理方法
         img_types = [
@@ -1206,11 +4796,6 @@ class AutoTrainingBot:
             {"name": "增強對比度", "img": enhanced_gray}
         ]
         
-        timestamp = time.strftime("%Y%m%d_%H%M%S")
-        screens_dir = 'screens'
-        if not os.path.exists(screens_dir):
-            os.makedirs(screens_dir)
-        
         # 準備診斷圖像
         debug_image = screenshot_np.copy()
         
@@ -1228,15 +4813,16 @@ class AutoTrainingBot:
             best_match = None
             best_confidence = 0
             
-            # 多尺度模板匹配
-            for scale in [0.7, 0.8, 0.9, 1.0, 1.1, 1.2, 1.3]:
-                width = int(self.player_on_rope_template.shape[1] * scale)
-                height = int(self.player_on_rope_template.shape[0] * scale)
+            # 多尺度模板匹配（使用預先縮放好的模板）
+            for variant in self.player_on_rope_pyramid:
+                scale = variant.scale
+                width = variant.width
+                height = variant.height
                 
                 if width > screenshot_gray.shape[1] or height > screenshot_gray.shape[0]:
                     continue
                     
-                resized_template = cv2.resize(self.player_on_rope_template, (width, height))
+                resized_template = variant.image
                 result = cv2.matchTemplate(screenshot_gray, resized_template, cv2.TM_CCOEFF_NORMED)
                 
                 # 找到所有匹配位置
@@ -1247,11 +4833,12 @@ class AutoTrainingBot:
                     x, y = pt
                     confidence = result[y, x]
                     
+                    screen_x, screen_y = frame.to_screen(x, y)
                     match = {
-                        'position': (x + width // 2, y + height // 2),
+                        'position': (screen_x + width // 2, screen_y + height // 2),
                         'confidence': confidence,
                         'scale': scale,
-                        'box': (x, y, width, height),
+                        'box': (screen_x, screen_y, width, height),
                         'method': type_name
                     }
                     
@@ -1278,7 +4865,7 @@ class AutoTrainingBot:
         
         # 檢查繩子位置
         print("\n檢查繩子位置關係:")
-        ropes = self.find_objects(self.rope_templates, threshold=0.7, debug=False)
+        ropes = self.find_objects(self.rope_templates, threshold=0.7, debug=False, frame=frame)
         if ropes:
             print(f"  找到 {len(ropes)} 條繩子")
             player_pos = self.get_player_position()
@@ -1295,6 +4882,7 @@ class AutoTrainingBot:
                 
                 # 標記繩子位置
                 x, y, w, h = rope_box
+                x, y = frame.to_local(x, y)
                 cv2.rectangle(debug_image, (x, y), (x+w, y+h), (0, 165, 255), 2)
                 cv2.putText(debug_image, f"Rope {i+1}", (x, y-10), 
                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 165, 255), 1)
@@ -1313,15 +4901,15 @@ class AutoTrainingBot:
                     
                     # 標記玩家與繩子的關係
                     cv2.line(debug_image, 
-                            (int(player_pos[0]), int(player_pos[1])),
-                            (int(rope_x), int(player_pos[1])),
+                            frame.to_local(player_pos[0], player_pos[1]),
+                            frame.to_local(rope_x, player_pos[1]),
                             (0, 255, 0), 2)
         else:
             print("  ❌ 沒有找到繩子")
         
         # 繪製所有最佳匹配
         for idx, match in enumerate(best_match_per_method):
-            x, y = match['position']
+            x, y = frame.to_local(*match['position'])
             w, h = match['box'][2], match['box'][3]
             
             # 使用不同顏色區分不同方法
@@ -1332,14 +4920,13 @@ class AutoTrainingBot:
                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
         
         # 標記玩家位置 (估算)
-        player_pos = self.get_player_position()
-        cv2.circle(debug_image, (int(player_pos[0]), int(player_pos[1])), 20, (255, 255, 255), 2)
-        cv2.putText(debug_image, "Estimated Player", (int(player_pos[0])+25, int(player_pos[1])),
+        player_pos = frame.to_local(*self.get_player_position())
+        cv2.circle(debug_image, player_pos, 20, (255, 255, 255), 2)
+        cv2.putText(debug_image, "Estimated Player", (player_pos[0]+25, player_pos[1]),
                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
         
         # 保存診斷圖像
-        debug_path = os.path.join(screens_dir, f"rope_detection_debug_{timestamp}.png")
-        cv2.imwrite(debug_path, debug_image)
+        debug_job = self.debug_writer.submit("rope_detection_debug", debug_image, dedup=False)
         
         # 排序所有匹配
         all_matches.sort(key=lambda x: x['confidence'], reverse=True)
@@ -1378,7 +4965,8 @@ class AutoTrainingBot:
             print("   - 更新角色在繩子上的模板圖像")
             print("   - 結合繩子位置關係和顏色偵測")
         
-        print(f"\n診斷圖像已保存: {debug_path}")
+        debug_job.wait(timeout=5.0)
+        print(f"\n診斷圖像: {debug_job}")
         print("=" * 60)
         
         return all_matches
@@ -1628,7 +5216,7 @@ class AutoTrainingBot:
         # 詳細記錄按鍵過程
         print("執行步驟:")
         print("  1. 截取動作前畫面")
-        screenshot_before = pyautogui.screenshot()
+        frame_before = self.capture_frame().copy()  # 背景擷取的緩衝區在下一次擷取後會被覆蓋
         
         print("  2. 按下並持續按住下鍵")
         if self.use_pyautogui_keys:
@@ -1655,11 +5243,11 @@ class AutoTrainingBot:
         time.sleep(1)
         
         print("  6. 截取動作後畫面並分析")
-        screenshot_after = pyautogui.screenshot()
+        frame_after = self.capture_frame()
         
         # 詳細分析
-        img1 = cv2.cvtColor(np.array(screenshot_before), cv2.COLOR_RGB2BGR)
-        img2 = cv2.cvtColor(np.array(screenshot_after), cv2.COLOR_RGB2BGR)
+        img1 = frame_before.bgr
+        img2 = frame_after.bgr
         
         diff = cv2.absdiff(img1, img2)
         gray_diff = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY)
@@ -1676,8 +5264,6 @@ class AutoTrainingBot:
             '上半部': gray_diff[:center_y, :]
         }
         
-        timestamp = time.strftime("%Y%m%d_%H%M%S")
-        
         print("\n分析結果:")
         for region_name, region in regions.items():
             if region.size > 0:
@@ -1687,22 +5273,16 @@ class AutoTrainingBot:
                 print(f"  {region_name}: {change_percentage:.3f}% 變化 ({change_pixels}/{total_pixels} 像素)")
         
         # 保存詳細的除錯圖像
-        screens_dir = 'screens'
-        if not os.path.exists(screens_dir):
-            os.makedirs(screens_dir)
-        
-        before_path = os.path.join(screens_dir, f"debug_before_{timestamp}.png")
-        after_path = os.path.join(screens_dir, f"debug_after_{timestamp}.png")
-        diff_path = os.path.join(screens_dir, f"debug_diff_{timestamp}.png")
+        jobs = [self.debug_writer.submit("debug_before", frame_before.snapshot(), dedup=False),
+                self.debug_writer.submit("debug_after", frame_after.snapshot(), dedup=False),
+                self.debug_writer.submit("debug_diff", diff, dedup=False)]
+        for job in jobs:
+            job.wait(timeout=5.0)
         
-        screenshot_before.save(before_path)
-        screenshot_after.save(after_path)
-        cv2.imwrite(diff_path, diff)
-        
-        print(f"\n除錯圖像已保存:")
-        print(f"  動作前: {before_path}")
-        print(f"  動作後: {after_path}")
-        print(f"  差異圖: {diff_path}")
+        print(f"\n除錯圖像:")
+        print(f"  動作前: {jobs[0]}")
+        print(f"  動作後: {jobs[1]}")
+        print(f"  差異圖: {jobs[2]}")
         
         # 恢復原設定
         self.use_pyautogui_keys = original_method
@@ -1808,10 +5388,10 @@ class AutoTrainingBot:
             
             # 檢查是否有分類錯誤
             print(f"\n詳細分析:")
-            all_objects = monsters + ropes + platforms
+            all_objects = list(DetectionBatch.concatenate([monsters, ropes, platforms]))
             
             # 按信心度排序
-            all_objects.sort(key=lambda x: x['confidence'], reverse=True)
+            all_objects.sort(key=lambda x: x.confidence, reverse=True)
             
             print("前10個最高信心度的偵測結果:")
             for i, obj in enumerate(all_objects[:10]):
@@ -1834,6 +5414,531 @@ class AutoTrainingBot:
         
         print("=" * 60)
     
+    def run_benchmark(self, name):
+        """執行指定的效能測試"""
+        return getattr(self, self.BENCHMARKS[name])()
+    
+    def benchmark_capture(self, duration=5.0):
+        """截圖效能測試：比較 pyautogui 與 mss 每秒可擷取的灰階畫面數
+        
+        沒有實體螢幕時可在虛擬 framebuffer 上執行：
+        xvfb-run -a -s "-screen 0 1920x1080x24" python macro_smart.py --benchmark capture
+        """
+        print("截圖效能測試")
+        print("=" * 60)
+        
+        backends = [('pyautogui (PIL → BGR → 灰階)', ScreenFrameSource)]
+        if mss is not None:
+            backends.append(('mss 灰階（直接輸出）', lambda: MSSFrameSource('gray')))
+            backends.append(('mss BGR → 灰階', lambda: MSSFrameSource('bgr')))
+        else:
+            print("⚠️  未安裝 mss，只測試 pyautogui")
+        
+        region = self.game_region
+        print(f"擷取區域: {region if region else '整個螢幕'}，每種方式測試 {duration:.0f} 秒")
+        
+        results = {}
+        for name, factory in backends:
+            source = factory()
+            source.grab(region=region)  # 暖機（建立連線、配置緩衝區）
+            
+            frames = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < duration:
+                frame = source.grab(region=region)
+                frame.gray  # 偵測都需要灰階，轉換成本一併計入
+                frames += 1
+            elapsed = time.perf_counter() - start
+            source.close()
+            
+            fps = frames / elapsed
+            results[name] = fps
+            print(f"  {name}: {fps:.1f} FPS ({1000 / fps:.2f} ms/張)")
+        
+        if len(results) > 1:
+            baseline = results[backends[0][0]]
+            print("\n相對 pyautogui 的加速:")
+            for name, fps in results.items():
+                print(f"  {name}: {fps / baseline:.1f}x")
+        
+        print("=" * 60)
+        return results
+    
+    def collect_benchmark_frames(self, frame_count):
+        """從目前的畫面來源取得測試用畫面（複製保存，避免緩衝區被覆蓋）"""
+        frames = []
+        for _ in range(frame_count):
+            try:
+                frame = self.capture_frame()
+            except FrameSourceExhausted:
+                break
+            frames.append(frame.copy())
+        return frames
+    
+    def count_recalled(self, expected, found, tolerance=10):
+        """計算 expected 中有多少物件在 found 裡有距離 tolerance 內的對應"""
+        if not len(expected) or not len(found):
+            return 0
+        offsets = np.abs(expected.positions[:, None, :] - found.positions[None, :, :])
+        return int(np.any(np.all(offsets <= tolerance, axis=2), axis=1).sum())
+    
+    def benchmark_coarse_matching(self, frame_count=10):
+        """比對效能測試：完整比對 vs 由粗到細比對的速度與召回率
+        
+        建議搭配重播畫面來源離線執行：python macro_smart.py screens --benchmark coarse
+        召回率以完整比對（去除重複後）的結果為基準。
+        """
+        print("由粗到細比對效能測試")
+        print("=" * 60)
+        
+        frames = self.collect_benchmark_frames(frame_count)
+        if not frames:
+            print("❌ 沒有可用的畫面")
+            return None
+        print(f"使用 {len(frames)} 張畫面，縮小倍數: {self.coarse_factor}，"
+              f"粗略閾值降低: {self.coarse_threshold_drop}")
+        
+        results = {}
+        for template_type, templates, threshold in [
+                ("monsters", self.monster_templates, 0.7),
+                ("ropes", self.rope_templates, self.rope_threshold),
+                ("platforms", self.platform_templates, self.platform_threshold)]:
+            if not templates:
+                continue
+            
+            timings = {}
+            detections = {}
+            for mode in ['exhaustive', 'coarse']:
+                start = time.perf_counter()
+                detections[mode] = [self.match_templates(frame, templates, threshold, template_type, match_mode=mode)
+                                    for frame in frames]
+                timings[mode] = (time.perf_counter() - start) / len(frames)
+            
+            expected_total = 0
+            recalled_total = 0
+            for expected, found in zip(detections['exhaustive'], detections['coarse']):
+                expected = self.remove_duplicates(expected)
+                found = self.remove_duplicates(found)
+                expected_total += len(expected)
+                recalled_total += self.count_recalled(expected, found)
+            
+            recall = recalled_total / expected_total if expected_total else 1.0
+            speedup = timings['exhaustive'] / timings['coarse'] if timings['coarse'] > 0 else 0
+            results[template_type] = {'exhaustive_ms': timings['exhaustive'] * 1000,
+                                      'coarse_ms': timings['coarse'] * 1000,
+                                      'speedup': speedup, 'recall': recall}
+            print(f"  {template_type}: 完整 {timings['exhaustive'] * 1000:.1f} ms/張, "
+                  f"由粗到細 {timings['coarse'] * 1000:.1f} ms/張, 加速 {speedup:.1f}x, "
+                  f"召回率 {recall * 100:.1f}% ({recalled_total}/{expected_total})")
+        
+        if not results:
+            print("❌ 沒有載入任何模板")
+        print("=" * 60)
+        return results
+    
+    def benchmark_match_workers(self, worker_counts=(1, 2, 4, 8, 16), frame_count=5):
+        """平行比對效能測試：每個 tick（怪物、繩子、平台全部比對一次）的延遲 vs 工作執行緒數
+        
+        不使用差異區塊快取與尺度鎖定，每張畫面都是完整比對。
+        同時確認不同執行緒數的偵測結果完全相同。
+        """
+        print("平行比對效能測試")
+        print("=" * 60)
+        
+        frames = self.collect_benchmark_frames(frame_count)
+        if not frames:
+            print("❌ 沒有可用的畫面")
+            return None
+        
+        detectors = self.benchmark_detectors()
+        job_count = sum(len(self.get_template_pyramid(t)) for _, templates, _ in detectors for t in templates)
+        print(f"使用 {len(frames)} 張畫面，每個 tick {job_count} 個 模板×尺度 工作，CPU 數: {os.cpu_count()}")
+        
+        original_workers = self.match_workers
+        results = {}
+        baseline = None
+        try:
+            for workers in worker_counts:
+                self.match_workers = workers
+                self.get_match_pool()
+                
+                latencies, detections = self.measure_detection_ticks(frames, detectors)
+                if baseline is None:
+                    baseline = detections
+                identical = detections == baseline
+                mean_ms = sum(latencies) / len(latencies) * 1000
+                results[workers] = {'tick_ms': mean_ms, 'max_ms': max(latencies) * 1000, 'identical': identical}
+                speedup = results[worker_counts[0]]['tick_ms'] / mean_ms if mean_ms > 0 else 0
+                print(f"  {workers:2d} 個執行緒 (OpenCV {cv2.getNumThreads()}): 平均 {mean_ms:.1f} ms/tick, "
+                      f"最慢 {max(latencies) * 1000:.1f} ms, 加速 {speedup:.1f}x, "
+                      f"結果{'相同' if identical else '不同 ⚠️'}")
+        finally:
+            self.match_workers = original_workers
+            self.shutdown_match_pool()
+        
+        print("=" * 60)
+        return results
+    
+    def benchmark_detection_processes(self, process_counts=(0, 1, 2, 4, 8), frame_count=5):
+        """行程池偵測效能測試：每個 tick 的延遲 vs 偵測行程數（0 = 在主行程比對）
+        
+        第一張畫面包含啟動行程的時間，所以每種設定先暖機一個 tick 再計時。
+        """
+        print("行程池偵測效能測試")
+        print("=" * 60)
+        
+        frames = self.collect_benchmark_frames(frame_count)
+        if not frames:
+            print("❌ 沒有可用的畫面")
+            return None
+        
+        detectors = self.benchmark_detectors()
+        print(f"使用 {len(frames)} 張畫面，CPU 數: {os.cpu_count()}，比對執行緒: {self.match_workers}")
+        
+        original_processes = self.detection_processes
+        results = {}
+        baseline = None
+        try:
+            for processes in process_counts:
+                self.detection_processes = processes
+                self.measure_detection_ticks(frames[:1], detectors)  # 暖機（啟動行程、建立金字塔）
+                
+                latencies, detections = self.measure_detection_ticks(frames, detectors)
+                # 不同行程數的合併順序不同，比較時不看順序
+                detections = [[sorted(boxes) for boxes in tick] for tick in detections]
+                if baseline is None:
+                    baseline = detections
+                identical = detections == baseline
+                mean_ms = sum(latencies) / len(latencies) * 1000
+                results[processes] = {'tick_ms': mean_ms, 'max_ms': max(latencies) * 1000, 'identical': identical}
+                speedup = results[process_counts[0]]['tick_ms'] / mean_ms if mean_ms > 0 else 0
+                label = f"{processes:2d} 個行程" if processes > 0 else " 主行程  "
+                print(f"  {label}: 平均 {mean_ms:.1f} ms/tick, 最慢 {max(latencies) * 1000:.1f} ms, "
+                      f"加速 {speedup:.1f}x, 結果{'相同' if identical else '不同 ⚠️'}")
+                self.shutdown_detection_pool()
+        finally:
+            self.detection_processes = original_processes
+            self.shutdown_detection_pool()
+        
+        print("=" * 60)
+        return results
+    
+    def benchmark_detectors(self):
+        """效能測試使用的 (物件類型, 模板, 閾值)"""
+        return [("monsters", self.monster_templates, 0.7),
+                ("ropes", self.rope_templates, self.rope_threshold),
+                ("platforms", self.platform_templates, self.platform_threshold)]
+    
+    def measure_detection_ticks(self, frames, detectors):
+        """每張畫面完整比對所有物件類型，回傳 (每個 tick 的秒數, 每個 tick 各類型的物件框)"""
+        latencies = []
+        detections = []
+        for frame in frames:
+            start = time.perf_counter()
+            tick = [self.match_templates(frame, templates, threshold, template_type,
+                                         match_mode=self.match_modes.get(template_type, 'exhaustive'))
+                    for template_type, templates, threshold in detectors]
+            latencies.append(time.perf_counter() - start)
+            detections.append([[obj['box'] for obj in objects] for objects in tick])
+        return latencies, detections
+    
+    def benchmark_monster_clusters(self, counts=(10, 100, 1000, 5000), repeats=20, reference_limit=1000,
+                                   budget_count=1000, budget_ms=1.0):
+        """怪物群組效能測試：偵測結果數量 vs 計算時間
+        
+        兩種分布：整個 1920x1080 畫面均勻分布，以及集中在 20 個位置附近（大量重疊的原始偵測結果）。
+        reference_limit 以下的數量同時執行逐一比較的版本，對照兩者最佳群組的中心與怪物數量
+        （find_monster_clusters 以格子計算距離，結果不會完全相同）。
+        budget_count 個偵測結果最快一次超過 budget_ms 時拋出 RuntimeError（效能退化）。
+        """
+        print("怪物群組效能測試")
+        print("=" * 60)
+        
+        rng = np.random.default_rng(0)
+        spots = rng.integers(0, (1920, 1080), (20, 2))
+        results = {}
+        over_budget = []
+        for distribution in ['uniform', 'overlapping']:
+            for count in counts:
+                if distribution == 'uniform':
+                    positions = rng.integers(0, (1920, 1080), (count, 2))
+                else:
+                    positions = spots[rng.integers(0, len(spots), count)] + rng.integers(-15, 16, (count, 2))
+                monsters = DetectionBatch(positions[:, 0], positions[:, 1], np.full(count, 40), np.full(count, 40),
+                                          rng.random(count), np.ones(count), rng.integers(0, 4, count),
+                                          np.zeros(count), ['m0', 'm1', 'm2', 'm3'], [5, 8, np.nan, 3])
+                timings = []
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    clusters = self.find_monster_clusters(monsters)
+                    timings.append(time.perf_counter() - start)
+                elapsed = sum(timings) / repeats
+                fastest_ms = min(timings) * 1000
+                results[(distribution, count)] = {'ms': elapsed * 1000, 'fastest_ms': fastest_ms,
+                                                  'clusters': len(clusters)}
+                label = "均勻分布" if distribution == 'uniform' else "重疊集中"
+                if count == budget_count and fastest_ms > budget_ms:
+                    over_budget.append(f"{label} {count} 個偵測結果: {fastest_ms:.3f} ms > {budget_ms} ms")
+                
+                # 與逐一比較的版本對照（數量太多時略過，O(n²) 太慢）
+                same = "略過對照"
+                if count <= reference_limit:
+                    start = time.perf_counter()
+                    reference = self.reference_monster_clusters(monsters)
+                    reference_ms = (time.perf_counter() - start) * 1000
+                    # 密度分數相同的群組都算最佳群組，中心取最近的一個比較
+                    best = clusters[0]
+                    center_offset = min(float(np.hypot(expected['center'][0] - best['center'][0],
+                                                       expected['center'][1] - best['center'][1]))
+                                        for expected in reference
+                                        if expected['density_score'] == reference[0]['density_score'])
+                    count_offset = best['monster_count'] - reference[0]['monster_count']
+                    results[(distribution, count)].update(reference_ms=reference_ms, center_offset=center_offset,
+                                                          count_offset=count_offset)
+                    same = (f"逐一比較 {reference_ms:.1f} ms, 最佳群組中心相差 {center_offset:.1f} px, "
+                            f"數量相差 {count_offset:+d}")
+                print(f"  {label} {count:5d} 個偵測結果: 平均 {elapsed * 1000:.3f} ms, 最快 {fastest_ms:.3f} ms, "
+                      f"{len(clusters)} 個群組（{same}）")
+        
+        print("=" * 60)
+        if over_budget:
+            raise RuntimeError("怪物群組計算超過時間預算:\n" + "\n".join(over_budget))
+        return results
+    
+    def benchmark_player_on_rope(self, frame_count=10):
+        """繩子上角色偵測效能測試：完整搜尋 vs 快速模式（局部視窗、提早結束）的速度與結果
+        
+        建議搭配重播畫面來源離線執行：python macro_smart.py screens --benchmark rope
+        """
+        print("繩子上角色偵測效能測試")
+        print("=" * 60)
+        
+        if self.player_on_rope_template is None:
+            print("❌ 沒有載入 role_on_rope.png 模板")
+            return None
+        frames = self.collect_benchmark_frames(frame_count)
+        if not frames:
+            print("❌ 沒有可用的畫面")
+            return None
+        
+        fast_mode = self.player_rope_fast_mode
+        results = {}
+        detections = {}
+        try:
+            for mode, fast in [('full', False), ('fast', True)]:
+                self.player_rope_fast_mode = fast
+                self.last_player_on_rope = None
+                start = time.perf_counter()
+                detections[mode] = [self.detect_player_on_rope(frame) for frame in frames]
+                results[mode] = (time.perf_counter() - start) / len(frames) * 1000
+        finally:
+            self.player_rope_fast_mode = fast_mode
+            self.last_player_on_rope = None
+        
+        agreed = sum(full[0] == fast[0] for full, fast in zip(detections['full'], detections['fast']))
+        speedup = results['full'] / results['fast'] if results['fast'] > 0 else 0
+        results['agreement'] = agreed / len(frames)
+        print(f"  完整搜尋: {results['full']:.1f} ms/張, 快速模式: {results['fast']:.1f} ms/張, 加速 {speedup:.1f}x")
+        print(f"  判斷一致: {agreed}/{len(frames)}")
+        print("=" * 60)
+        return results
+    
+    def benchmark_minimap(self, frame_count=10, repeats=20):
+        """小地圖定位效能測試：每次讀取小地圖玩家位置的時間 vs 整張畫面的角色偵測"""
+        print("小地圖定位效能測試")
+        print("=" * 60)
+        
+        frames = self.collect_benchmark_frames(frame_count)
+        if not frames:
+            print("❌ 沒有可用的畫面")
+            return None
+        if self.minimap_reader.region is None and not self.minimap_locate_attempted:
+            self.locate_minimap(frames[0])
+        if self.minimap_reader.region is None:
+            print("❌ 沒有小地圖區域（需要 templates/minimap_tl.png 或 set_minimap_region）")
+            return None
+        
+        found = 0
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for frame in frames:
+                found += self.minimap_reader.read(frame) is not None
+        minimap_ms = (time.perf_counter() - start) / (repeats * len(frames)) * 1000
+        results = {'minimap_ms': minimap_ms, 'found': found / (repeats * len(frames))}
+        print(f"  小地圖讀取: {minimap_ms:.3f} ms/次（{1000 / minimap_ms:.0f} 次/秒），"
+              f"找到玩家標記: {results['found'] * 100:.0f}%")
+        
+        if self.player_on_rope_template is not None:
+            start = time.perf_counter()
+            for frame in frames:
+                self.detect_player_on_rope(frame)
+            results['full_frame_ms'] = (time.perf_counter() - start) / len(frames) * 1000
+            print(f"  整張畫面角色偵測: {results['full_frame_ms']:.1f} ms/次")
+        
+        print("=" * 60)
+        return results
+    
+    def benchmark_debug_levels(self, frame_count=10, directory='benchmark_debug'):
+        """debug 等級效能測試：各等級下偵測路徑（find_objects）每張畫面的時間與排入保存的圖像數
+        
+        每張畫面都做完整比對（暫時關閉區塊差異與追蹤），圖像寫到 directory 而不是 screens/。
+        背景寫入時間另外列出，不計入偵測路徑。
+        """
+        print("debug 等級效能測試")
+        print("=" * 60)
+        
+        frames = self.collect_benchmark_frames(frame_count)
+        if not frames:
+            print("❌ 沒有可用的畫面")
+            return None
+        
+        settings = (self.debug_level, self.debug_writer, self.use_dirty_regions, self.use_tracking)
+        results = {}
+        try:
+            self.use_dirty_regions = False
+            self.use_tracking = False
+            for level in [0, 1, 2]:
+                self.debug_level = level
+                self.debug_states = {}
+                self.debug_writer = DebugImageWriter(os.path.join(directory, f"level{level}"),
+                                                     max_queue=len(frames) * 8, image_format=settings[1].image_format)
+                start = time.perf_counter()
+                for frame in frames:
+                    frame = frame.copy()  # 新的畫面物件：不沿用同一 tick 的結果與已複製的 debug 影像
+                    frame.index = self.frame_count = self.frame_count + 1
+                    self.find_objects(self.monster_templates, threshold=0.7, frame=frame)
+                    self.find_objects(self.rope_templates, threshold=self.rope_threshold, frame=frame)
+                detect_ms = (time.perf_counter() - start) / len(frames) * 1000
+                queued = self.debug_writer.submitted
+                start = time.perf_counter()
+                self.debug_writer.flush()
+                write_ms = (time.perf_counter() - start) * 1000
+                self.debug_writer.close()
+                results[level] = {'detect_ms': detect_ms, 'queued': queued, 'written': self.debug_writer.written,
+                                  'flush_ms': write_ms}
+        finally:
+            self.debug_level, self.debug_writer, self.use_dirty_regions, self.use_tracking = settings
+            self.debug_states = {}
+        
+        baseline = results[0]['detect_ms']
+        for level, result in results.items():
+            overhead = result['detect_ms'] - baseline
+            print(f"  等級 {level}: 偵測 {result['detect_ms']:.2f} ms/張（+{overhead:.2f} ms）, "
+                  f"排入 {result['queued']} 張, 寫入 {result['written']} 張, 背景寫完還需 {result['flush_ms']:.0f} ms")
+        print(f"測試圖像保存在 {directory}/（可刪除）")
+        print("=" * 60)
+        return results
+    
+    def benchmark_recording(self, frame_count=60, directory='benchmark_session'):
+        """錄製格式效能測試：每張 PNG vs 分段錄製檔（各壓縮方式）的寫入速度、大小與隨機讀取速度"""
+        print("錄製格式效能測試")
+        print("=" * 60)
+        
+        frames = self.collect_benchmark_frames(frame_count)
+        if not frames:
+            print("❌ 沒有可用的畫面")
+            return None
+        print(f"使用 {len(frames)} 張畫面，大小 {frames[0].size}")
+        
+        results = {}
+        png_dir = os.path.join(directory, 'png')
+        os.makedirs(png_dir, exist_ok=True)
+        start = time.perf_counter()
+        png_bytes = 0
+        for i, frame in enumerate(frames):
+            path = os.path.join(png_dir, f"{i:06d}.png")
+            frame.save(path)
+            png_bytes += os.path.getsize(path)
+        results['png'] = {'write_ms': (time.perf_counter() - start) / len(frames) * 1000, 'mb': png_bytes / 1024 ** 2}
+        start = time.perf_counter()
+        for i in range(len(frames)):
+            cv2.imread(os.path.join(png_dir, f"{i:06d}.png"), cv2.IMREAD_UNCHANGED)
+        results['png']['read_ms'] = (time.perf_counter() - start) / len(frames) * 1000
+        
+        rng = np.random.default_rng(0)
+        for compression in ['raw', 'zlib', 'delta']:
+            session_dir = os.path.join(directory, compression)
+            recorder = SessionRecorder(session_dir, compression=compression, max_queue=len(frames))
+            start = time.perf_counter()
+            for frame in frames:
+                recorder.append(frame)
+            append_ms = (time.perf_counter() - start) / len(frames) * 1000  # 控制迴圈每個 tick 的成本
+            recorder.close()
+            write_ms = (time.perf_counter() - start) / len(frames) * 1000
+            
+            reader = SessionReader(session_dir)
+            start = time.perf_counter()
+            for frame in reader.frames():
+                frame.gray
+            sequential_ms = (time.perf_counter() - start) / len(reader) * 1000
+            positions = rng.integers(0, len(reader), min(20, len(reader)))
+            start = time.perf_counter()
+            for position in positions:
+                reader.frame_at(int(position))
+            seek_ms = (time.perf_counter() - start) / len(positions) * 1000
+            results[compression] = {'write_ms': write_ms, 'append_ms': append_ms,
+                                    'mb': recorder.bytes_written / 1024 ** 2,
+                                    'read_ms': sequential_ms, 'seek_ms': seek_ms}
+        
+        for name, result in results.items():
+            seek = f", 隨機跳轉 {result['seek_ms']:.2f} ms" if 'seek_ms' in result else ""
+            append = f"（迴圈中 {result['append_ms']:.2f} ms）" if 'append_ms' in result else ""
+            print(f"  {name:5s}: 寫入 {result['write_ms']:.2f} ms/張{append}, 大小 {result['mb']:.1f} MB, "
+                  f"依序讀取 {result['read_ms']:.2f} ms/張{seek}")
+        print(f"測試檔案保存在 {directory}/（可刪除）")
+        print("=" * 60)
+        return results
+    
+    def benchmark_fft_engine(self, template_counts=(1, 4, 16, 32, 64), template_size=(32, 48)):
+        """比對引擎效能測試：模板數量增加時 cv2.matchTemplate 與 FFT 引擎的成本
+        
+        從畫面隨機裁切出 template_size (寬, 高) 的區塊當作模板（模擬同尺寸的動畫影格），
+        同時檢查 FFT 結果與 TM_CCOEFF_NORMED 的最大誤差。
+        """
+        print("FFT 批次相關運算效能測試")
+        print("=" * 60)
+        
+        frames = self.collect_benchmark_frames(1)
+        if not frames:
+            print("❌ 沒有可用的畫面")
+            return None
+        frame = frames[0]
+        gray = frame.gray
+        frame_width, frame_height = frame.size
+        template_width, template_height = template_size
+        
+        rng = np.random.default_rng(0)
+        variants = []
+        for i in range(max(template_counts)):
+            x = int(rng.integers(0, frame_width - template_width))
+            y = int(rng.integers(0, frame_height - template_height))
+            crop = gray[y:y + template_height, x:x + template_width].copy()
+            variants.append(TemplatePyramid(crop, (1.0,), f"benchmark_{i}").get(1.0))
+        
+        print(f"畫面: {frame_width}x{frame_height}，模板: {template_width}x{template_height}")
+        results = {}
+        for count in template_counts:
+            subset = variants[:count]
+            
+            start = time.perf_counter()
+            reference = [cv2.matchTemplate(gray, variant.image, cv2.TM_CCOEFF_NORMED) for variant in subset]
+            opencv_time = time.perf_counter() - start
+            
+            engine = FFTCorrelationEngine()  # 不使用上一輪快取的模板頻譜
+            start = time.perf_counter()
+            state = engine.prepare(gray)
+            fft_results = [engine.match(state, variant) for variant in subset]
+            fft_time = time.perf_counter() - start
+            
+            max_error = max(float(np.abs(a - b).max()) for a, b in zip(reference, fft_results))
+            results[count] = {'opencv_ms': opencv_time * 1000, 'fft_ms': fft_time * 1000, 'max_error': max_error}
+            print(f"  {count:3d} 個模板: matchTemplate {opencv_time * 1000:8.1f} ms, "
+                  f"FFT {fft_time * 1000:8.1f} ms ({opencv_time / fft_time:.1f}x), 最大誤差 {max_error:.2e}")
+        
+        print("註: FFT 時間包含每張畫面一次的頻譜與積分圖計算")
+        print("=" * 60)
+        return results
+    
     def test_color_detection(self):
         """測試顏色偵測功能 - 實驗性功能"""
         print("顏色偵測測試（實驗性功能）")
@@ -1848,50 +5953,23 @@ class AutoTrainingBot:
             time.sleep(1)
         
         # 截取螢幕
-        screenshot = pyautogui.screenshot()
-        screenshot_np = cv2.cvtColor(np.array(screenshot), cv2.COLOR_RGB2BGR)
+        frame = self.capture_frame()
+        if not frame.has_color:
+            print("❌ 目前的畫面來源只有灰階（例如 --gray），無法做顏色偵測")
+            return
+        screenshot_np = frame.bgr
         screenshot_hsv = cv2.cvtColor(screenshot_np, cv2.COLOR_BGR2HSV)
         
         print("分析螢幕顏色分布...")
         
-        # 定義一些常見的遊戲物件顏色範圍（HSV）
-        color_ranges = {
-            '怪物紅色': {
-                'lower': np.array([0, 100, 100]),    # 紅色下限
-                'upper': np.array([10, 255, 255]),   # 紅色上限
-                'color': (0, 0, 255)  # BGR中的紅色
-            },
-            '怪物橙色': {
-                'lower': np.array([10, 100, 100]),   # 橙色下限
-                'upper': np.array([25, 255, 255]),   # 橙色上限
-                'color': (0, 165, 255)  # BGR中的橙色
-            },
-            '繩子棕色': {
-                'lower': np.array([8, 50, 50]),      # 棕色下限
-                'upper': np.array([20, 200, 200]),   # 棕色上限
-                'color': (42, 42, 165)  # BGR中的棕色
-            },
-            'HP條綠色': {
-                'lower': np.array([40, 50, 50]),     # 綠色下限
-                'upper': np.array([80, 255, 255]),   # 綠色上限
-                'color': (0, 255, 0)  # BGR中的綠色
-            },
-            '文字白色': {
-                'lower': np.array([0, 0, 200]),      # 白色下限
-                'upper': np.array([180, 30, 255]),   # 白色上限
-                'color': (255, 255, 255)  # BGR中的白色
-            }
-        }
+        # 常見的遊戲物件顏色範圍（HSV）
+        color_ranges = COLOR_RANGES
         
         # 創建結果圖像
         result_image = screenshot_np.copy()
         
         # 保存結果
         timestamp = time.strftime("%Y%m%d_%H%M%S")
-        screens_dir = 'screens'
-        if not os.path.exists(screens_dir):
-            os.makedirs(screens_dir)
-        
         detected_objects = {}
         
         for color_name, color_info in color_ranges.items():
@@ -1933,20 +6011,19 @@ class AutoTrainingBot:
             print(f"  找到 {len(significant_contours)} 個 {color_name} 區域")
             
             # 保存單獨的遮罩圖像
-            mask_path = os.path.join(screens_dir, f"color_mask_{color_name}_{timestamp}.png")
-            cv2.imwrite(mask_path, mask)
+            self.debug_writer.submit(f"color_mask_{color_name}", mask, dedup=False)
         
         # 保存標記結果
-        result_path = os.path.join(screens_dir, f"color_detection_result_{timestamp}.png")
-        cv2.imwrite(result_path, result_image)
+        result_job = self.debug_writer.submit("color_detection_result", result_image, dedup=False)
+        result_job.wait(timeout=5.0)
         
         print(f"\n顏色偵測總結:")
         for color_name, count in detected_objects.items():
             print(f"  {color_name}: {count} 個區域")
         
-        print(f"\n圖像已保存:")
-        print(f"  標記結果: {result_path}")
-        print(f"  各顏色遮罩: screens/color_mask_*_{timestamp}.png")
+        print(f"\n圖像:")
+        print(f"  標記結果: {result_job}")
+        print(f"  各顏色遮罩: screens/color_mask_*_{timestamp}_*.png")
         
         # 分析結果並提供建議
         print(f"\n分析與建議:")
@@ -1976,7 +6053,70 @@ class AutoTrainingBot:
 
 # 使用範例
 if __name__ == "__main__":
-    bot = AutoTrainingBot()
+    # 可選：python macro_smart.py <重播資料夾> [fps] - 使用錄製的截圖離線執行
+    parser = argparse.ArgumentParser(description="楓之谷自動練功腳本")
+    parser.add_argument('replay', nargs='?', help="重播截圖資料夾（例如 screens）或錄製檔資料夾")
+    parser.add_argument('fps', nargs='?', type=float, help="重播速率，不指定則不限速")
+    parser.add_argument('--capture', choices=['pyautogui', 'mss'], default='pyautogui',
+                        help="即時截圖方式（mss 為高速擷取）")
+    parser.add_argument('--gray', action='store_true',
+                        help="mss 只擷取灰階畫面（較快，但顏色預篩選與小地圖讀取無法使用）")
+    parser.add_argument('--capture-thread', action='store_true',
+                        help="自動練功時使用背景執行緒持續擷取畫面")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="平行比對的執行緒數（1 = 依序比對）")
+    parser.add_argument('--processes', type=int, default=0,
+                        help="偵測行程池的行程數（0 = 不使用）")
+    parser.add_argument('--debug-level', type=int, choices=[0, 1, 2], default=1,
+                        help="debug 等級（0 = 不保存也不標記, 1 = 抽樣保存, 2 = 每個 tick 保存並輸出偵測過程）")
+    parser.add_argument('--debug-interval', type=int, default=10,
+                        help="每幾個 tick 保存一次偵測 debug 圖像（0 = 只在偵測數量改變時保存）")
+    parser.add_argument('--debug-format', choices=['png', 'jpg'], default='png',
+                        help="debug 圖像格式（jpg 編碼較快，但重播只讀取 png）")
+    parser.add_argument('--debug-budget', type=int, default=2048,
+                        help="screens/ 資料夾的容量上限（MB），超過時刪除最舊的圖像")
+    parser.add_argument('--record', metavar='DIR',
+                        help="把每個 tick 擷取的畫面錄製到 DIR（分段壓縮錄製檔）")
+    parser.add_argument('--record-compression', choices=['delta', 'zlib', 'raw'], default='delta',
+                        help="錄製檔壓縮方式（delta 最小，raw 重播時不需解壓）")
+    parser.add_argument('--seek', type=int, metavar='TICK',
+                        help="重播錄製檔時從指定的 tick 開始")
+    parser.add_argument('--benchmark', choices=sorted(AutoTrainingBot.BENCHMARKS),
+                        help="直接執行效能測試後結束（可搭配 xvfb-run 使用）")
+    args = parser.parse_args()
+    
+    frame_source = None
+    if args.replay and os.path.exists(os.path.join(args.replay, 'session.json')):
+        frame_source = SessionFrameSource(args.replay, fps=args.fps, start_tick=args.seek)
+        print(f"使用錄製檔重播: {args.replay} ({len(frame_source.reader)} 張, "
+              f"從第 {frame_source.reader.ticks[frame_source.position]} tick 開始, fps: {args.fps or '不限'})")
+    elif args.replay:
+        frame_source = ReplayFrameSource(args.replay, fps=args.fps)
+        print(f"使用重播畫面來源: {args.replay} ({len(frame_source.files)} 張, fps: {args.fps or '不限'})")
+    elif args.capture == 'mss':
+        frame_source = MSSFrameSource('gray' if args.gray else 'bgr')
+        print(f"使用 mss 高速截圖（{'灰階' if args.gray else 'BGR'}）")
+        if args.gray:
+            print("⚠️  灰階擷取沒有彩色畫面：顏色預篩選改為比對整張畫面，小地圖需要額外擷取")
+    
+    bot = AutoTrainingBot(frame_source=frame_source)
+    bot.use_capture_thread = args.capture_thread
+    bot.capture_mode = 'gray' if args.gray else 'bgr'
+    bot.match_workers = args.workers
+    bot.detection_processes = args.processes
+    bot.debug_level = args.debug_level
+    bot.debug_image_interval = args.debug_interval
+    bot.debug_writer.image_format = args.debug_format
+    bot.debug_writer.max_bytes = args.debug_budget * 1024 ** 2
+    atexit.register(bot.debug_writer.close)  # 結束前寫完佇列中的 debug 圖像
+    atexit.register(bot.map_cache.flush)  # 結束前寫入還沒保存的地圖快取
+    if args.record:
+        bot.start_recording(args.record, compression=args.record_compression)
+        atexit.register(bot.stop_recording)
+    
+    if args.benchmark:
+        bot.run_benchmark(args.benchmark)
+        sys.exit(0)
     
     print("楓之谷自動練功腳本")
     print("=" * 50)
@@ -1992,11 +6132,12 @@ if __name__ == "__main__":
     print("9. 配置下繩子策略")
     print("10. 偵錯下繩子問題（詳細分析）")
     print("11. 開始自動練功")
+    print("12. 效能測試")
     print("=" * 50)
     print("角色在繩子上偵測問題提示：使用選項6和選項8進行診斷")
     print("=" * 50)
     
-    choice = input("請選擇 (1-11): ").strip()
+    choice = input("請選擇 (1-12): ").strip()
     
     # 不同選項需要不同的準備說明
     if choice in ['1', '2', '7', '10']:
@@ -2015,148 +6156,163 @@ if __name__ == "__main__":
             time.sleep(1)
         print("開始執行！")
     
-    if choice == '1':
-        bot.test_keyboard_controls()
+    try:
+        if choice == '1':
+            bot.test_keyboard_controls()
         
-    elif choice == '2':
-        bot.simple_key_test()
+        elif choice == '2':
+            bot.simple_key_test()
         
-    elif choice == '3':
-        print("測試物件偵測（基本）...")
-        monsters = bot.find_objects(bot.monster_templates, debug=True)
-        ropes = bot.find_objects(bot.rope_templates, debug=True)
-        platforms = bot.find_objects(bot.platform_templates, debug=True)
+        elif choice == '3':
+            print("測試物件偵測（基本）...")
+            monsters = bot.find_objects(bot.monster_templates, debug=True)
+            ropes = bot.find_objects(bot.rope_templates, debug=True)
+            platforms = bot.find_objects(bot.platform_templates, debug=True)
         
-        print(f"\n總結: 偵測到 {len(monsters)} 怪物, {len(ropes)} 繩子, {len(platforms)} 平台")
+            print(f"\n總結: 偵測到 {len(monsters)} 怪物, {len(ropes)} 繩子, {len(platforms)} 平台")
         
-        if monsters:
-            print("怪物列表:")
-            for i, monster in enumerate(monsters):
-                print(f"  {i+1}. {monster['name']} - 信心度: {monster['confidence']:.3f} - 位置: {monster['position']}")
+            if monsters:
+                print("怪物列表:")
+                for i, monster in enumerate(monsters):
+                    print(f"  {i+1}. {monster['name']} - 信心度: {monster['confidence']:.3f} - 位置: {monster['position']}")
             
-            target = bot.select_target_monster(monsters)
-            if target:
-                print(f"\n選中目標: {target['name']} 優先級: {target.get('priority', 5)}")
+                target = bot.select_target_monster(monsters)
+                if target:
+                    print(f"\n選中目標: {target['name']} 優先級: {target.get('priority', 5)}")
         
-        if ropes:
-            print("繩子列表:")
-            for i, rope in enumerate(ropes):
-                print(f"  {i+1}. {rope['name']} - 信心度: {rope['confidence']:.3f} - 位置: {rope['position']}")
+            if ropes:
+                print("繩子列表:")
+                for i, rope in enumerate(ropes):
+                    print(f"  {i+1}. {rope['name']} - 信心度: {rope['confidence']:.3f} - 位置: {rope['position']}")
     
-    elif choice == '4':
-        print("偵錯物件偵測（詳細分析）...")
-        bot.debug_object_detection()
+        elif choice == '4':
+            print("偵錯物件偵測（詳細分析）...")
+            bot.debug_object_detection()
     
-    elif choice == '5':
-        print("測試顏色偵測（實驗性功能）...")
-        bot.test_color_detection()
+        elif choice == '5':
+            print("測試顏色偵測（實驗性功能）...")
+            bot.test_color_detection()
 
-    elif choice == '6':
-        print("測試繩子偵測...")
-        print("=" * 50)
-        
-        # 測試玩家在繩子上的偵測
-        on_rope, rope_info = bot.detect_player_on_rope()
-        if on_rope:
-            print(f"✅ 玩家在繩子上!")
-            if rope_info:
-                print(f"   詳細資訊: {rope_info}")
-        else:
-            print("❌ 玩家不在繩子上")
+        elif choice == '6':
+            print("測試繩子偵測...")
+            print("=" * 50)
+        
+            # 測試玩家在繩子上的偵測
+            on_rope, rope_info = bot.detect_player_on_rope()
+            if on_rope:
+                print(f"✅ 玩家在繩子上!")
+                if rope_info:
+                    print(f"   詳細資訊: {rope_info}")
+            else:
+                print("❌ 玩家不在繩子上")
         
-        print("-" * 30)
+            print("-" * 30)
         
-        # 測試繩子模板偵測
-        ropes = bot.find_objects(bot.rope_templates, debug=True)
-        print(f"偵測到 {len(ropes)} 條繩子:")
-        for i, rope in enumerate(ropes):
-            print(f"  {i+1}. {rope['name']} - 位置: {rope['position']} - 信心度: {rope['confidence']:.2f}")
+            # 測試繩子模板偵測
+            ropes = bot.find_objects(bot.rope_templates, debug=True)
+            print(f"偵測到 {len(ropes)} 條繩子:")
+            for i, rope in enumerate(ropes):
+                print(f"  {i+1}. {rope['name']} - 位置: {rope['position']} - 信心度: {rope['confidence']:.2f}")
         
-        print("-" * 30)
+            print("-" * 30)
         
-        # 測試平台偵測
-        monsters = bot.find_objects(bot.monster_templates, debug=True)
-        print(f"偵測到 {len(monsters)} 隻怪物:")
-        for monster in monsters:
-            same_platform = bot.check_same_platform(monster['position'])
-            platform_status = "同一平台" if same_platform else "不同平台"
-            print(f"  怪物 {monster['name']} - {platform_status} - 位置: {monster['position']}")
+            # 測試平台偵測
+            monsters = bot.find_objects(bot.monster_templates, debug=True)
+            print(f"偵測到 {len(monsters)} 隻怪物:")
+            for monster in monsters:
+                same_platform = bot.check_same_platform(monster['position'])
+                platform_status = "同一平台" if same_platform else "不同平台"
+                print(f"  怪物 {monster['name']} - {platform_status} - 位置: {monster['position']}")
         
-        print("=" * 50)
+            print("=" * 50)
 
-    elif choice == '7':
-        print("測試下繩子方法...")
-        bot.test_climb_down_methods()
+        elif choice == '7':
+            print("測試下繩子方法...")
+            bot.test_climb_down_methods()
 
-    elif choice == '8':
-        print("詳細測試繩子偵測...")
-        print("請輸入要測試的信心度閾值 (0.1-1.0，建議從 0.5 開始):")
-        try:
-            threshold = float(input("閾值: "))
-            if 0.1 <= threshold <= 1.0:
-                bot.test_rope_detection_with_threshold(threshold)
-            else:
-                print("閾值必須在 0.1 到 1.0 之間")
-        except ValueError:
-            print("無效的閾值，使用預設值 0.7")
-            bot.test_rope_detection_with_threshold(0.7)
+        elif choice == '8':
+            print("詳細測試繩子偵測...")
+            print("請輸入要測試的信心度閾值 (0.1-1.0，建議從 0.5 開始):")
+            try:
+                threshold = float(input("閾值: "))
+                if 0.1 <= threshold <= 1.0:
+                    bot.test_rope_detection_with_threshold(threshold)
+                else:
+                    print("閾值必須在 0.1 到 1.0 之間")
+            except ValueError:
+                print("無效的閾值，使用預設值 0.7")
+                bot.test_rope_detection_with_threshold(0.7)
 
-    elif choice == '9':
-        print("配置下繩子策略...")
-        print("=" * 50)
-        print("選擇下繩子策略:")
-        print("1. 僅使用按住下鍵（推薦，兼容性最好）")
-        print("2. 智能嘗試多種方法（可能失敗，但覆蓋面廣）")
-        print("3. 測試並選擇最佳方法")
-        
-        strategy_choice = input("請選擇策略 (1/2/3): ").strip()
-        
-        if strategy_choice == '1':
-            print("✅ 已設定為僅使用按住下鍵方法")
-            print("此方法兼容性最好，適合大部分楓之谷版本")
-            bot.climb_down_strategy = 'simple'
-            
-        elif strategy_choice == '2':
-            print("✅ 已設定為智能嘗試多種方法")
-            print("將嘗試：按住下鍵 → 向左跳 → 向右跳")
-            print("⚠️  注意：部分版本可能不支援同時按兩鍵")
-            bot.climb_down_strategy = 'smart'
-            
-        elif strategy_choice == '3':
-            print("即將測試所有下繩子方法...")
-            successful_methods = bot.test_climb_down_methods()
-            if successful_methods:
-                print(f"\n推薦策略: 使用 {', '.join(successful_methods)} 方法")
-                if 'down' in successful_methods:
-                    print("建議：優先使用按住下鍵方法（兼容性最好）")
-                    bot.climb_down_strategy = 'simple'
-                elif len(successful_methods) > 1:
-                    print("建議：使用智能策略嘗試多種方法")
-                    bot.climb_down_strategy = 'smart'
+        elif choice == '9':
+            print("配置下繩子策略...")
+            print("=" * 50)
+            print("選擇下繩子策略:")
+            print("1. 僅使用按住下鍵（推薦，兼容性最好）")
+            print("2. 智能嘗試多種方法（可能失敗，但覆蓋面廣）")
+            print("3. 測試並選擇最佳方法")
+        
+            strategy_choice = input("請選擇策略 (1/2/3): ").strip()
+        
+            if strategy_choice == '1':
+                print("✅ 已設定為僅使用按住下鍵方法")
+                print("此方法兼容性最好，適合大部分楓之谷版本")
+                bot.climb_down_strategy = 'simple'
+            
+            elif strategy_choice == '2':
+                print("✅ 已設定為智能嘗試多種方法")
+                print("將嘗試：按住下鍵 → 向左跳 → 向右跳")
+                print("⚠️  注意：部分版本可能不支援同時按兩鍵")
+                bot.climb_down_strategy = 'smart'
+            
+            elif strategy_choice == '3':
+                print("即將測試所有下繩子方法...")
+                successful_methods = bot.test_climb_down_methods()
+                if successful_methods:
+                    print(f"\n推薦策略: 使用 {', '.join(successful_methods)} 方法")
+                    if 'down' in successful_methods:
+                        print("建議：優先使用按住下鍵方法（兼容性最好）")
+                        bot.climb_down_strategy = 'simple'
+                    elif len(successful_methods) > 1:
+                        print("建議：使用智能策略嘗試多種方法")
+                        bot.climb_down_strategy = 'smart'
+                    else:
+                        bot.climb_down_strategy = 'simple'
                 else:
+                    print("建議：默認使用按住下鍵方法")
                     bot.climb_down_strategy = 'simple'
             else:
-                print("建議：默認使用按住下鍵方法")
-                bot.climb_down_strategy = 'simple'
-        else:
-            print("無效選擇，保持預設策略")
+                print("無效選擇，保持預設策略")
         
-        print("=" * 50)
+            print("=" * 50)
 
-    elif choice == '10':
-        print("偵錯下繩子問題...")
-        bot.debug_climb_down_test()
+        elif choice == '10':
+            print("偵錯下繩子問題...")
+            bot.debug_climb_down_test()
 
-    elif choice == '11':
-        print("即將開始自動練功...")
-        bot.show_current_settings()
-        print("請確保角色在安全位置（如繩子上或平台上）")
-        print("最後倒數計時：")
-        for i in range(5, 0, -1):
-            print(f"  {i} 秒後開始自動練功...")
-            time.sleep(1)
-        print("開始自動練功！")
-        bot.auto_training_loop()
+        elif choice == '11':
+            print("即將開始自動練功...")
+            bot.show_current_settings()
+            print("請確保角色在安全位置（如繩子上或平台上）")
+            print("最後倒數計時：")
+            for i in range(5, 0, -1):
+                print(f"  {i} 秒後開始自動練功...")
+                time.sleep(1)
+            print("開始自動練功！")
+            bot.auto_training_loop()
     
-    else:
-        print("無效的選擇")
\ No newline at end of file
+        elif choice == '12':
+            print("效能測試...")
+            print("=" * 50)
+            names = sorted(bot.BENCHMARKS)
+            for i, name in enumerate(names):
+                print(f"{i+1}. {name}")
+            bench_choice = input(f"請選擇 (1-{len(names)}): ").strip()
+            if bench_choice.isdigit() and 1 <= int(bench_choice) <= len(names):
+                bot.run_benchmark(names[int(bench_choice) - 1])
+            else:
+                print("無效選擇")
+    
+        else:
+            print("無效的選擇")
+    except FrameSourceExhausted:
+        print("❌ 畫面來源已結束（重播完畢），無法繼續測試")